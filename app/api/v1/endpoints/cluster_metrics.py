@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from typing import Any, Dict, List
 
 from fastapi import APIRouter, Query
@@ -9,11 +10,7 @@ from app.core.config import settings
 from app.services.cluster_metrics import ClusterMetricsTracker
 from app.services.chroma_service import ChromaClientProvider, collection_name_for_os
 from app.services.clustering_service import _single_pass_cluster
-from app.services.cluster_metrics import (
-    calculate_silhouette_score,
-    calculate_cohesion,
-    calculate_separation,
-)
+from app.services.cluster_metrics import compute_quality_metrics
 
 router = APIRouter()
 
@@ -166,11 +163,9 @@ async def compute_current_quality(
     ms = min_size if min_size is not None else settings.CLUSTER_MIN_SIZE
 
     # Cluster and compute metrics
-    clusters, _centroids = _single_pass_cluster(t_embs, threshold=thr, min_size=ms)
+    clusters, _centroids = await asyncio.to_thread(_single_pass_cluster, t_embs, thr, ms)
 
-    silhouette = calculate_silhouette_score(clusters, t_embs)
-    cohesion = calculate_cohesion(clusters, t_embs)
-    separation = calculate_separation(clusters, t_embs)
+    quality = await asyncio.to_thread(compute_quality_metrics, clusters, t_embs)
 
     sizes = [len(c) for c in clusters]
 
@@ -179,26 +174,31 @@ async def compute_current_quality(
         "params": {"threshold": thr, "min_size": ms, "include_logs_samples": include_logs_samples},
         "num_clusters": len(clusters),
         "num_points": len(t_embs),
-        "silhouette_score": silhouette,
-        "cohesion": cohesion,
-        "separation": separation,
+        "silhouette_score": quality["silhouette_score"],
+        "cohesion": quality["cohesion"],
+        "separation": quality["separation"],
+        "silhouette_ci95": quality["silhouette_ci95"],
+        "metrics_mode": quality["metrics_mode"],
+        "metrics_sample_size": quality["metrics_sample_size"],
         "cluster_sizes": sizes,
     }
 
 
 @router.get("/llm-usage", response_model=Dict[str, Any])
 async def get_llm_usage(
-    hours: int = Query(24, ge=1, le=168, description="Hours of data to retrieve")
+    hours: int = Query(24, ge=1, le=2160, description="Hours of data to retrieve"),
+    resolution: str = Query("hour", pattern="^(minute|hour|day)$", description="Breakdown bucket size"),
 ) -> Dict[str, Any]:
     """Get LLM usage metrics including costs, latency, and confidence.
     
-    Returns aggregated metrics across all LLM calls.
+    Returns aggregated metrics across all LLM calls, broken down per minute/hour/day
+    bucket (minute buckets are kept for a day, hour buckets for 7 days).
     """
     redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
     tracker = ClusterMetricsTracker(redis_client)
     
     try:
-        metrics = await tracker.get_llm_metrics(hours=hours)
+        metrics = await tracker.get_llm_metrics(hours=hours, resolution=resolution)
         
         # Aggregate totals
         total_calls = sum(m.get("total_calls", 0) for m in metrics)
@@ -236,12 +236,51 @@ async def get_llm_usage(
                 "avg_latency_ms": round(avg_latency, 2),
             },
             "recommendations": recommendations,
+            "resolution": resolution,
             "hourly_breakdown": metrics,
         }
     finally:
         await redis_client.close()
 
 
+@router.get("/distances/{os_name}", response_model=Dict[str, Any])
+async def get_distance_percentiles(
+    os_name: str,
+    hours: int = Query(24, ge=1, le=2160, description="Hours of data to retrieve"),
+    resolution: str = Query("hour", pattern="^(minute|hour|day)$", description="Breakdown bucket size"),
+) -> Dict[str, Any]:
+    """Get p50/p90/p99 of online cluster assignment distances.
+    
+    Answered from per-bucket quantile sketches (relative error CLUSTER_METRICS_SKETCH_ACCURACY).
+    """
+    redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    tracker = ClusterMetricsTracker(redis_client)
+    
+    try:
+        return await tracker.get_distance_percentiles(os_name, hours=hours, resolution=resolution)
+    finally:
+        await redis_client.close()
+
+
+@router.get("/llm-confidence/{os_name}", response_model=Dict[str, Any])
+async def get_confidence_percentiles(
+    os_name: str,
+    hours: int = Query(24, ge=1, le=2160, description="Hours of data to retrieve"),
+    resolution: str = Query("hour", pattern="^(minute|hour|day)$", description="Breakdown bucket size"),
+) -> Dict[str, Any]:
+    """Get p50/p90/p99 of LLM classification confidence.
+    
+    Answered from per-bucket quantile sketches (relative error CLUSTER_METRICS_SKETCH_ACCURACY).
+    """
+    redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    tracker = ClusterMetricsTracker(redis_client)
+    
+    try:
+        return await tracker.get_confidence_percentiles(os_name, hours=hours, resolution=resolution)
+    finally:
+        await redis_client.close()
+
+
 @router.get("/drift/{os_name}", response_model=Dict[str, Any])
 async def get_drift_metrics(
     os_name: str,
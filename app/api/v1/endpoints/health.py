@@ -1,6 +1,9 @@
 from fastapi import APIRouter
 from datetime import datetime, timezone
 
+from app.streams.retention import retention_stats
+from app.streams.utils import stream_writer_stats
+
 router = APIRouter()
 
 
@@ -10,6 +13,8 @@ async def health() -> dict[str, object]:
     return {
         "status": "ok",
         "time": datetime.now(timezone.utc).isoformat(),
+        "stream_retention": retention_stats(),
+        "stream_writer": stream_writer_stats(),
     }
 
 
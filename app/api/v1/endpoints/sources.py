@@ -5,15 +5,26 @@ from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
 import secrets
 import uuid
+import redis.asyncio as aioredis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db_session
+from app.core.config import settings
 from app.crud.crud_data_source import crud_data_source
 from app.schemas.data_source import DataSourceCreate, DataSourceOut, DataSourceUpdate
+from app.services.source_config_cache import publish_source_invalidation
+from app.services.telegraf_ingest import invalidate_telegraf_index
 from app.streams.producer_manager import manager
 
 
 router = APIRouter()
+redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+
+
+async def _source_changed(source_id: int) -> None:
+    # Token index first, so replicas that reload after the broadcast see the new state
+    await invalidate_telegraf_index(redis)
+    await publish_source_invalidation(redis, source_id)
 
 
 @router.get("", response_model=list[DataSourceOut])
@@ -41,6 +52,8 @@ async def create_source(
         body = DataSourceCreate(name=body.name, type=body.type, enabled=body.enabled, config=cfg)
 
     obj = await crud_data_source.create(db, obj_in=body)
+    # Drop any cached "no such source" entry for the new id
+    await _source_changed(obj.id)
     # Only start producer-backed sources
     if obj.enabled and obj.type not in {"telegraf"}:
         manager.start(obj.id, obj.type, obj.config)
@@ -68,6 +81,7 @@ async def update_source(
     if exists is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data source not found")
     updated = await crud_data_source.update(db, db_obj=exists, obj_in=body)
+    await _source_changed(updated.id)
 
     # Reconcile running instance (skip non-producer types like telegraf)
     await manager.stop(updated.id)
@@ -86,6 +100,7 @@ async def delete_source(
     deleted = await crud_data_source.remove(db, source_id=source_id)
     if deleted is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data source not found")
+    await _source_changed(source_id)
     return {"status": "ok"}
 
 
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Header, HTTPException, status, Depends
+from fastapi import APIRouter, Header, HTTPException, Request, status
 from pydantic import BaseModel, Field
 
 from app.services.otel_exporter import get_export_status, set_export_enabled
+from app.services.embedding import get_embedding_cache_stats
 from app.services.normalizers.dcim_http import get_redfish_status, set_redfish_enabled
 from app.core.logging_config import get_request_logs_status, set_request_logs_enabled
 from app.core.config import get_settings
@@ -11,15 +12,17 @@ from app.streams.automations import get_status as get_auto_status, set_dry_run a
 from app.rules.automations import get_rules as rules_get, upsert_rule as rules_upsert, delete_rule as rules_delete
 import redis.asyncio as aioredis
 from typing import Any
-import json as _json
 import json
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.api.deps import get_db_session
-from app.models.data_source import DataSource
+import time
+from app.services.telegraf_ingest import TokenIndexUnavailable, decode_body, get_telegraf_index
+from app.streams.metrics_stream import METRICS_STREAM, decode_entry
+from app.streams.retention import xadd_args
 
 
 router = APIRouter()
+settings = get_settings()
+# Shared pooled client for all telemetry endpoints (was one new client per request)
+redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
 
 
 class ExportToggle(BaseModel):
@@ -36,6 +39,11 @@ async def export_toggle(body: ExportToggle) -> dict[str, object]:
     return set_export_enabled(body.enabled)
 
 
+@router.get("/embedding-cache/status")
+async def embedding_cache_status() -> dict[str, object]:
+    return get_embedding_cache_stats()
+
+
 @router.get("/redfish/status")
 async def redfish_status() -> dict[str, object]:
     return get_redfish_status()
@@ -61,35 +69,38 @@ async def metrics_recent(limit: int = 100, vendor: str | None = None, schema: st
     """Return recent normalized metric points from the internal metrics stream.
     Optional filters: vendor (e.g., 'dcim_http', 'snmp') or schema ('redfish').
     """
-    settings = get_settings()
-    redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-    # fetch recent entries
-    rows = await redis.xrevrange("metrics", count=max(1, min(limit, 1000)))
+    # fetch recent entries; packed entries hold many points, so stop once `limit` points are in
+    limit = max(1, min(limit, 1000))
+    rows = await redis.xrevrange(METRICS_STREAM, count=limit)
     items: list[dict[str, Any]] = []
     for _id, fields in rows:
         try:
-            resource = _json.loads(fields.get("resource") or "{}")
-        except Exception:
-            resource = {}
-        try:
-            attributes = _json.loads(fields.get("attributes") or "{}")
+            points = decode_entry(fields)
         except Exception:
-            attributes = {}
-        obj = {
-            "id": _id,
-            "name": fields.get("name"),
-            "type": fields.get("type"),
-            "value": fields.get("value"),
-            "unit": fields.get("unit"),
-            "resource": resource,
-            "attributes": attributes,
-        }
-        # filters
-        if vendor and (resource.get("vendor") != vendor):
-            continue
-        if schema == "redfish" and not str(obj.get("name") or "").startswith("redfish."):
             continue
-        items.append(obj)
+        packed = len(points) > 1 or fields.get("encoding") == "packed"
+        # newest first, matching xrevrange order
+        for i in range(len(points) - 1, -1, -1):
+            point = points[i]
+            resource = point.get("resource") if isinstance(point.get("resource"), dict) else {}
+            obj = {
+                "id": f"{_id}#{i}" if packed else _id,
+                "name": point.get("name"),
+                "type": point.get("type"),
+                "value": point.get("value"),
+                "unit": point.get("unit"),
+                "resource": resource,
+                "attributes": point.get("attributes") or {},
+            }
+            # filters
+            if vendor and (resource.get("vendor") != vendor):
+                continue
+            if schema == "redfish" and not str(obj.get("name") or "").startswith("redfish."):
+                continue
+            items.append(obj)
+        if len(items) >= limit:
+            break
+    items = items[:limit]
     # reverse to chronological order
     items.reverse()
     return {"items": items}
@@ -149,37 +160,31 @@ class TelegrafBatch(BaseModel):
 
 @router.post("/telegraf")
 async def ingest_telegraf(
-    batch: TelegrafBatch,
+    request: Request,
     x_telegraf_token: str | None = Header(default=None),
     x_agent_id: str | None = Header(default=None),
-    db: AsyncSession = Depends(get_db_session),
 ) -> dict[str, Any]:
     """Accept Telegraf metrics and enqueue them to the central logs stream.
 
+    - Bodies may be Telegraf JSON ({"metrics": [...]}) or InfluxDB line protocol, optionally gzip-encoded.
     - Log-like metrics (e.g., macos_log) are written as plain log lines for parsing/template routing.
     - Numeric metrics are written as JSON payloads with source kind 'telegraf' for normalization/export.
+    - The whole batch is enqueued in one pipelined round-trip.
     """
-    settings = get_settings()
-    redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-
     # Authenticate agent via DataSource(type=telegraf, enabled=true) using token in config
     if not x_telegraf_token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing telegraf token")
 
-    # Load telegraf agents and find match by token (and optional agent_id)
-    res = await db.execute(select(DataSource).where(DataSource.type == "telegraf", DataSource.enabled.is_(True)))
-    agents = [row for row in res.scalars().all()]
-    matched: DataSource | None = None
-    for a in agents:
-        cfg = a.config or {}
-        tok = str(cfg.get("token") or "")
-        if not tok or tok != x_telegraf_token:
-            continue
-        aid = str(cfg.get("agent_id") or "")
-        if aid and x_agent_id and aid != x_agent_id:
-            continue
-        matched = a
-        break
+    # Hashed-token index (memory, then Redis, rebuilt from the DB only when missing)
+    try:
+        matched = await get_telegraf_index().lookup(redis, x_telegraf_token, x_agent_id)
+    except TokenIndexUnavailable as exc:
+        # Not a rejection: Telegraf keeps the batch and retries it
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(exc),
+            headers={"Retry-After": str(max(1, int(settings.TELEGRAF_AUTH_REBUILD_MIN_SEC)))},
+        )
     if matched is None:
         # incremental metric for failed auth
         try:
@@ -188,13 +193,32 @@ async def ingest_telegraf(
             pass
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="invalid or disabled token")
 
+    try:
+        raw_metrics = decode_body(
+            await request.body(),
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding"),
+        )
+        batch = TelegrafBatch(metrics=[TelegrafMetric.model_validate(m) for m in raw_metrics])
+    except Exception as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"invalid telegraf body: {exc}")
+
     # Optional host allow-list enforcement
-    allowed_hosts = (matched.config or {}).get("allowed_hosts") or []
+    allowed_hosts = matched.get("allowed_hosts") or []
     provided_hosts = {str((m.tags or {}).get("host") or "") for m in batch.metrics}
     if allowed_hosts:
         if not any(h and h in allowed_hosts for h in provided_hosts):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="host not allowed for this agent")
 
+    source_id = str(matched["id"])
+    # Map to existing OS file names so consumer routes correctly by substring
+    source_map = {
+        "macos_log": "Mac.log:telegraf",
+        "linux_log": "Linux.log:telegraf",
+        "windows_log": "Windows_2k.log:telegraf",
+        "docker_log": "Mac.log:telegraf:docker",
+    }
+    entries: list[dict[str, str]] = []
     logs_written = 0
     metrics_written = 0
 
@@ -207,22 +231,13 @@ async def ingest_telegraf(
             if isinstance(val, str) and val:
                 msg = val
 
-        if name in {"macos_log", "linux_log", "windows_log", "docker_log"} and msg:
+        if name in source_map and msg:
             # Skip docker_log entries from infrastructure containers to avoid feedback loops
             if name == "docker_log":
                 container = str((m.tags or {}).get("container_name") or "")
                 if "aiops" in container or "telegraf" in container:
                     continue
-
-            # Map to existing OS file names so consumer routes correctly by substring
-            source_map = {
-                "macos_log": "Mac.log:telegraf",
-                "linux_log": "Linux.log:telegraf",
-                "windows_log": "Windows_2k.log:telegraf",
-                "docker_log": "Mac.log:telegraf:docker",
-            }
-            source = source_map.get(name, "Mac.log:telegraf")
-            await redis.xadd("logs", {"source": source, "line": msg, "source_id": str(matched.id)})
+            entries.append({"source": source_map[name], "line": msg, "source_id": source_id})
             logs_written += 1
             continue
 
@@ -235,22 +250,25 @@ async def ingest_telegraf(
         }
         # Use source prefix 'telegraf' so consumer can normalize
         host = str((m.tags or {}).get("host") or "")
-        await redis.xadd("logs", {"source": f"telegraf:{host}", "line": json.dumps(payload), "source_id": str(matched.id)})
+        entries.append({"source": f"telegraf:{host}", "line": json.dumps(payload), "source_id": source_id})
         metrics_written += 1
 
-    # agent runtime stats
-    try:
-        key = f"telegraf:agent:{matched.id}"
-        pipe = redis.pipeline()
+    # One round-trip: stream entries plus agent runtime stats
+    trim = xadd_args("logs")
+    async with redis.pipeline(transaction=False) as pipe:
+        for entry in entries:
+            pipe.xadd("logs", entry, **trim)
+        key = f"telegraf:agent:{matched['id']}"
         pipe.hset(key, mapping={
-            "last_seen": str(int(__import__('time').time())),
-            "name": matched.name,
+            "last_seen": str(int(time.time())),
+            "name": matched.get("name") or "",
         })
         pipe.incrby(f"{key}:accepted", logs_written + metrics_written)
-        await pipe.execute()
-    except Exception:
-        pass
+        results = await pipe.execute(raise_on_error=False)
+    failed = [r for r in results[:len(entries)] if isinstance(r, Exception)]
+    if failed:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"enqueue failed for {len(failed)} metrics: {failed[0]}")
 
-    return {"accepted": len(batch.metrics), "logs_enqueued": logs_written, "metrics_enqueued": metrics_written, "source_id": matched.id}
+    return {"accepted": len(batch.metrics), "logs_enqueued": logs_written, "metrics_enqueued": metrics_written, "source_id": matched["id"]}
 
 
@@ -46,9 +46,23 @@ class Settings(BaseSettings):
     TEI_BASE_URL: str = "http://localhost:8081"  # Base URL of TEI server
     TEI_MODEL_NAME: str = "bert-base-uncased"  # Model name for identification (TEI uses model it was started with)
     TEI_API_KEY: str | None = None  # Optional API key (TEI doesn't require auth by default)
+    # Embedding cache (wraps every provider; keyed by provider name + text hash)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 50_000  # in-process LRU bound
+    EMBEDDING_CACHE_REDIS_ENABLED: bool = False  # share cached vectors across worker processes via REDIS_URL
+    EMBEDDING_CACHE_REDIS_TTL_SEC: int = 7 * 24 * 3600
     # LLM provider and models (inference/classification)
     LLM_PROVIDER: str = "openai"  # "openai" | "ollama"
     OLLAMA_CHAT_MODEL: str = "mistral"
+    LLM_TIMEOUT_SEC: float = 120.0
+    LLM_HTTP_MAX_CONNECTIONS: int = 20  # pooled connections per worker event loop
+    LLM_CACHE_ENABLED: bool = True  # content-addressed cache of LLM JSON responses
+    LLM_CACHE_TTL_SEC: int = 6 * 3600
+    LLM_CACHE_MAX_ENTRIES: int = 2048
+    LLM_CACHE_REDIS: bool = False  # share cached responses across replicas via Redis
+    LLM_PROMPT_MAX_TOKENS: int = 6000  # context budget per LLM call, split across prompt sections
+    LLM_PROMPT_MAX_LINE_TOKENS: int = 200  # longer log lines are truncated
+    LLM_PROMPT_TOKENIZER: str = "cl100k_base"  # used when tiktoken is installed
     CHROMA_COLLECTION_PREFIX: str = "templates_"  # results: templates_macos, templates_linux, templates_windows
 
     # Redis stream config used by producer/consumer
@@ -65,6 +79,9 @@ class Settings(BaseSettings):
 
     # Metrics normalization and export
     ENABLE_METRICS_NORMALIZATION: bool = True
+    METRICS_STREAM_ENCODING: str = "rows"  # rows (one entry per point) | packed (one entry per payload chunk)
+    METRICS_STREAM_PACK_MAX_POINTS: int = 1000  # points per packed entry
+    METRICS_STREAM_PACK_CODEC: str = "json"  # json | msgpack (needs the msgpack package on writers and readers)
     ENABLE_OTEL_EXPORT: bool = False
     OTEL_EXPORTER_OTLP_ENDPOINT: str = "http://localhost:4318/v1/metrics"
     OTEL_SERVICE_NAME: str = "aiops"
@@ -91,6 +108,17 @@ class Settings(BaseSettings):
     # Online clustering + cluster classification thresholds
     ONLINE_CLUSTER_DISTANCE_THRESHOLD: float = 0.25
     CLUSTER_MIN_LOGS_FOR_CLASSIFICATION: int = 20
+    # Process-local prototype index (exact-text and in-memory vector lookup for online clustering)
+    PROTOTYPE_INDEX_ENABLED: bool = True
+    PROTOTYPE_INDEX_REFRESH_SEC: float = 5.0  # pull prototypes added by other writers
+    PROTOTYPE_INDEX_FULL_RELOAD_SEC: float = 300.0  # rebuild to pick up rewritten prototypes
+    # Templater used for routing/clustering text: "regex" (mask variables) or "drain" (parse-tree template mining)
+    TEMPLATER: str = "regex"
+    DRAIN_DEPTH: int = 4  # tree depth incl. root and length layer
+    DRAIN_SIM_THRESHOLD: float = 0.4  # min share of matching tokens to join a template
+    DRAIN_MAX_CHILDREN: int = 100  # per internal node; overflow goes to the <*> child
+    DRAIN_STATE_PATH: str = ".drain/state.json"  # per process (last writer wins); empty disables persistence
+    DRAIN_SNAPSHOT_EVERY: int = 500  # template changes between snapshots
     # Re-publish cluster candidates for very large clusters (keeps alerts flowing even when a cluster is long-lived)
     # Set to 0 to disable.
     CLUSTER_CANDIDATE_REPUBLISH_EVERY: int = 200
@@ -101,6 +129,55 @@ class Settings(BaseSettings):
     ISSUE_INACTIVITY_SEC: int = 120  # close issue after N seconds without new logs
     ISSUE_MAX_LOGS_FOR_LLM: int = 50  # cap logs sent to LLM
     ENABLE_PER_LINE_CANDIDATES: bool = False  # if true, also publish per-line candidates
+    ENRICHER_CONCURRENCY: int = 4  # issue candidates enriched in parallel (bounds concurrent LLM calls)
+    CLUSTER_ENRICHER_BATCH_SIZE: int = 4  # cluster candidates per LLM request (1 disables batching)
+    CLUSTER_ENRICHER_BATCH_MAX_WAIT_SEC: float = 2.0  # max time a candidate waits for a batch to fill
+    # Reuse classifications stored on proto_<os> prototypes instead of calling the LLM
+    LABEL_PROPAGATION_ENABLED: bool = True
+    LABEL_PROPAGATION_MAX_DISTANCE: float = 0.1  # to the nearest labelled prototype (collection distance)
+    LABEL_PROPAGATION_MAX_AGE_SEC: int = 7 * 24 * 3600  # since the LLM classified that prototype
+    LABEL_PROPAGATION_MIN_CONFIDENCE: float = 0.7
+    LABEL_PROPAGATION_ISSUE_LINES: int = 3  # top templated lines of an issue that must all match
+    # Stream consumer identity / scaling
+    STREAM_CONSUMER_ID: str = ""  # instance part of consumer names; default <hostname>-<pid>
+    STREAM_WORKERS_PER_PROCESS: int = 1  # concurrent consumers per process on the `logs` stream groups
+    STREAM_RECLAIM_ENABLED: bool = True  # XAUTOCLAIM entries stuck in the pending list
+    STREAM_RECLAIM_MIN_IDLE_MS: int = 5 * 60 * 1000  # pending longer than this is considered abandoned
+    STREAM_RECLAIM_INTERVAL_SEC: float = 15.0
+    STREAM_RECLAIM_COUNT: int = 100  # entries claimed per XAUTOCLAIM call
+    STREAM_CONSUMER_PRUNE_IDLE_SEC: int = 24 * 60 * 60  # drop idle consumers without pending entries; 0 disables
+    STREAM_WRITER_ENABLED: bool = True  # producers' safe_xadd goes through a pipelined batch writer
+    STREAM_WRITER_MAX_BATCH: int = 500
+    STREAM_WRITER_LINGER_MS: float = 20.0  # max delay before a partial batch is flushed
+    STREAM_BACKPRESSURE_MAXLEN: int = 0  # producers wait while a stream is longer than this (0 = off)
+    STREAM_BACKPRESSURE_POLL_SEC: float = 0.5
+    # Stream retention: "stream=maxlen:N" or "stream=minid:SECONDS", comma separated
+    STREAM_RETENTION: str = (
+        "logs=maxlen:1000000,metrics=maxlen:1000000,issues_candidates=maxlen:100000,"
+        "clusters_candidates=maxlen:100000,alerts=minid:2592000"
+    )
+    STREAM_RETENTION_WRITE_HEADROOM: float = 2.0  # XADD caps at policy x headroom; 0 disables write-time trimming
+    ENABLE_STREAM_TRIMMER: bool = True  # background trim that never drops entries a consumer group still needs
+    STREAM_TRIM_INTERVAL_SEC: float = 30.0
+    STREAM_TRIM_BATCH: int = 100000  # max entries removed per maxlen stream per pass
+    SOURCE_CONFIG_CACHE_TTL_SEC: float = 300.0  # DataSource config cache; /sources writes invalidate via pub/sub
+    # Telegraf ingest: hashed-token agent index (memory + Redis) and request body limits
+    TELEGRAF_AUTH_CACHE_TTL_SEC: float = 300.0
+    TELEGRAF_AUTH_CACHE_MAX_ENTRIES: int = 10000
+    TELEGRAF_AUTH_INDEX_TTL_SEC: int = 3600  # Redis index expiry; rebuilt from the DB on the next miss
+    TELEGRAF_AUTH_REBUILD_MIN_SEC: float = 5.0
+    TELEGRAF_MAX_BODY_BYTES: int = 32 << 20  # after gzip decompression
+    # File tailing: block reads, Redis (inode, offset) checkpoints, inotify follow
+    FILETAIL_READ_BLOCK_BYTES: int = 1 << 20
+    FILETAIL_CHECKPOINT_INTERVAL_SEC: float = 1.0
+    FILETAIL_POLL_INTERVAL_SEC: float = 0.5  # follow poll interval (inotify wake-ups are immediate)
+    FILETAIL_INOTIFY: bool = True  # uses inotify_simple when installed (Linux)
+    # CPU offload for parse/template/rules and local embedding models (spawned worker processes)
+    CPU_POOL_WORKERS: int = 0  # 0 = run that work in threads of this process
+    CPU_POOL_EMBEDDING: bool = True  # load sentence-transformers / local LogBERT in the pool workers
+    # Single pass over `logs`: the consumer also runs online clustering + issue aggregation
+    # in-process (no separate issues_aggregator consumer group / thread)
+    UNIFIED_PIPELINE: bool = False
 
     # Background stream toggles
     ENABLE_PRODUCER: bool = False
@@ -115,6 +192,16 @@ class Settings(BaseSettings):
     CLUSTER_QUALITY_THRESHOLD: float = 0.3  # Min silhouette score
     DRIFT_DETECTION_WINDOW_SEC: int = 3600  # 1 hour
     LLM_COST_PER_1K_TOKENS: float = 0.0001  # OpenAI pricing for gpt-4o-mini
+    # Cluster quality metrics engine (silhouette / cohesion / separation)
+    CLUSTER_METRICS_MODE: str = "auto"  # exact | sampled | auto (sampled above EXACT_MAX_POINTS)
+    CLUSTER_METRICS_EXACT_MAX_POINTS: int = 20_000
+    CLUSTER_METRICS_SAMPLE_SIZE: int = 2_000  # stratified silhouette sample
+    CLUSTER_METRICS_MAX_BLOCK_MB: float = 64.0  # memory cap per distance block
+    CLUSTER_METRICS_FLUSH_INTERVAL_SEC: float = 2.0  # online/LLM metrics buffer -> Redis
+    CLUSTER_METRICS_MINUTE_RETENTION_SEC: int = 24 * 3600  # minute rollups (hour rollups keep 7 days)
+    CLUSTER_METRICS_DAY_RETENTION_SEC: int = 90 * 24 * 3600  # day rollups
+    CLUSTER_METRICS_SKETCH_ACCURACY: float = 0.01  # DDSketch relative error for distance/confidence percentiles
+    CLUSTER_METRICS_SKETCH_MIN_VALUE: float = 1e-4  # values at or below count as 0
     # HTTP request logging toggle (middleware). Set to false to suppress request logs
     REQUEST_LOGS_ENABLED: bool = True
 
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
 
 from app.core.config import settings
@@ -15,6 +16,7 @@ from app.streams.producer_manager import attach_producers
 from app.streams.automations import attach_automations
 from app.streams.cluster_enricher import attach_cluster_enricher
 from app.streams.metrics_aggregator import attach_metrics_aggregator
+from app.streams.retention import attach_stream_trimmer
 import logging
 from app.core.runtime_state import set_shutting_down
 import threading
@@ -59,6 +61,16 @@ async def _init_db_event():
     await init_db()
 
 
+@app.on_event("startup")
+async def _start_cpu_pool():
+    # Spawn workers and load any pooled embedding model before the stream loops need it
+    try:
+        from app.services.cpu_pool import start_cpu_pool
+        await asyncio.to_thread(start_cpu_pool)
+    except Exception as exc:
+        LOG.error("cpu pool startup failed err=%s", exc)
+
+
 def _mask_api_key(value: str | None) -> str:
     if not value:
         return "-"
@@ -171,6 +183,10 @@ if settings.ENABLE_PRODUCER:
     # Attach metrics aggregator for cluster observability
     attach_metrics_aggregator(app)
     LOG.info("metrics aggregator attachment registered (ENABLE_CLUSTER_METRICS=%s)", settings.ENABLE_CLUSTER_METRICS)
+
+    # Trim streams to their retention policies without dropping unconsumed entries
+    attach_stream_trimmer(app)
+    LOG.info("stream trimmer attachment registered (ENABLE_STREAM_TRIMMER=%s)", settings.ENABLE_STREAM_TRIMMER)
 else:
     LOG.info("background workers disabled (ENABLE_PRODUCER=False); API-only mode")
 
@@ -190,3 +206,12 @@ async def _mark_shutting_down():
         set_shutting_down(True)
     except Exception:
         pass
+
+
+@app.on_event("shutdown")
+async def _stop_cpu_pool():
+    try:
+        from app.services.cpu_pool import shutdown_cpu_pool
+        shutdown_cpu_pool()
+    except Exception:
+        pass
@@ -1,8 +1,8 @@
-from .templating import template_content, render_templated_line
+from .templating import template_content, render_templated_line, render_templated_line_with_id, mine_template
 
 __all__ = [
     "template_content",
     "render_templated_line",
+    "render_templated_line_with_id",
+    "mine_template",
 ]
-
-
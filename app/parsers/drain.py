@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .templating import template_content
+
+LOG = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+
+
+@dataclass
+class LogTemplate:
+    template_id: str
+    tokens: List[str]
+    size: int = 1
+    # Keys followed from the root when the template was inserted; used to rebuild the tree
+    path: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+
+@dataclass
+class _Node:
+    children: Dict[str, "_Node"] = field(default_factory=dict)
+    template_ids: List[str] = field(default_factory=list)
+
+
+def _has_digit(token: str) -> bool:
+    return any(ch.isdigit() for ch in token)
+
+
+class DrainTemplateMiner:
+    """Fixed-depth parse tree template miner (Drain).
+
+    Lines are masked with `template_content` first, then routed by token count and
+    their first `depth - 2` tokens to a leaf holding a few candidate templates. The
+    most similar candidate at or above `sim_threshold` absorbs the line (positions
+    that differ become `<*>`), otherwise a new template is created. Lookup cost is
+    O(depth) plus a scan over one small leaf.
+
+    The tree is snapshotted to `state_path` every `snapshot_every` changes so
+    template ids survive restarts.
+
+    Ids are derived from the masked tokens that created the template, not from a
+    counter, so miners in separate processes (or restored from another process's
+    snapshot) never hand out the same id for different templates. Which template a
+    line joins still depends on that process's tree, so ids are only meaningful
+    within one miner; do not join on them across processes.
+    """
+
+    def __init__(
+        self,
+        depth: int = 4,
+        sim_threshold: float = 0.4,
+        max_children: int = 100,
+        state_path: str | None = None,
+        snapshot_every: int = 500,
+    ) -> None:
+        self.depth = max(3, int(depth))
+        self.sim_threshold = float(sim_threshold)
+        self.max_children = max(2, int(max_children))
+        self.state_path = Path(state_path) if state_path else None
+        self.snapshot_every = max(1, int(snapshot_every))
+        self._root = _Node()
+        self._templates: Dict[str, LogTemplate] = {}
+        self._changes = 0
+        self._lock = threading.Lock()
+        if self.state_path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def add_content(self, content: str) -> Tuple[str, str]:
+        """Match (or create) the template for a message body; returns (template_id, template)."""
+        tokens = template_content(content).split()
+        with self._lock:
+            template = self._match(tokens)
+            if template is None:
+                template = self._create(tokens)
+                self._changed()
+            else:
+                template.size += 1
+                updated = [t if t == new else WILDCARD for t, new in zip(template.tokens, tokens)]
+                if updated != template.tokens:
+                    template.tokens = updated
+                    self._changed()
+            return template.template_id, template.text
+
+    def match_content(self, content: str) -> Tuple[Optional[str], str]:
+        """Look up the template for a message body without changing the tree.
+
+        Returns (template_id, template), or (None, masked body) when no template matches.
+        """
+        tokens = template_content(content).split()
+        with self._lock:
+            template = self._match(tokens)
+            if template is None:
+                return None, " ".join(tokens)
+            return template.template_id, template.text
+
+    def get(self, template_id: str) -> Optional[LogTemplate]:
+        return self._templates.get(template_id)
+
+    def _leaf(self, tokens: List[str]) -> Optional[_Node]:
+        node = self._root.children.get(str(len(tokens)))
+        if node is None:
+            return None
+        for token in tokens[: self.depth - 2]:
+            nxt = node.children.get(token) or node.children.get(WILDCARD)
+            if nxt is None:
+                return None
+            node = nxt
+        return node
+
+    def _match(self, tokens: List[str]) -> Optional[LogTemplate]:
+        leaf = self._leaf(tokens)
+        if leaf is None:
+            return None
+        best: Optional[LogTemplate] = None
+        best_key = (-1.0, -1)
+        for template_id in leaf.template_ids:
+            template = self._templates[template_id]
+            same = 0
+            params = 0
+            for t, tok in zip(template.tokens, tokens):
+                if t == WILDCARD:
+                    params += 1
+                elif t == tok:
+                    same += 1
+            sim = same / len(tokens) if tokens else 1.0
+            if (sim, params) > best_key:
+                best_key = (sim, params)
+                best = template
+        if best is not None and best_key[0] >= self.sim_threshold:
+            return best
+        return None
+
+    def _new_id(self, tokens: List[str]) -> str:
+        base = "T" + hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()[:12]
+        template_id, n = base, 1
+        # Same seed tokens that no longer match their generalized template
+        while template_id in self._templates:
+            n += 1
+            template_id = f"{base}-{n}"
+        return template_id
+
+    def _create(self, tokens: List[str]) -> LogTemplate:
+        template = LogTemplate(template_id=self._new_id(tokens), tokens=list(tokens))
+        path = [str(len(tokens))]
+        node = self._root.children.setdefault(path[0], _Node())
+        for token in tokens[: self.depth - 2]:
+            if token in node.children:
+                key = token
+            elif _has_digit(token) or len(node.children) >= self.max_children - 1:
+                key = WILDCARD
+            else:
+                key = token
+            node = node.children.setdefault(key, _Node())
+            path.append(key)
+        node.template_ids.append(template.template_id)
+        template.path = path
+        self._templates[template.template_id] = template
+        return template
+
+    def _changed(self) -> None:
+        self._changes += 1
+        if self.state_path is not None and self._changes % self.snapshot_every == 0:
+            self._save_locked()
+
+    def save(self) -> None:
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self) -> None:
+        if self.state_path is None:
+            return
+        state = {
+            "depth": self.depth,
+            "templates": [
+                {"id": t.template_id, "tokens": t.tokens, "size": t.size, "path": t.path}
+                for t in self._templates.values()
+            ],
+        }
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_path.with_suffix(self.state_path.suffix + ".tmp")
+            tmp.write_text(json.dumps(state), encoding="utf-8")
+            os.replace(tmp, self.state_path)
+        except Exception as exc:
+            LOG.warning("drain: failed to save state path=%s err=%s", self.state_path, exc)
+
+    def _load(self) -> None:
+        if self.state_path is None or not self.state_path.exists():
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except Exception as exc:
+            LOG.warning("drain: failed to load state path=%s err=%s", self.state_path, exc)
+            return
+        if int(state.get("depth", self.depth)) != self.depth:
+            LOG.warning("drain: ignoring state saved with depth=%s (configured %s)", state.get("depth"), self.depth)
+            return
+        for item in state.get("templates") or []:
+            template = LogTemplate(
+                template_id=str(item["id"]),
+                tokens=list(item["tokens"]),
+                size=int(item.get("size", 1)),
+                path=list(item.get("path") or []),
+            )
+            node = self._root
+            for key in template.path:
+                node = node.children.setdefault(key, _Node())
+            node.template_ids.append(template.template_id)
+            self._templates[template.template_id] = template
+        LOG.info("drain: loaded %d templates from %s", len(self._templates), self.state_path)
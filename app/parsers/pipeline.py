@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.services.failure_rules import match_failure_signals
+
+from .linux import parse_linux_line
+from .macos import parse_macos_line
+from .templating import render_templated_line_with_id
+
+
+ParsedLine = Tuple[str, Dict[str, str], Dict[str, object]]
+
+
+def parse_and_template(os_name: str, line: str, mine: bool = True) -> Tuple[str, Dict[str, str]]:
+    """Parse a raw line for its OS and return (templated line, parsed fields).
+
+    Lines that do not match the OS parser are templated as a whole under component
+    "unknown". When the templater assigns ids, `parsed["template_id"]` is set.
+    `mine=False` looks templates up without adding the line to the Drain tree.
+    """
+    parsed: Dict[str, str] | None = None
+    if os_name == "linux":
+        parsed = parse_linux_line(0, line) or None
+    elif os_name == "macos":
+        parsed = parse_macos_line(0, line) or None
+    if not parsed:
+        templated, template_id = render_templated_line_with_id(component="unknown", pid=None, content=line, mine=mine)
+        fallback = {"content": line, "component": "unknown"}
+        if template_id:
+            fallback["template_id"] = template_id
+        return templated, fallback
+    templated, template_id = render_templated_line_with_id(
+        component=parsed.get("component", ""),
+        pid=parsed.get("PID"),
+        content=parsed.get("content", ""),
+        mine=mine,
+    )
+    if template_id:
+        parsed["template_id"] = template_id
+    return templated, parsed
+
+
+def parse_lines_batch(
+    items: Sequence[Tuple[str, str]], with_rules: bool = False, mine: bool = True
+) -> List[Optional[ParsedLine]]:
+    """Parse/template a batch of (os_name, line) pairs; optionally run the failure rules.
+
+    Module-level and free of I/O so it can run in a worker process (see
+    app/services/cpu_pool.py). Returns one `(templated, parsed, rule)` per item, with
+    `rule` empty when `with_rules` is false, or None when the item failed.
+    """
+    out: List[Optional[ParsedLine]] = []
+    for os_name, line in items:
+        try:
+            templated, parsed = parse_and_template(os_name, line, mine)
+            rule: Dict[str, object] = match_failure_signals(f"{templated} {line}") if with_rules else {}
+            out.append((templated, parsed, rule))
+        except Exception:
+            out.append(None)
+    return out
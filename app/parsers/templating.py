@@ -1,7 +1,13 @@
 from __future__ import annotations
 
 import re
-from typing import Optional
+import atexit
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .drain import DrainTemplateMiner
 
 
 # Patterns ordered from most specific to most general to avoid over-masking
@@ -15,33 +21,115 @@ HASH_NUMBER = re.compile(r"#\d+")
 NUMBER = re.compile(r"(?<!\w)[-+]?\d+(?:\.\d+)?(?!\w)")
 
 
-def template_content(message: str) -> str:
-    """Return a templated version of a log message body by masking variable tokens.
+# Applied in this order; each mask sees the output of the previous ones
+_MASKS = (
+    (MAC_ADDRESS, "<*>"),
+    (IPV4_ADDRESS, "<*>"),
+    (IPV6_ADDRESS, "<*>"),
+    (UUID_PATTERN, "<*>"),
+    (HEX_LITERAL, "<*>"),
+    (VERSION_PATTERN, "<*>"),
+    (HASH_NUMBER, "#<*>"),
+    (NUMBER, "<*>"),
+)
+# Every mask needs a digit, a ':' (MAC/IPv6) or a '-' (UUID) to match
+_MAY_CONTAIN_VARIABLE = re.compile(r"[\d:-]")
 
-    The function attempts to preserve structure while replacing volatile values with `<*>`.
+_TOKEN_CACHE_SIZE = 65536
+_MESSAGE_CACHE_SIZE = 16384
+
+
+def template_content_reference(message: str) -> str:
+    """Reference implementation: the mask chain applied to the whole message.
+
+    Kept for equivalence checks and benchmarks (see scripts/bench_templating.py).
     """
     templated = message
-    templated = MAC_ADDRESS.sub("<*>", templated)
-    templated = IPV4_ADDRESS.sub("<*>", templated)
-    templated = IPV6_ADDRESS.sub("<*>", templated)
-    templated = UUID_PATTERN.sub("<*>", templated)
-    templated = HEX_LITERAL.sub("<*>", templated)
-    templated = VERSION_PATTERN.sub("<*>", templated)
-    templated = HASH_NUMBER.sub("#<*>", templated)
-    templated = NUMBER.sub("<*>", templated)
+    for pattern, replacement in _MASKS:
+        templated = pattern.sub(replacement, templated)
     # collapse excessive whitespace that may appear after substitutions
     templated = re.sub(r"\s+", " ", templated).strip()
     return templated
 
 
-def render_templated_line(component: str, pid: Optional[str], content: str) -> str:
-    """Build a templated full line like `component[PID]: <templated content>`.
+@lru_cache(maxsize=_TOKEN_CACHE_SIZE)
+def _template_token(token: str) -> str:
+    if not _MAY_CONTAIN_VARIABLE.search(token):
+        return token
+    for pattern, replacement in _MASKS:
+        token = pattern.sub(replacement, token)
+    return token
 
-    If `pid` is falsy, the bracketed PID segment is omitted.
+
+@lru_cache(maxsize=_MESSAGE_CACHE_SIZE)
+def template_content(message: str) -> str:
+    """Return a templated version of a log message body by masking variable tokens.
+
+    The function attempts to preserve structure while replacing volatile values with `<*>`.
+
+    No mask can match whitespace, and whitespace behaves like a string edge for the
+    `\\b` and lookaround assertions they use, so masking each whitespace-separated
+    token and joining with single spaces is byte-identical to running the chain over
+    the whole message. Tokens repeat heavily across log lines, so both the per-token
+    result and recently seen messages are memoized.
     """
-    templated_body = template_content(content)
+    return " ".join([_template_token(token) for token in message.split()])
+
+
+_drain: "DrainTemplateMiner | None" = None
+_drain_lock = threading.Lock()
+
+
+def _get_drain_miner() -> "DrainTemplateMiner":
+    global _drain
+    if _drain is None:
+        with _drain_lock:
+            if _drain is None:
+                from app.core.config import settings
+                from .drain import DrainTemplateMiner
+
+                miner = DrainTemplateMiner(
+                    depth=settings.DRAIN_DEPTH,
+                    sim_threshold=settings.DRAIN_SIM_THRESHOLD,
+                    max_children=settings.DRAIN_MAX_CHILDREN,
+                    state_path=settings.DRAIN_STATE_PATH or None,
+                    snapshot_every=settings.DRAIN_SNAPSHOT_EVERY,
+                )
+                atexit.register(miner.save)
+                _drain = miner
+    return _drain
+
+
+def mine_template(content: str, mine: bool = True) -> Tuple[Optional[str], str]:
+    """Return (template_id, templated body) using the configured templater.
+
+    With `TEMPLATER="regex"` (default) the body is `template_content(content)` and no
+    id is assigned. With `TEMPLATER="drain"` the masked body is matched against the
+    persistent Drain parse tree (see app/parsers/drain.py), which also generalizes
+    positions that vary between lines of the same template. `mine=False` only looks
+    the template up, for readers of lines another stage has already mined.
+    """
+    from app.core.config import settings
+
+    if (settings.TEMPLATER or "regex").strip().lower() == "drain":
+        miner = _get_drain_miner()
+        return miner.add_content(content) if mine else miner.match_content(content)
+    return None, template_content(content)
+
+
+def render_templated_line_with_id(
+    component: str, pid: Optional[str], content: str, mine: bool = True
+) -> Tuple[str, Optional[str]]:
+    """Like `render_templated_line`, also returning the template id (None for the regex templater)."""
+    template_id, templated_body = mine_template(content, mine)
     pid_part = f"[{pid}]" if pid else ""
     separator = ": " if templated_body else ""
-    return f"{component}{pid_part}{separator}{templated_body}"
+    return f"{component}{pid_part}{separator}{templated_body}", template_id
+
 
+def render_templated_line(component: str, pid: Optional[str], content: str) -> str:
+    """Build a templated full line like `component[PID]: <templated content>`.
 
+    If `pid` is falsy, the bracketed PID segment is omitted.
+    """
+    return render_templated_line_with_id(component, pid, content)[0]
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
 import chromadb
 from chromadb.api import ClientAPI
@@ -15,7 +15,9 @@ from app.services.embedding import (
     OllamaEmbeddingFunction,
     LogBERTEmbeddingFunction,
     LogBERTClientEmbeddingFunction,
+    CachedEmbeddingFunction,
 )
+from app.services.cpu_pool import ProcessPoolEmbeddingFunction, uses_local_embedding_model
 
 
 class ChromaClientProvider:
@@ -25,7 +27,14 @@ class ChromaClientProvider:
         # Choose embedding provider
         provider = settings.EMBEDDING_PROVIDER.lower()
         embedding_fn: Any = None
-        if provider == "openai":
+        if (
+            int(settings.CPU_POOL_WORKERS or 0) > 0
+            and settings.CPU_POOL_EMBEDDING
+            and uses_local_embedding_model(embedding_model_name)
+        ):
+            # Local model inference runs in the CPU pool workers instead of this process
+            embedding_fn = ProcessPoolEmbeddingFunction()
+        elif provider == "openai":
             embedding_fn = OpenAIEmbeddingFunction(
                 model=settings.OPENAI_EMBEDDING_MODEL,
                 api_key=settings.OPENAI_API_KEY,
@@ -68,6 +77,8 @@ class ChromaClientProvider:
                 f"Unknown EMBEDDING_PROVIDER '{settings.EMBEDDING_PROVIDER}'. "
                 "Supported: openai, sentence-transformers, ollama, logbert, tei"
             )
+        if settings.EMBEDDING_CACHE_ENABLED:
+            embedding_fn = CachedEmbeddingFunction(embedding_fn)
         self.embedding_fn = embedding_fn
         self._client = self._create_client()
 
@@ -92,6 +103,23 @@ class ChromaClientProvider:
     def client(self) -> ClientAPI:
         return self._client
 
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts once with the provider's embedding function.
+
+        Duplicate texts within the call are embedded a single time. The result is
+        aligned with `texts` and can be passed as explicit `embeddings=` /
+        `query_embeddings=` to Chroma so collections never re-embed internally.
+        """
+        unique: Dict[str, int] = {}
+        for text in texts:
+            if text not in unique:
+                unique[text] = len(unique)
+        if not unique:
+            return []
+        vectors = self.embedding_fn(list(unique.keys()))
+        as_lists = [vec.tolist() if hasattr(vec, "tolist") else list(vec) for vec in vectors]
+        return [as_lists[unique[text]] for text in texts]
+
     def get_or_create_collection(self, name: str) -> Collection:
         # Ensure collections are namespaced by embedding function to avoid
         # dimension mismatches when switching models/providers.
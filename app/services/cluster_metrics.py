@@ -3,22 +3,229 @@ from __future__ import annotations
 import json
 import logging
 import time
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import atexit
 import math
+import threading
 
+import numpy as np
 import redis.asyncio as aioredis
 
 from app.core.config import settings
+from app.services.quantile_sketch import DDSketch
 
 LOG = logging.getLogger(__name__)
 
 
-def _cosine_distance(a: List[float], b: List[float]) -> float:
-    """Calculate cosine distance between two normalized vectors."""
-    dot = sum(x * y for x, y in zip(a, b))
-    dot = max(min(dot, 1.0), -1.0)
-    return 1.0 - dot
+# ---- Vectorized metrics engine ----
+#
+# Distances are cosine distances `1 - clip(a . b, -1, 1)` (inputs are expected to be
+# normalized). Work is done in row blocks sized to CLUSTER_METRICS_MAX_BLOCK_MB.
+# For unit-norm inputs the clip is a no-op, so sums of distances to a cluster reduce
+# to `|C| - x . sum(C)`: silhouette needs an (n x k) product instead of (n x n)
+# distances, and cohesion is O(n * d).
+
+_UNIT_NORM_TOLERANCE = 1e-6
+
+
+def _as_matrix(embeddings: Any) -> np.ndarray:
+    matrix = np.asarray(embeddings, dtype=np.float64)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    return matrix
+
+
+def _block_rows(n_cols: int) -> int:
+    """Rows per block so one float64 (rows x n_cols) block stays under the memory cap."""
+    cap_bytes = max(1.0, float(settings.CLUSTER_METRICS_MAX_BLOCK_MB)) * 1024 * 1024
+    return max(1, int(cap_bytes // (8 * max(1, n_cols))))
+
+
+def _cosine_block(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    dots = a @ b.T
+    np.clip(dots, -1.0, 1.0, out=dots)
+    return 1.0 - dots
+
+
+class _ClusterLayout:
+    """Clustered points reordered so each cluster is a contiguous row range."""
+
+    def __init__(self, clusters: List[List[int]], embeddings: Any) -> None:
+        members = [list(c) for c in clusters if c]
+        self.sizes = np.array([len(c) for c in members], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]]).astype(np.int64) if members else np.zeros(0, dtype=np.int64)
+        order = [idx for c in members for idx in c]
+        matrix = _as_matrix(embeddings)
+        self.x = matrix[order] if order else np.zeros((0, matrix.shape[1] if matrix.ndim == 2 else 0))
+        self.labels = np.repeat(np.arange(len(members)), self.sizes)
+        self.sq_norms = np.einsum("ij,ij->i", self.x, self.x)
+        self.unit = bool(len(self.x)) and bool(np.all(np.abs(np.sqrt(self.sq_norms) - 1.0) <= _UNIT_NORM_TOLERANCE))
+        self.sums = np.add.reduceat(self.x, self.starts, axis=0) if len(members) else np.zeros((0, self.x.shape[1]))
+
+    @property
+    def k(self) -> int:
+        return len(self.sizes)
+
+    def distance_sums(self, rows: np.ndarray) -> np.ndarray:
+        """(len(rows) x k) sums of distances from each row to every member of each cluster."""
+        if self.unit:
+            return self.sizes[None, :] - self.x[rows] @ self.sums.T
+        return np.add.reduceat(_cosine_block(self.x[rows], self.x), self.starts, axis=1)
+
+    def self_distances(self, rows: np.ndarray) -> np.ndarray:
+        return 1.0 - np.clip(self.sq_norms[rows], -1.0, 1.0)
+
+
+def _silhouette_values(layout: _ClusterLayout, rows: np.ndarray) -> np.ndarray:
+    """Silhouette s(i) for the given rows (all must belong to clusters of size >= 2)."""
+    out = np.empty(len(rows), dtype=np.float64)
+    width = layout.k if layout.unit else len(layout.x)
+    step = _block_rows(width)
+    for begin in range(0, len(rows), step):
+        block = rows[begin:begin + step]
+        sums = layout.distance_sums(block)
+        own = layout.labels[block]
+        local = np.arange(len(block))
+        a = (sums[local, own] - layout.self_distances(block)) / (layout.sizes[own] - 1)
+        means = sums / layout.sizes[None, :]
+        means[local, own] = np.inf
+        b = means.min(axis=1) if layout.k > 1 else np.full(len(block), np.inf)
+        b = np.where(np.isfinite(b), b, 0.0)
+        denom = np.maximum(a, b)
+        safe = np.where(denom > 0, denom, 1.0)
+        out[begin:begin + len(block)] = np.where(denom > 0, (b - a) / safe, 0.0)
+    return out
+
+
+def _pair_distance_sum(layout: _ClusterLayout, ci: int, rows: np.ndarray | None = None) -> Tuple[float, int]:
+    """Sum of distances over unordered member pairs of cluster `ci` (optionally a subset of its rows)."""
+    start = int(layout.starts[ci])
+    if rows is None:
+        rows = np.arange(start, start + int(layout.sizes[ci]))
+    size = len(rows)
+    pairs = size * (size - 1) // 2
+    if size < 2:
+        return 0.0, 0
+    if layout.unit:
+        total = layout.x[rows].sum(axis=0)
+        dot_pairs = (float(total @ total) - float(layout.sq_norms[rows].sum())) / 2.0
+        return float(pairs) - dot_pairs, pairs
+    members = layout.x[rows]
+    acc = 0.0
+    step = _block_rows(size)
+    for begin in range(0, size, step):
+        block = _cosine_block(members[begin:begin + step], members)
+        acc += float(block.sum())
+    # full matrix counts every pair twice plus the diagonal
+    acc -= float(layout.self_distances(rows).sum())
+    return acc / 2.0, pairs
+
+
+def _stratified_sample(layout: _ClusterLayout, eligible: np.ndarray, sample_size: int, seed: int) -> Dict[int, np.ndarray]:
+    """Proportional allocation (at least one row per eligible cluster) without replacement."""
+    rng = np.random.default_rng(seed)
+    total = int(layout.sizes[eligible].sum())
+    picks: Dict[int, np.ndarray] = {}
+    for ci in eligible:
+        size = int(layout.sizes[ci])
+        n_h = min(size, max(1, int(round(sample_size * size / total))))
+        start = int(layout.starts[ci])
+        picks[int(ci)] = start + np.sort(rng.choice(size, size=n_h, replace=False))
+    return picks
+
+
+def compute_quality_metrics(
+    clusters: List[List[int]],
+    embeddings: Any,
+    *,
+    mode: str | None = None,
+    sample_size: int | None = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Silhouette, cohesion and separation with exact or stratified-sampled evaluation.
+
+    `mode` is "exact", "sampled" or "auto" (default from CLUSTER_METRICS_MODE: sampled
+    once more than CLUSTER_METRICS_EXACT_MAX_POINTS points are in clusters of size
+    >= 2). In sampled mode silhouette is estimated from a per-cluster proportional
+    sample and reported with a 95% confidence interval; cohesion is exact for unit
+    vectors and estimated from within-sample pairs otherwise. Separation is always exact.
+    """
+    mode = (mode or settings.CLUSTER_METRICS_MODE or "auto").strip().lower()
+    sample_size = int(sample_size or settings.CLUSTER_METRICS_SAMPLE_SIZE)
+    result: Dict[str, Any] = {
+        "silhouette_score": 0.0,
+        "cohesion": 0.0,
+        "separation": calculate_separation(clusters, embeddings),
+        "metrics_mode": "exact",
+        "metrics_sample_size": 0,
+        "silhouette_ci95": None,
+    }
+    if not clusters:
+        return result
+    layout = _ClusterLayout(clusters, embeddings)
+    eligible = np.flatnonzero(layout.sizes >= 2)
+    n_eligible = int(layout.sizes[eligible].sum()) if len(eligible) else 0
+    if n_eligible == 0:
+        return result
+    if mode == "auto":
+        mode = "sampled" if n_eligible > int(settings.CLUSTER_METRICS_EXACT_MAX_POINTS) else "exact"
+    if mode == "sampled" and sample_size >= n_eligible:
+        mode = "exact"
+
+    if mode != "sampled":
+        rows = np.concatenate([np.arange(layout.starts[ci], layout.starts[ci] + layout.sizes[ci]) for ci in eligible])
+        if len(clusters) >= 2:
+            result["silhouette_score"] = float(_silhouette_values(layout, rows).mean())
+        pair_total = 0.0
+        pair_count = 0
+        for ci in eligible:
+            dist_sum, pairs = _pair_distance_sum(layout, int(ci))
+            pair_total += dist_sum
+            pair_count += pairs
+        result["cohesion"] = pair_total / pair_count if pair_count else 0.0
+        result["metrics_sample_size"] = n_eligible
+        return result
+
+    picks = _stratified_sample(layout, eligible, sample_size, seed)
+    rows = np.concatenate(list(picks.values()))
+    values = _silhouette_values(layout, rows) if len(clusters) >= 2 else np.zeros(len(rows))
+    estimate = 0.0
+    variance = 0.0
+    offset = 0
+    for ci, picked in picks.items():
+        part = values[offset:offset + len(picked)]
+        offset += len(picked)
+        weight = float(layout.sizes[ci]) / n_eligible
+        estimate += weight * float(part.mean())
+        if len(part) > 1:
+            fpc = 1.0 - len(part) / float(layout.sizes[ci])
+            variance += weight * weight * fpc * float(part.var(ddof=1)) / len(part)
+    half_width = 1.96 * math.sqrt(variance)
+
+    pair_total = 0.0
+    pair_count = 0
+    for ci, picked in picks.items():
+        if layout.unit:
+            dist_sum, pairs = _pair_distance_sum(layout, ci)
+            pair_total += dist_sum
+            pair_count += pairs
+            continue
+        dist_sum, sampled_pairs = _pair_distance_sum(layout, ci, picked)
+        if sampled_pairs:
+            full_pairs = int(layout.sizes[ci]) * (int(layout.sizes[ci]) - 1) // 2
+            pair_total += full_pairs * dist_sum / sampled_pairs
+            pair_count += full_pairs
+
+    result.update({
+        "silhouette_score": estimate,
+        "cohesion": pair_total / pair_count if pair_count else 0.0,
+        "metrics_mode": "sampled",
+        "metrics_sample_size": int(len(rows)),
+        "silhouette_ci95": [max(-1.0, estimate - half_width), min(1.0, estimate + half_width)],
+    })
+    return result
 
 
 def calculate_silhouette_score(
@@ -34,50 +241,12 @@ def calculate_silhouette_score(
     """
     if len(clusters) < 2:
         return 0.0
-    
-    total_score = 0.0
-    total_samples = 0
-    
-    for cluster_idx, cluster_members in enumerate(clusters):
-        if len(cluster_members) < 2:
-            continue
-        
-        for member_idx in cluster_members:
-            member_vec = embeddings[member_idx]
-            
-            # Calculate a(i): mean distance to other points in same cluster
-            intra_distances = []
-            for other_idx in cluster_members:
-                if other_idx != member_idx:
-                    intra_distances.append(_cosine_distance(member_vec, embeddings[other_idx]))
-            
-            a_i = sum(intra_distances) / len(intra_distances) if intra_distances else 0.0
-            
-            # Calculate b(i): mean distance to points in nearest other cluster
-            min_inter_distance = float('inf')
-            for other_cluster_idx, other_cluster in enumerate(clusters):
-                if other_cluster_idx == cluster_idx or not other_cluster:
-                    continue
-                
-                inter_distances = [
-                    _cosine_distance(member_vec, embeddings[other_idx])
-                    for other_idx in other_cluster
-                ]
-                mean_inter = sum(inter_distances) / len(inter_distances) if inter_distances else 0.0
-                min_inter_distance = min(min_inter_distance, mean_inter)
-            
-            b_i = min_inter_distance if min_inter_distance != float('inf') else 0.0
-            
-            # Silhouette score for this sample
-            if max(a_i, b_i) > 0:
-                s_i = (b_i - a_i) / max(a_i, b_i)
-            else:
-                s_i = 0.0
-            
-            total_score += s_i
-            total_samples += 1
-    
-    return total_score / total_samples if total_samples > 0 else 0.0
+    layout = _ClusterLayout(clusters, embeddings)
+    eligible = np.flatnonzero(layout.sizes >= 2)
+    if not len(eligible):
+        return 0.0
+    rows = np.concatenate([np.arange(layout.starts[ci], layout.starts[ci] + layout.sizes[ci]) for ci in eligible])
+    return float(_silhouette_values(layout, rows).mean())
 
 
 def calculate_cohesion(clusters: List[List[int]], embeddings: List[List[float]]) -> float:
@@ -87,20 +256,14 @@ def calculate_cohesion(clusters: List[List[int]], embeddings: List[List[float]])
     """
     if not clusters:
         return 0.0
-    
-    total_distance = 0.0
-    total_pairs = 0
-    
-    for cluster_members in clusters:
-        if len(cluster_members) < 2:
-            continue
-        
-        for i, idx_i in enumerate(cluster_members):
-            for idx_j in cluster_members[i + 1:]:
-                total_distance += _cosine_distance(embeddings[idx_i], embeddings[idx_j])
-                total_pairs += 1
-    
-    return total_distance / total_pairs if total_pairs > 0 else 0.0
+    layout = _ClusterLayout(clusters, embeddings)
+    pair_total = 0.0
+    pair_count = 0
+    for ci in np.flatnonzero(layout.sizes >= 2):
+        dist_sum, pairs = _pair_distance_sum(layout, int(ci))
+        pair_total += dist_sum
+        pair_count += pairs
+    return pair_total / pair_count if pair_count > 0 else 0.0
 
 
 def calculate_separation(clusters: List[List[int]], embeddings: List[List[float]]) -> float:
@@ -110,28 +273,22 @@ def calculate_separation(clusters: List[List[int]], embeddings: List[List[float]
     """
     if len(clusters) < 2:
         return 1.0
-    
-    # Calculate centroids
-    centroids = []
-    for cluster_members in clusters:
-        if not cluster_members:
-            continue
-        cluster_vecs = [embeddings[idx] for idx in cluster_members]
-        centroid = [sum(v[i] for v in cluster_vecs) / len(cluster_vecs) for i in range(len(cluster_vecs[0]))]
-        centroids.append(centroid)
-    
-    if len(centroids) < 2:
+    members = [c for c in clusters if c]
+    if len(members) < 2:
         return 1.0
-    
-    # Calculate pairwise centroid distances
+    matrix = _as_matrix(embeddings)
+    centroids = np.stack([matrix[c].mean(axis=0) for c in members])
+
+    # Mean pairwise centroid distance over i < j
+    k = len(centroids)
     total_distance = 0.0
-    total_pairs = 0
-    
-    for i in range(len(centroids)):
-        for j in range(i + 1, len(centroids)):
-            total_distance += _cosine_distance(centroids[i], centroids[j])
-            total_pairs += 1
-    
+    step = _block_rows(k)
+    for begin in range(0, k, step):
+        block = _cosine_block(centroids[begin:begin + step], centroids)
+        rows = np.arange(begin, begin + len(block))
+        upper = np.arange(k)[None, :] > rows[:, None]
+        total_distance += float(block[upper].sum())
+    total_pairs = k * (k - 1) // 2
     return total_distance / total_pairs if total_pairs > 0 else 0.0
 
 
@@ -153,6 +310,298 @@ def calculate_distance_stats(distances: List[float]) -> Dict[str, float]:
     }
 
 
+_METRICS_TTL_SEC = 7 * 24 * 3600
+
+# (resolution, bucket format, bucket seconds); counters are rolled up into all three on write
+_ROLLUPS: Tuple[Tuple[str, str, int], ...] = (
+    ("minute", "%Y-%m-%d-%H-%M", 60),
+    ("hour", "%Y-%m-%d-%H", 3600),
+    ("day", "%Y-%m-%d", 86400),
+)
+
+
+def _rollup_retention_sec(resolution: str) -> int:
+    if resolution == "minute":
+        return int(settings.CLUSTER_METRICS_MINUTE_RETENTION_SEC)
+    if resolution == "day":
+        return int(settings.CLUSTER_METRICS_DAY_RETENTION_SEC)
+    return _METRICS_TTL_SEC
+
+
+def _bucket_start(now: datetime, seconds: int) -> int:
+    ts = int(now.replace(tzinfo=timezone.utc).timestamp())
+    return ts - ts % seconds
+
+
+def _new_sketch() -> DDSketch:
+    return DDSketch(settings.CLUSTER_METRICS_SKETCH_ACCURACY, settings.CLUSTER_METRICS_SKETCH_MIN_VALUE)
+
+
+_SKETCH_KEYS = _new_sketch()  # only used to map values to bin fields
+
+
+def _sketch_counts(value: float) -> Dict[str, int]:
+    """HINCRBY fields adding one value to a DDSketch hash."""
+    return {DDSketch.field_for(_SKETCH_KEYS.key(float(value))): 1, "n": 1}
+
+
+def _rollup_spec(resolution: str) -> Tuple[str, str, int]:
+    for spec in _ROLLUPS:
+        if spec[0] == resolution:
+            return spec
+    raise ValueError(f"unknown resolution: {resolution}")
+
+
+class _MetricsDelta:
+    """Counter increments not yet written to Redis.
+
+    Keys are resolved when a sample is recorded, so buffered samples land in the
+    bucket they happened in even if they are flushed later. Counters go to one hash
+    per minute/hour/day bucket, and each bucket is registered in a per-resolution
+    index sorted set (score = bucket start) so reads are a range query plus one
+    pipelined fetch instead of probing every possible bucket. Distance and
+    confidence distributions are DDSketch bins (see quantile_sketch.py), so every
+    bucket has a bounded number of fields no matter how many samples it covers.
+    """
+
+    def __init__(self) -> None:
+        self.incr: Dict[str, Dict[str, int]] = {}
+        self.incr_float: Dict[str, Dict[str, float]] = {}
+        self.index: Dict[str, Dict[str, float]] = {}
+        self.ttl: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.incr) + len(self.incr_float)
+
+    def __bool__(self) -> bool:
+        return bool(self.incr or self.incr_float or self.index)
+
+    def _incr(self, key: str, field: str, amount: int) -> None:
+        fields = self.incr.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+
+    def _incr_float(self, key: str, field: str, amount: float) -> None:
+        fields = self.incr_float.setdefault(key, {})
+        fields[field] = fields.get(field, 0.0) + amount
+
+    def _rollup(
+        self,
+        prefix: str,
+        index_prefix: str,
+        now: datetime,
+        counts: Dict[str, int],
+        floats: Dict[str, float] | None = None,
+    ) -> None:
+        for resolution, fmt, seconds in _ROLLUPS:
+            bucket = now.strftime(fmt)
+            key = f"{prefix}:{bucket}"
+            for field, amount in counts.items():
+                self._incr(key, field, amount)
+            for field, famount in (floats or {}).items():
+                self._incr_float(key, field, famount)
+            index_key = f"{index_prefix}:{resolution}"
+            self.index.setdefault(index_key, {})[bucket] = float(_bucket_start(now, seconds))
+            self.ttl[key] = self.ttl[index_key] = _rollup_retention_sec(resolution)
+
+    def add_online_assignment(self, os_name: str, cluster_id: str, distance: float, is_new_cluster: bool) -> None:
+        now = datetime.utcnow()
+        counts = {"total_assignments": 1}
+        if is_new_cluster:
+            counts["new_clusters"] = 1
+        self._rollup(f"cluster_metrics:online:{os_name}", f"cluster_metrics:index:online:{os_name}", now, counts)
+        # Track distance distribution (quantile sketch for percentile queries)
+        self._rollup(
+            f"cluster_metrics:sketch:distance:{os_name}",
+            f"cluster_metrics:index:sketch:distance:{os_name}",
+            now,
+            _sketch_counts(distance),
+        )
+
+    def add_llm_call(
+        self,
+        os_name: str,
+        cluster_id: str,
+        operation: str,
+        confidence: Optional[float],
+        tokens_used: int,
+        latency_ms: float,
+        success: bool,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached: bool = False,
+    ) -> None:
+        now = datetime.utcnow()
+        # Aggregate metrics by minute/hour/day; cost uses OpenAI pricing as default
+        self._rollup(
+            "cluster_metrics:llm",
+            "cluster_metrics:index:llm",
+            now,
+            {
+                "total_calls": 1,
+                "successful_calls" if success else "failed_calls": 1,
+                "cached_calls": 1 if cached else 0,
+                "prompt_tokens": int(prompt_tokens),
+                "completion_tokens": int(completion_tokens),
+            },
+            {
+                "total_tokens": float(tokens_used),
+                "total_latency_ms": float(latency_ms),
+                "total_cost_usd": (tokens_used / 1000.0) * settings.LLM_COST_PER_1K_TOKENS,
+            },
+        )
+        # Track confidence distribution
+        if confidence is not None:
+            self._rollup(
+                f"cluster_metrics:sketch:confidence:{os_name}",
+                f"cluster_metrics:index:sketch:confidence:{os_name}",
+                now,
+                _sketch_counts(confidence),
+            )
+
+    def merge(self, other: "_MetricsDelta") -> None:
+        for key, fields in other.incr.items():
+            for field, amount in fields.items():
+                self._incr(key, field, amount)
+        for key, ffields in other.incr_float.items():
+            for field, famount in ffields.items():
+                self._incr_float(key, field, famount)
+        for key, members in other.index.items():
+            self.index.setdefault(key, {}).update(members)
+        self.ttl.update(other.ttl)
+
+    def apply(self, pipe: Any) -> None:
+        """Queue the writes (plus one EXPIRE per key) on a sync or asyncio pipeline."""
+        keys = set(self.index)
+        for key, fields in self.incr.items():
+            for field, amount in fields.items():
+                pipe.hincrby(key, field, amount)
+            keys.add(key)
+        for key, ffields in self.incr_float.items():
+            for field, famount in ffields.items():
+                pipe.hincrbyfloat(key, field, famount)
+            keys.add(key)
+        now_ts = time.time()
+        for key, members in self.index.items():
+            pipe.zadd(key, members)
+            pipe.zremrangebyscore(key, "-inf", now_ts - self.ttl.get(key, _METRICS_TTL_SEC))
+        for key in keys:
+            pipe.expire(key, self.ttl.get(key, _METRICS_TTL_SEC))
+
+
+class ClusterMetricsBuffer:
+    """In-process accumulator for per-line online clustering and LLM call metrics.
+
+    Recording only updates dicts under a lock. A daemon thread flushes everything
+    every CLUSTER_METRICS_FLUSH_INTERVAL_SEC as one MULTI/EXEC pipeline over a shared
+    pooled (sync) client, so hot paths never create threads, loops or connections.
+    If a flush fails the delta is merged back for the next one; it stays bounded
+    because every sample lands in a fixed set of bucket/bin counters.
+    """
+
+    def __init__(self, redis_url: str | None = None) -> None:
+        self._redis_url = redis_url or settings.REDIS_URL
+        self._client: Any = None
+        self._lock = threading.Lock()
+        self._pending = _MetricsDelta()
+        self._flusher: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            import redis as redis_sync
+
+            self._client = redis_sync.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="cluster-metrics-flusher", daemon=True)
+                self._flusher.start()
+
+    def record_online_assignment(self, os_name: str, cluster_id: str, distance: float, is_new_cluster: bool) -> None:
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.add_online_assignment(os_name, cluster_id, distance, is_new_cluster)
+
+    def record_llm_call(
+        self,
+        os_name: str,
+        cluster_id: str,
+        operation: str,
+        confidence: Optional[float],
+        tokens_used: int,
+        latency_ms: float,
+        success: bool,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached: bool = False,
+    ) -> None:
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.add_llm_call(
+                os_name, cluster_id, operation, confidence, tokens_used, latency_ms, success,
+                prompt_tokens, completion_tokens, cached,
+            )
+
+    def flush(self) -> int:
+        """Write everything buffered in one transaction; returns the number of hashes updated."""
+        with self._lock:
+            delta, self._pending = self._pending, _MetricsDelta()
+        if not delta:
+            return 0
+        try:
+            pipe = self._get_client().pipeline(transaction=True)
+            delta.apply(pipe)
+            pipe.execute()
+            self.flushes += 1
+            return len(delta)
+        except Exception as exc:
+            self.failed_flushes += 1
+            LOG.debug("cluster metrics flush failed keys=%d err=%s", len(delta), exc)
+            with self._lock:
+                delta.merge(self._pending)
+                self._pending = delta
+            return 0
+
+    def _run(self) -> None:
+        interval = max(0.1, float(settings.CLUSTER_METRICS_FLUSH_INTERVAL_SEC))
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_keys": pending,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+_buffer: ClusterMetricsBuffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def get_metrics_buffer() -> ClusterMetricsBuffer:
+    """Process-wide metrics buffer (flushed on interpreter exit as well)."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ClusterMetricsBuffer()
+                atexit.register(_buffer.close)
+    return _buffer
+
+
 class ClusterMetricsTracker:
     """Tracks and stores cluster metrics in Redis."""
     
@@ -170,10 +619,13 @@ class ClusterMetricsTracker:
         """Record metrics from batch clustering operation."""
         timestamp = datetime.utcnow().isoformat() + 'Z'
         
-        # Calculate quality metrics
-        silhouette = calculate_silhouette_score(clusters, embeddings)
-        cohesion = calculate_cohesion(clusters, embeddings)
-        separation = calculate_separation(clusters, embeddings)
+        # Calculate quality metrics (CPU-bound; keep it off the event loop)
+        started = time.perf_counter()
+        quality = await asyncio.to_thread(compute_quality_metrics, clusters, embeddings)
+        silhouette = quality["silhouette_score"]
+        cohesion = quality["cohesion"]
+        separation = quality["separation"]
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
         
         # Cluster size distribution
         sizes = [len(c) for c in clusters]
@@ -188,6 +640,10 @@ class ClusterMetricsTracker:
             "silhouette_score": silhouette,
             "cohesion": cohesion,
             "separation": separation,
+            "silhouette_ci95": quality["silhouette_ci95"],
+            "metrics_mode": quality["metrics_mode"],
+            "metrics_sample_size": quality["metrics_sample_size"],
+            "metrics_elapsed_ms": round(elapsed_ms, 1),
             "threshold": threshold,
             "min_size": min_size,
             "cluster_size_mean": size_stats["mean"],
@@ -196,17 +652,21 @@ class ClusterMetricsTracker:
             "cluster_size_max": size_stats["max"],
         }
         
-        # Store in Redis with TTL (keep for 7 days)
-        key = f"cluster_metrics:batch:{os_name}:{int(time.time())}"
-        await self.redis.setex(key, 7 * 24 * 3600, json.dumps(metrics))
-        
-        # Update latest metrics
+        # Store in a timestamp-scored index (keep for 7 days) and update latest metrics
+        now_ts = time.time()
+        payload = json.dumps(metrics)
+        index_key = f"cluster_metrics:index:batch:{os_name}"
         latest_key = f"cluster_metrics:latest:batch:{os_name}"
-        await self.redis.setex(latest_key, 7 * 24 * 3600, json.dumps(metrics))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(index_key, {payload: now_ts})
+            pipe.zremrangebyscore(index_key, "-inf", now_ts - _METRICS_TTL_SEC)
+            pipe.expire(index_key, _METRICS_TTL_SEC)
+            pipe.setex(latest_key, _METRICS_TTL_SEC, payload)
+            await pipe.execute()
         
         LOG.info(
-            "batch clustering metrics os=%s clusters=%d silhouette=%.3f cohesion=%.3f separation=%.3f",
-            os_name, len(clusters), silhouette, cohesion, separation
+            "batch clustering metrics os=%s clusters=%d silhouette=%.3f cohesion=%.3f separation=%.3f mode=%s sample=%d",
+            os_name, len(clusters), silhouette, cohesion, separation, quality["metrics_mode"], quality["metrics_sample_size"]
         )
         
         return metrics
@@ -218,21 +678,10 @@ class ClusterMetricsTracker:
         distance: float,
         is_new_cluster: bool,
     ) -> None:
-        """Record a single online cluster assignment."""
-        timestamp = datetime.utcnow().isoformat() + 'Z'
-        
-        # Increment counters
-        hour_key = f"cluster_metrics:online:{os_name}:{datetime.utcnow().strftime('%Y-%m-%d-%H')}"
-        await self.redis.hincrby(hour_key, "total_assignments", 1)  # type: ignore[misc]
-        await self.redis.expire(hour_key, 7 * 24 * 3600)  # type: ignore[misc]
-        
-        if is_new_cluster:
-            await self.redis.hincrby(hour_key, "new_clusters", 1)  # type: ignore[misc]
-        
-        # Track distance distribution (store in sorted set for percentile queries)
-        distance_key = f"cluster_metrics:distances:{os_name}:{datetime.utcnow().strftime('%Y-%m-%d-%H')}"
-        await self.redis.zadd(distance_key, {f"{timestamp}:{cluster_id}": distance})
-        await self.redis.expire(distance_key, 7 * 24 * 3600)
+        """Record a single online cluster assignment (one pipelined round-trip)."""
+        delta = _MetricsDelta()
+        delta.add_online_assignment(os_name, cluster_id, distance, is_new_cluster)
+        await self._apply(delta)
     
     async def record_llm_call(
         self,
@@ -243,105 +692,123 @@ class ClusterMetricsTracker:
         tokens_used: int,
         latency_ms: float,
         success: bool,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached: bool = False,
     ) -> None:
-        """Record LLM call metrics."""
-        timestamp = datetime.utcnow().isoformat() + 'Z'
-        
-        # Aggregate metrics by hour
-        hour_key = f"cluster_metrics:llm:{datetime.utcnow().strftime('%Y-%m-%d-%H')}"
-        await self.redis.hincrby(hour_key, "total_calls", 1)  # type: ignore[misc]
-        await self.redis.hincrbyfloat(hour_key, "total_tokens", float(tokens_used))  # type: ignore[misc]
-        await self.redis.hincrbyfloat(hour_key, "total_latency_ms", latency_ms)  # type: ignore[misc]
-        await self.redis.expire(hour_key, 7 * 24 * 3600)  # type: ignore[misc]
-        
-        if success:
-            await self.redis.hincrby(hour_key, "successful_calls", 1)  # type: ignore[misc]
-        else:
-            await self.redis.hincrby(hour_key, "failed_calls", 1)  # type: ignore[misc]
-        
-        # Track confidence distribution
-        if confidence is not None:
-            confidence_key = f"cluster_metrics:llm:confidence:{datetime.utcnow().strftime('%Y-%m-%d-%H')}"
-            await self.redis.zadd(confidence_key, {f"{timestamp}:{cluster_id}": confidence})
-            await self.redis.expire(confidence_key, 7 * 24 * 3600)
-        
-        # Calculate cost (using OpenAI pricing as default)
-        cost = (tokens_used / 1000.0) * settings.LLM_COST_PER_1K_TOKENS
-        await self.redis.hincrbyfloat(hour_key, "total_cost_usd", cost)  # type: ignore[misc]
+        """Record LLM call metrics (one pipelined round-trip)."""
+        delta = _MetricsDelta()
+        delta.add_llm_call(
+            os_name, cluster_id, operation, confidence, tokens_used, latency_ms, success,
+            prompt_tokens, completion_tokens, cached,
+        )
+        await self._apply(delta)
+
+    async def _apply(self, delta: "_MetricsDelta") -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            delta.apply(pipe)
+            await pipe.execute()
     
     async def get_quality_metrics(self, os_name: str, hours: int = 24) -> List[Dict[str, Any]]:
-        """Retrieve quality metrics for the last N hours."""
-        pattern = f"cluster_metrics:batch:{os_name}:*"
-        keys = []
-        cursor = 0
-        
-        # Scan for matching keys
-        while True:
-            cursor, batch = await self.redis.scan(cursor, match=pattern, count=100)
-            keys.extend(batch)
-            if cursor == 0:
-                break
-        
-        # Retrieve and parse metrics
-        metrics = []
-        for key in keys:
-            data = await self.redis.get(key)
-            if data:
-                try:
-                    metrics.append(json.loads(data))
-                except json.JSONDecodeError:
-                    pass
-        
-        # Sort by timestamp (most recent first)
-        metrics.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        
-        return metrics
-    
-    async def get_online_metrics(self, os_name: str, hours: int = 24) -> List[Dict[str, Any]]:
-        """Retrieve online clustering metrics for the last N hours."""
+        """Retrieve quality metrics for the last N hours (most recent first)."""
+        since = time.time() - hours * 3600
+        members = await self.redis.zrevrangebyscore(f"cluster_metrics:index:batch:{os_name}", "+inf", since)
         metrics = []
-        now = datetime.utcnow()
-        
-        for hour_offset in range(hours):
-            hour_dt = now - timedelta(hours=hour_offset)
-            hour_str = hour_dt.strftime('%Y-%m-%d-%H')
-            
-            hour_key = f"cluster_metrics:online:{os_name}:{hour_str}"
-            data = await self.redis.hgetall(hour_key)  # type: ignore[misc]
-            
-            if data:
-                metrics.append({
-                    "hour": hour_str,
-                    "total_assignments": int(data.get("total_assignments", 0)),
-                    "new_clusters": int(data.get("new_clusters", 0)),
-                })
-        
+        for data in members:
+            try:
+                metrics.append(json.loads(data))
+            except json.JSONDecodeError:
+                pass
         return metrics
+
+    async def _read_rollup(
+        self, prefix: str, index_prefix: str, hours: int, resolution: str
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        """Buckets of one resolution covering the last N hours, most recent first.
+
+        One ZREVRANGEBYSCORE on the bucket index plus one pipelined HGETALL per
+        existing bucket; empty buckets are never touched.
+        """
+        _, _, seconds = _rollup_spec(resolution)
+        oldest = datetime.utcnow() - timedelta(seconds=max(hours * 3600 - seconds, 0))
+        buckets = await self.redis.zrevrangebyscore(
+            f"{index_prefix}:{resolution}", "+inf", _bucket_start(oldest, seconds)
+        )
+        if not buckets:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for bucket in buckets:
+                pipe.hgetall(f"{prefix}:{bucket}")
+            rows = await pipe.execute()
+        return [(bucket, data) for bucket, data in zip(buckets, rows) if data]
+
+    async def get_online_metrics(self, os_name: str, hours: int = 24, resolution: str = "hour") -> List[Dict[str, Any]]:
+        """Retrieve online clustering metrics for the last N hours, bucketed by minute, hour or day."""
+        rows = await self._read_rollup(
+            f"cluster_metrics:online:{os_name}", f"cluster_metrics:index:online:{os_name}", hours, resolution
+        )
+        return [
+            {
+                resolution: bucket,
+                "total_assignments": int(data.get("total_assignments", 0)),
+                "new_clusters": int(data.get("new_clusters", 0)),
+            }
+            for bucket, data in rows
+        ]
     
-    async def get_llm_metrics(self, hours: int = 24) -> List[Dict[str, Any]]:
-        """Retrieve LLM usage metrics for the last N hours."""
+    async def _read_sketch(
+        self, series: str, os_name: str, hours: int, resolution: str, quantiles: Sequence[float]
+    ) -> Dict[str, Any]:
+        rows = await self._read_rollup(
+            f"cluster_metrics:sketch:{series}:{os_name}",
+            f"cluster_metrics:index:sketch:{series}:{os_name}",
+            hours,
+            resolution,
+        )
+        total = _new_sketch()
+        buckets = []
+        for bucket, data in rows:
+            sketch = DDSketch.from_fields(data, total.relative_accuracy, total.min_value)
+            total.merge(sketch)
+            buckets.append({resolution: bucket, "count": sketch.count, **sketch.quantiles(quantiles)})
+        return {
+            "os": os_name,
+            "count": total.count,
+            **total.quantiles(quantiles),
+            "relative_accuracy": total.relative_accuracy,
+            "buckets": buckets,
+        }
+
+    async def get_distance_percentiles(
+        self, os_name: str, hours: int = 24, resolution: str = "hour", quantiles: Sequence[float] = (0.5, 0.9, 0.99)
+    ) -> Dict[str, Any]:
+        """Online assignment distance percentiles over the last N hours, overall and per bucket."""
+        return await self._read_sketch("distance", os_name, hours, resolution, quantiles)
+
+    async def get_confidence_percentiles(
+        self, os_name: str, hours: int = 24, resolution: str = "hour", quantiles: Sequence[float] = (0.5, 0.9, 0.99)
+    ) -> Dict[str, Any]:
+        """LLM classification confidence percentiles over the last N hours, overall and per bucket."""
+        return await self._read_sketch("confidence", os_name, hours, resolution, quantiles)
+
+    async def get_llm_metrics(self, hours: int = 24, resolution: str = "hour") -> List[Dict[str, Any]]:
+        """Retrieve LLM usage metrics for the last N hours, bucketed by minute, hour or day."""
         metrics = []
-        now = datetime.utcnow()
-        
-        for hour_offset in range(hours):
-            hour_dt = now - timedelta(hours=hour_offset)
-            hour_str = hour_dt.strftime('%Y-%m-%d-%H')
-            
-            hour_key = f"cluster_metrics:llm:{hour_str}"
-            data = await self.redis.hgetall(hour_key)  # type: ignore[misc]
-            
-            if data:
-                total_calls = int(data.get("total_calls", 0))
-                metrics.append({
-                    "hour": hour_str,
-                    "total_calls": total_calls,
-                    "successful_calls": int(data.get("successful_calls", 0)),
-                    "failed_calls": int(data.get("failed_calls", 0)),
-                    "total_tokens": int(float(data.get("total_tokens", 0))),
-                    "total_latency_ms": float(data.get("total_latency_ms", 0)),
-                    "total_cost_usd": float(data.get("total_cost_usd", 0)),
-                    "avg_latency_ms": float(data.get("total_latency_ms", 0)) / total_calls if total_calls > 0 else 0,
-                })
+        rows = await self._read_rollup("cluster_metrics:llm", "cluster_metrics:index:llm", hours, resolution)
+        for bucket, data in rows:
+            total_calls = int(data.get("total_calls", 0))
+            metrics.append({
+                resolution: bucket,
+                "total_calls": total_calls,
+                "successful_calls": int(data.get("successful_calls", 0)),
+                "failed_calls": int(data.get("failed_calls", 0)),
+                "total_tokens": int(float(data.get("total_tokens", 0))),
+                "prompt_tokens": int(data.get("prompt_tokens", 0)),
+                "completion_tokens": int(data.get("completion_tokens", 0)),
+                "cached_calls": int(data.get("cached_calls", 0)),
+                "total_latency_ms": float(data.get("total_latency_ms", 0)),
+                "total_cost_usd": float(data.get("total_cost_usd", 0)),
+                "avg_latency_ms": float(data.get("total_latency_ms", 0)) / total_calls if total_calls > 0 else 0,
+            })
         
         return metrics
-
@@ -7,10 +7,13 @@ import math
 import logging
 import asyncio
 
+import numpy as np
+
 from app.core.config import settings
 from app.core.runtime_state import is_shutting_down
 from app.services.chroma_service import ChromaClientProvider
 from app.services.failure_rules import match_failure_signals
+from app.services.prototype_index import get_prototype_index
 
 LOG = logging.getLogger(__name__)
 
@@ -47,34 +50,6 @@ def _proto_collection_name(os_name: str) -> str:
     return f"{settings.CHROMA_PROTO_COLLECTION_PREFIX}{_suffix_for_os(os_name)}"
 
 
-def _l2_norm(vec: List[float]) -> float:
-    return math.sqrt(sum(v * v for v in vec)) or 1.0
-
-
-def _normalize(vec: List[float]) -> List[float]:
-    n = _l2_norm(vec)
-    return [v / n for v in vec]
-
-
-def _cosine_distance(a: List[float], b: List[float]) -> float:
-    # expects normalized vectors
-    dot = sum(x * y for x, y in zip(a, b))
-    # numeric stability on bounds
-    dot = max(min(dot, 1.0), -1.0)
-    return 1.0 - dot
-
-
-def _mean(vectors: List[List[float]]) -> List[float]:
-    if not vectors:
-        return []
-    dim = len(vectors[0])
-    acc = [0.0] * dim
-    for v in vectors:
-        for i in range(dim):
-            acc[i] += v[i]
-    return [x / float(len(vectors)) for x in acc]
-
-
 @dataclass
 class Prototype:
     cluster_id: str
@@ -86,6 +61,16 @@ class Prototype:
     exemplar_ids: List[str]
 
 
+def _normalize_rows(embeddings: Any) -> np.ndarray:
+    """Row-wise L2 normalization; zero rows stay zero."""
+    matrix = np.asarray(embeddings, dtype=np.float64)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+    norms[norms == 0.0] = 1.0
+    return matrix / norms[:, None]
+
+
 def _single_pass_cluster(
     embeddings: List[List[float]],
     threshold: float,
@@ -93,48 +78,60 @@ def _single_pass_cluster(
 ) -> Tuple[List[List[int]], List[List[float]]]:
     """Simple incremental clustering by cosine distance to current centroids.
 
+    Each vector joins the nearest centroid when within `threshold`, otherwise it
+    starts a new cluster. A centroid is the renormalized mean of its (normalized)
+    members; since normalization is scale invariant this is kept as a running sum per
+    cluster, and distances to all centroids are one matrix-vector product over a
+    preallocated, doubling centroid matrix.
+
     Returns (clusters_indices, centroids).
     """
-    normalized = [_normalize(e) for e in embeddings]
+    if len(embeddings) == 0:
+        return [], []
+    normalized = _normalize_rows(embeddings)
+    n, dim = normalized.shape
+    capacity = 64
+    centroids = np.empty((capacity, dim), dtype=np.float64)
+    sums = np.empty((capacity, dim), dtype=np.float64)
     clusters: List[List[int]] = []
-    centroids: List[List[float]] = []
-
-    for idx, vec in enumerate(normalized):
-        if not centroids:
-            clusters.append([idx])
-            centroids.append(vec[:])
-            continue
-        # find nearest centroid
-        distances = [_cosine_distance(vec, c) for c in centroids]
-        best_i = min(range(len(distances)), key=lambda i: distances[i])
-        if distances[best_i] <= threshold:
-            clusters[best_i].append(idx)
-            # update centroid as mean of members (on normalized vectors), then renormalize
-            members = [normalized[i] for i in clusters[best_i]]
-            centroids[best_i] = _normalize(_mean(members))
-        else:
-            clusters.append([idx])
-            centroids.append(vec[:])
+    count = 0
+
+    for idx in range(n):
+        vec = normalized[idx]
+        if count:
+            dots = centroids[:count] @ vec
+            np.clip(dots, -1.0, 1.0, out=dots)
+            best_i = int(np.argmax(dots))  # first minimum of 1 - dot
+            if 1.0 - dots[best_i] <= threshold:
+                clusters[best_i].append(idx)
+                sums[best_i] += vec
+                norm = math.sqrt(float(sums[best_i] @ sums[best_i])) or 1.0
+                centroids[best_i] = sums[best_i] / norm
+                continue
+        if count == capacity:
+            capacity *= 2
+            centroids = np.concatenate([centroids, np.empty_like(centroids)])
+            sums = np.concatenate([sums, np.empty_like(sums)])
+        clusters.append([idx])
+        centroids[count] = vec
+        sums[count] = vec
+        count += 1
 
     # filter small clusters
     filtered: List[List[int]] = []
     filtered_centroids: List[List[float]] = []
-    for c, ctr in zip(clusters, centroids):
+    for ci, c in enumerate(clusters):
         if len(c) >= max(1, min_size):
             filtered.append(c)
-            filtered_centroids.append(ctr)
+            filtered_centroids.append(centroids[ci].tolist())
     return filtered, filtered_centroids
 
 
-def _medoid_index(indices: List[int], vectors: List[List[float]], centroid: List[float]) -> int:
-    best_idx = indices[0]
-    best_dist = 1e9
-    for i in indices:
-        d = _cosine_distance(vectors[i], centroid)
-        if d < best_dist:
-            best_dist = d
-            best_idx = i
-    return best_idx
+def _medoid_index(indices: List[int], normalized: np.ndarray, centroid: List[float]) -> int:
+    """Member closest (cosine) to the centroid; first one wins ties."""
+    dots = normalized[indices] @ np.asarray(centroid, dtype=np.float64)
+    np.clip(dots, -1.0, 1.0, out=dots)
+    return indices[int(np.argmax(dots))]
 
 
 def _label_cluster(documents: List[str]) -> Tuple[str, str]:
@@ -159,12 +156,10 @@ def build_prototypes(
     centroids: List[List[float]],
 ) -> List[Prototype]:
     prototypes: List[Prototype] = []
+    normalized = _normalize_rows(embeddings) if clusters else None
     for ci, member_indices in enumerate(clusters):
         centroid = centroids[ci]
-        medoid_local = _medoid_index(member_indices, [
-            _normalize(e) for e in embeddings
-        ], centroid)
-        medoid_global = medoid_local
+        medoid_global = _medoid_index(member_indices, normalized, centroid)  # type: ignore[arg-type]
         medoid_doc = documents[medoid_global]
         label, rationale = _label_cluster([documents[i] for i in member_indices])
         proto = Prototype(
@@ -218,6 +213,8 @@ def upsert_prototypes(os_name: str, provider: ChromaClientProvider, prototypes:
             dim,
         )
         raise
+    # Batch prototypes may rewrite existing ids; rebuild the online index on next use
+    get_prototype_index(os_name).invalidate()
     return len(prototypes)
 
 
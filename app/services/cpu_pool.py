@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from app.core.config import settings
+from app.parsers.pipeline import ParsedLine, parse_lines_batch
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def get_cpu_pool() -> ProcessPoolExecutor | None:
+    """Return the shared process pool, or None when CPU_POOL_WORKERS is 0.
+
+    Uses the spawn start method: workers never inherit the parent's threads, event
+    loops, Redis connections or model weights.
+    """
+    global _pool
+    workers = int(settings.CPU_POOL_WORKERS or 0)
+    if workers <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                LOG.info("cpu pool started workers=%d", workers)
+    return _pool
+
+
+def start_cpu_pool() -> None:
+    """Start the pool and, when local embeddings are pooled, load the model in a worker
+    and resolve its name. Blocking: call from a thread at startup, never on a loop."""
+    global _pool_embedding_name
+    pool = get_cpu_pool()
+    if pool is None or not settings.CPU_POOL_EMBEDDING or not uses_local_embedding_model():
+        return
+    if _pool_embedding_name is None:
+        _pool_embedding_name = pool.submit(_worker_embedding_name).result()
+        LOG.info("cpu pool embedding model ready name=%s", _pool_embedding_name)
+
+
+def shutdown_cpu_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any, in_process: bool = False) -> T:
+    """Run a picklable CPU-bound callable off the event loop.
+
+    Goes to the process pool when one is configured, otherwise (or with
+    `in_process=True`, for work that depends on process-local state) to a thread.
+    """
+    pool = None if in_process else get_cpu_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, partial(fn, *args))
+
+
+async def parse_lines(
+    items: Sequence[Tuple[str, str]], *, with_rules: bool = False, mine: bool = True
+) -> List[Optional[ParsedLine]]:
+    """Parse/template (os_name, line) pairs in one batched work item.
+
+    `mine=False` only looks Drain templates up, for lines another stage mines.
+    """
+    if not items:
+        return []
+    # The Drain tree is per-process state; mining it in pool workers would fork template ids
+    stateful = (settings.TEMPLATER or "regex").strip().lower() == "drain"
+    return await run_cpu(parse_lines_batch, list(items), with_rules, mine, in_process=stateful)
+
+
+# ---- Local embedding models in pool workers ----
+
+_worker_embedding_fn: Any = None
+# Name of the pooled model, resolved once by start_cpu_pool (Chroma asks for it on the loop)
+_pool_embedding_name: str | None = None
+
+
+def _get_worker_embedding_fn() -> Any:
+    global _worker_embedding_fn
+    if _worker_embedding_fn is None:
+        from app.services.embedding import LogBERTEmbeddingFunction, SentenceTransformerEmbeddingFunction
+
+        if settings.EMBEDDING_PROVIDER.lower() == "logbert":
+            _worker_embedding_fn = LogBERTEmbeddingFunction(
+                model_name=settings.LOGBERT_MODEL_NAME,
+                device=settings.LOGBERT_DEVICE,
+            )
+        else:
+            _worker_embedding_fn = SentenceTransformerEmbeddingFunction(settings.EMBEDDING_MODEL_NAME)
+    return _worker_embedding_fn
+
+
+def _worker_embed(texts: List[str]) -> List[List[float]]:
+    vectors = _get_worker_embedding_fn()(texts)
+    return [vec.tolist() if hasattr(vec, "tolist") else list(vec) for vec in vectors]
+
+
+def _worker_embedding_name() -> str:
+    return str(_get_worker_embedding_fn().name())
+
+
+def uses_local_embedding_model(embedding_model_name: str | None = None) -> bool:
+    """True when the configured provider runs a model in-process (and can be pooled)."""
+    provider = settings.EMBEDDING_PROVIDER.lower()
+    if provider == "sentence-transformers":
+        return embedding_model_name is None
+    return provider == "logbert" and not settings.LOGBERT_BASE_URL
+
+
+class ProcessPoolEmbeddingFunction:
+    """Embedding function that runs the local model (SentenceTransformer / LogBERT) in the CPU pool.
+
+    Each worker loads the model once; batches are shipped as plain lists. `name()`
+    is resolved from a worker by start_cpu_pool at startup so collection names match
+    the in-process function without blocking an event loop. Calls block on the pool
+    and must run in worker threads (asyncio.to_thread), as every loop-side caller does.
+    `model_name` is the model the workers load, so caches keyed by it stay per model.
+    """
+
+    def __init__(self) -> None:
+        self._name: str | None = None
+        if settings.EMBEDDING_PROVIDER.lower() == "logbert":
+            self.model_name = settings.LOGBERT_MODEL_NAME
+        else:
+            self.model_name = settings.EMBEDDING_MODEL_NAME
+
+    def _pool(self) -> ProcessPoolExecutor:
+        pool = get_cpu_pool()
+        if pool is None:
+            raise RuntimeError("CPU pool is disabled (CPU_POOL_WORKERS=0)")
+        return pool
+
+    def __call__(self, input: Iterable[str]) -> List[List[float]]:
+        texts = [value if isinstance(value, str) else str(value) for value in list(input)]
+        if not texts:
+            return []
+        return self._pool().submit(_worker_embed, texts).result()
+
+    def name(self) -> str:
+        if self._name is None:
+            # Only blocks when used before start_cpu_pool (scripts, tests)
+            self._name = _pool_embedding_name or self._pool().submit(_worker_embedding_name).result()
+        return self._name
+
+    def embed_documents(self, input: Iterable[str]) -> List[List[float]]:
+        return self(list(input))
+
+    def embed_query(self, input: str) -> List[List[float]]:
+        return self([input])
@@ -6,7 +6,7 @@ import logging
 
 from app.core.config import settings
 from app.services.chroma_service import ChromaClientProvider
-from app.services.clustering_service import _single_pass_cluster, _normalize, _cosine_distance
+from app.services.clustering_service import _medoid_index, _normalize_rows, _single_pass_cluster
 import numpy as np  # type: ignore
 try:
     import hdbscan  # type: ignore
@@ -51,17 +51,6 @@ def _proto_collection_name(os_name: str) -> str:
     return f"{settings.CHROMA_PROTO_COLLECTION_PREFIX}{key}"
 
 
-def _compute_medoid_index(indices: List[int], vectors: List[List[float]], centroid: List[float]) -> int:
-    best_idx = indices[0]
-    best_dist = 1e9
-    for i in indices:
-        d = _cosine_distance(vectors[i], centroid)
-        if d < best_dist:
-            best_dist = d
-            best_idx = i
-    return best_idx
-
-
 def compute_global_clusters(
     *,
     limit_per_source: int = 200,
@@ -140,12 +129,12 @@ def compute_global_clusters(
     clusters, centroids = _single_pass_cluster(embs, threshold=thr, min_size=ms)
 
     # Normalize embeddings once for medoid computation
-    normalized = [_normalize(v) for v in embs]
+    normalized = _normalize_rows(embs)
 
     out_clusters: List[Dict[str, Any]] = []
     for ci, member_indices in enumerate(clusters):
         centroid = centroids[ci]
-        medoid_idx_local = _compute_medoid_index(member_indices, normalized, centroid)
+        medoid_idx_local = _medoid_index(member_indices, normalized, centroid)
         # medoid_idx_local is global since member_indices stores global indices
         medoid_global_idx = medoid_idx_local
 
@@ -352,7 +341,7 @@ def compute_global_prototype_clusters_hdbscan(
         # Convert to list for downstream
         centroid = centroid_vec.tolist()
         # Compute medoid using cosine distance on normalized vectors
-        medoid_global_idx = _compute_medoid_index(member_indices, [r.tolist() for r in X_norm], centroid)
+        medoid_global_idx = _medoid_index(member_indices, X_norm, centroid)
 
         # Aggregate source/os counts by sampling logs assigned to each prototype id
         src_counts: Dict[str, int] = {}
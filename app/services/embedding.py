@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, List
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Sequence
+import hashlib
 import logging
 import threading
 import time
@@ -23,6 +25,7 @@ class SentenceTransformerEmbeddingFunction:
     """
 
     def __init__(self, model_name: str) -> None:
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
 
     def __call__(self, input: Iterable[str]) -> List[List[float]]:
@@ -377,3 +380,203 @@ class OllamaEmbeddingFunction:
 
     def embed_query(self, input: str) -> List[List[float]]:
         return self([input])
+
+
+class EmbeddingCache:
+    """Bounded LRU of embeddings shared by every provider in the process.
+
+    Entries are keyed by provider (name and model) plus a SHA-1 of the text, so templated lines
+    that repeat across batches (and across consumers) are embedded only once. When a
+    Redis URL is given, misses are looked up in (and results written to) Redis so
+    several worker processes share one cache.
+    """
+
+    def __init__(self, max_entries: int, redis_url: str | None = None, redis_ttl_sec: int = 7 * 24 * 3600) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.redis_ttl_sec = int(redis_ttl_sec)
+        self._entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis: Any = None
+        self._redis_retry_at = 0.0
+        if redis_url:
+            import redis as _redis_sync
+            self._redis = _redis_sync.Redis.from_url(redis_url)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8", errors="replace")).hexdigest()
+
+    @staticmethod
+    def _redis_key(provider: str, digest: str) -> str:
+        return f"embcache:{provider}:{digest}"
+
+    def _redis_available(self) -> bool:
+        return self._redis is not None and time.time() >= self._redis_retry_at
+
+    def _redis_failed(self, exc: Exception) -> None:
+        # Back off for a minute instead of paying a connection timeout per batch
+        self._redis_retry_at = time.time() + 60.0
+        logging.getLogger(__name__).warning("embedding cache: redis tier unavailable err=%s", exc)
+
+    def get_many(self, provider: str, texts: Sequence[str]) -> List[np.ndarray | None]:
+        digests = [self._digest(t) for t in texts]
+        found: List[np.ndarray | None] = []
+        with self._lock:
+            for digest in digests:
+                vec = self._entries.get((provider, digest))
+                if vec is not None:
+                    self._entries.move_to_end((provider, digest))
+                found.append(vec)
+        missing = [i for i, vec in enumerate(found) if vec is None]
+        if missing and self._redis_available():
+            try:
+                raw = self._redis.mget([self._redis_key(provider, digests[i]) for i in missing])
+                promoted: List[tuple[str, np.ndarray]] = []
+                for i, blob in zip(missing, raw):
+                    if blob:
+                        vec = np.frombuffer(blob, dtype=np.float32)
+                        found[i] = vec
+                        promoted.append((digests[i], vec))
+                if promoted:
+                    self._store(provider, promoted)
+                    with self._lock:
+                        self.redis_hits += len(promoted)
+            except Exception as exc:
+                self._redis_failed(exc)
+        with self._lock:
+            missed = sum(1 for vec in found if vec is None)
+            self.misses += missed
+            self.hits += len(found) - missed
+        return found
+
+    def put_many(self, provider: str, texts: Sequence[str], vectors: Sequence[np.ndarray]) -> None:
+        items = [(self._digest(t), v) for t, v in zip(texts, vectors)]
+        self._store(provider, items)
+        if items and self._redis_available():
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for digest, vec in items:
+                    pipe.set(self._redis_key(provider, digest), vec.tobytes(), ex=self.redis_ttl_sec)
+                pipe.execute()
+            except Exception as exc:
+                self._redis_failed(exc)
+
+    def _store(self, provider: str, items: Sequence[tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            for digest, vec in items:
+                self._entries[(provider, digest)] = vec
+                self._entries.move_to_end((provider, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "redis_enabled": self._redis is not None,
+            }
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+                    redis_url=settings.REDIS_URL if settings.EMBEDDING_CACHE_REDIS_ENABLED else None,
+                    redis_ttl_sec=settings.EMBEDDING_CACHE_REDIS_TTL_SEC,
+                )
+    return _cache
+
+
+def get_embedding_cache_stats() -> Dict[str, Any]:
+    return {"enabled": bool(settings.EMBEDDING_CACHE_ENABLED), **get_embedding_cache().stats()}
+
+
+class CachedEmbeddingFunction:
+    """Caching wrapper usable around any of the embedding functions above.
+
+    Only texts missing from the cache are forwarded to the wrapped function, in a
+    single call. Vectors are returned as float32 numpy arrays.
+
+    `name()` stays the wrapped function's name (Chroma checks it against existing
+    collections); the cache namespace also carries the model id, since some names
+    (sentence-transformers) only encode the dimension.
+    """
+
+    def __init__(self, inner: Any, cache: EmbeddingCache | None = None) -> None:
+        self.inner = inner
+        self.cache = cache or get_embedding_cache()
+        self._name = str(getattr(inner, "name", lambda: type(inner).__name__)())
+        model = getattr(inner, "model_name", None) or getattr(inner, "model", None)
+        if isinstance(model, str) and model and model not in self._name:
+            self._provider_key = f"{self._name}::{model}"
+        else:
+            self._provider_key = self._name
+
+    def __call__(self, input: Iterable[str]) -> List[np.ndarray]:
+        texts: List[str] = []
+        for value in list(input):
+            if isinstance(value, str):
+                texts.append(value)
+            elif isinstance(value, (list, tuple)):
+                texts.append(" ".join(map(str, value)))
+            elif value is None:
+                texts.append("")
+            else:
+                texts.append(str(value))
+        if not texts:
+            return []
+
+        found = self.cache.get_many(self._provider_key, texts)
+        pending: Dict[str, List[int]] = {}
+        for i, vec in enumerate(found):
+            if vec is None:
+                pending.setdefault(texts[i], []).append(i)
+        if pending:
+            to_embed = list(pending.keys())
+            raw = list(self.inner(to_embed))
+            if len(raw) != len(to_embed) or any(vec is None for vec in raw):
+                # Dropping slots would misalign vectors with their ids downstream
+                raise RuntimeError(
+                    f"embedding provider {self._name} returned {len(raw)} vectors for {len(to_embed)} texts"
+                )
+            computed = [np.asarray(vec, dtype=np.float32) for vec in raw]
+            self.cache.put_many(self._provider_key, to_embed, computed)
+            for text, vec in zip(to_embed, computed):
+                for i in pending[text]:
+                    found[i] = vec
+        return found  # type: ignore[return-value]
+
+    def name(self) -> str:
+        return self._name
+
+    def embed_documents(self, input: Iterable[str]) -> List[np.ndarray]:
+        return self(list(input))
+
+    def embed_query(self, input: str) -> List[np.ndarray]:
+        return self([input])
+
+    def __getattr__(self, item: str) -> Any:
+        # Delegate anything else Chroma may probe (e.g. default_space) to the wrapped function
+        if item == "inner":
+            raise AttributeError(item)
+        return getattr(self.inner, item)
@@ -10,6 +10,7 @@ from typing import Any, Deque, Dict, Tuple
 import redis.asyncio as aioredis
 
 from app.core.config import get_settings
+from app.streams.metrics_stream import METRICS_STREAM, decode_entry
 
 
 LOG = logging.getLogger(__name__)
@@ -64,7 +65,7 @@ async def run_failure_prediction() -> None:
     redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
     predictor = FailurePredictor()
 
-    stream = "metrics"
+    stream = METRICS_STREAM
     group = "predictors"
     consumer = "predictor_1"
 
@@ -87,27 +88,40 @@ async def run_failure_prediction() -> None:
         for _, messages in rows:
             for msg_id, fields in messages:
                 try:
-                    host = ""
-                    try:
-                        resource = json.loads(fields.get("resource") or "{}")
-                        host = str(resource.get("host") or "")
-                    except Exception:
-                        host = ""
-                    name = str(fields.get("name") or "")
-                    value = float(fields.get("value") or 0)
-                    if not host or not name:
-                        ack_ids.append(msg_id)
-                        continue
-                    alerts = predictor.ingest(host, name, value)
-                    # For now, write alerts to a debug Redis key; future: unify with incidents
-                    if alerts:
-                        key = f"predict:{host}:{name}"
+                    points = decode_entry(fields)
+                except Exception as exc:
+                    # Retrying won't make it decodable (e.g. msgpack entry, msgpack not installed)
+                    LOG.warning(
+                        "predictor: skipping undecodable entry id=%s encoding=%s codec=%s err=%s",
+                        msg_id,
+                        fields.get("encoding"),
+                        fields.get("codec"),
+                        exc,
+                    )
+                    ack_ids.append(msg_id)
+                    continue
+                try:
+                    for point in points:
+                        resource = point.get("resource") or {}
+                        host = str(resource.get("host") or "") if isinstance(resource, dict) else ""
+                        name = str(point.get("name") or "")
                         try:
-                            await redis.set(key, json.dumps({"last": alerts[-1]}), ex=3600)
-                        except Exception:
-                            pass
+                            value = float(point.get("value") or 0)
+                        except (TypeError, ValueError):
+                            continue
+                        if not host or not name:
+                            continue
+                        alerts = predictor.ingest(host, name, value)
+                        # For now, write alerts to a debug Redis key; future: unify with incidents
+                        if alerts:
+                            key = f"predict:{host}:{name}"
+                            try:
+                                await redis.set(key, json.dumps({"last": alerts[-1]}), ex=3600)
+                            except Exception:
+                                pass
                     ack_ids.append(msg_id)
-                except Exception:
+                except Exception as exc:
+                    LOG.info("predictor: failed to process entry id=%s err=%s", msg_id, exc)
                     ack_ids.append(msg_id)
         if ack_ids:
             try:
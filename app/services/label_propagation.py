@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Any, Dict, List, Sequence, cast
+
+from chromadb.api.types import Embedding
+
+from app.core.config import settings
+from app.services.chroma_service import ChromaClientProvider
+
+LOG = logging.getLogger(__name__)
+
+_provider: ChromaClientProvider | None = None
+
+
+def _get_provider() -> ChromaClientProvider:
+    global _provider
+    if _provider is None:
+        _provider = ChromaClientProvider()
+    return _provider
+
+
+def _suffix_for_os(os_name: str) -> str:
+    key = (os_name or "").strip().lower()
+    if key in {"mac", "macos", "osx"}:
+        return "macos"
+    if key in {"linux"}:
+        return "linux"
+    if key in {"windows", "win"}:
+        return "windows"
+    return key or "unknown"
+
+
+def _proto_collection_name(os_name: str) -> str:
+    return f"{settings.CHROMA_PROTO_COLLECTION_PREFIX}{_suffix_for_os(os_name)}"
+
+
+def classification_metadata(result: Dict[str, Any], classified_at: float | None = None) -> Dict[str, Any]:
+    """Prototype metadata fields that store an LLM classification for later reuse."""
+    stored = {k: v for k, v in result.items() if not k.startswith("_") and k != "propagated_from"}
+    try:
+        confidence = float(result.get("confidence") or 0.0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    return {
+        "classification": json.dumps(stored),
+        "classification_confidence": confidence,
+        "classified_at": float(classified_at if classified_at is not None else time.time()),
+    }
+
+
+# Only prototypes the LLM classified directly can lend their classification
+SOURCE_RATIONALE = "llm_cluster"
+
+
+def _usable(meta: Dict[str, Any] | None, now: float) -> bool:
+    if not meta or not meta.get("classification") or meta.get("rationale") != SOURCE_RATIONALE:
+        return False
+    try:
+        age = now - float(meta.get("classified_at") or 0.0)
+        confidence = float(meta.get("classification_confidence") or 0.0)
+    except (TypeError, ValueError):
+        return False
+    return age <= float(settings.LABEL_PROPAGATION_MAX_AGE_SEC) and confidence >= float(settings.LABEL_PROPAGATION_MIN_CONFIDENCE)
+
+
+def _reuse(cluster_id: str, meta: Dict[str, Any], distance: float) -> Dict[str, Any] | None:
+    try:
+        result = json.loads(str(meta.get("classification")))
+    except Exception:
+        return None
+    if not isinstance(result, dict):
+        return None
+    result["propagated_from"] = {
+        "cluster_id": cluster_id,
+        "distance": round(float(distance), 6),
+        "classified_at": float(meta.get("classified_at") or 0.0),
+    }
+    return result
+
+
+def _where(now: float) -> Dict[str, Any]:
+    return {"$and": [
+        {"rationale": SOURCE_RATIONALE},
+        {"classified_at": {"$gte": now - float(settings.LABEL_PROPAGATION_MAX_AGE_SEC)}},
+        {"classification_confidence": {"$gte": float(settings.LABEL_PROPAGATION_MIN_CONFIDENCE)}},
+    ]}
+
+
+def _nearest_labelled(os_name: str, embeddings: Sequence[Sequence[float]], now: float) -> List[Dict[str, Any] | None]:
+    """Closest fresh, confident, labelled prototype per query vector (None when none qualifies)."""
+    collection = _get_provider().get_or_create_collection(_proto_collection_name(os_name))
+    result = collection.query(
+        query_embeddings=cast(List[Embedding], [list(e) for e in embeddings]),
+        n_results=1,
+        where=_where(now),
+        include=["distances", "metadatas"],
+    ) or {}
+    ids = result.get("ids") or []
+    dists = result.get("distances") or []
+    metas = result.get("metadatas") or []
+    out: List[Dict[str, Any] | None] = []
+    for row in range(len(embeddings)):
+        row_ids = ids[row] if row < len(ids) else []
+        if len(row_ids) == 0:
+            out.append(None)
+            continue
+        row_dists = dists[row] if row < len(dists) else []
+        row_metas = metas[row] if row < len(metas) else []
+        distance = float(row_dists[0]) if len(row_dists) > 0 else float("inf")
+        meta = dict(row_metas[0] or {}) if len(row_metas) > 0 else {}
+        if distance > float(settings.LABEL_PROPAGATION_MAX_DISTANCE) or not _usable(meta, now):
+            out.append(None)
+            continue
+        out.append({"cluster_id": str(row_ids[0]), "distance": distance, "metadata": meta})
+    return out
+
+
+def classification_for_cluster(
+    os_name: str,
+    cluster_id: str,
+    proto_meta: Dict[str, Any] | None,
+    centroid: Sequence[float] | None,
+) -> Dict[str, Any] | None:
+    """Stored classification for a cluster candidate, from itself or the nearest labelled prototype.
+
+    Returns the reused result (with `propagated_from`) or None when the LLM is needed.
+    """
+    if not settings.LABEL_PROPAGATION_ENABLED:
+        return None
+    now = time.time()
+    if _usable(proto_meta, now):
+        return _reuse(cluster_id, dict(proto_meta or {}), 0.0)
+    if centroid is None or len(centroid) == 0:
+        return None
+    try:
+        hit = _nearest_labelled(os_name, [centroid], now)[0]
+    except Exception as exc:
+        LOG.info("label propagation lookup failed os=%s cluster=%s err=%s", os_name, cluster_id, exc)
+        return None
+    if hit is None or hit["cluster_id"] == cluster_id:
+        return None
+    return _reuse(hit["cluster_id"], hit["metadata"], hit["distance"])
+
+
+def classification_for_issue(os_name: str, templated_lines: Sequence[str]) -> Dict[str, Any] | None:
+    """Stored classification for an issue whose top log lines all sit next to labelled prototypes.
+
+    The first LABEL_PROPAGATION_ISSUE_LINES distinct templated lines are embedded in
+    one call; every line must hit a labelled prototype within distance and the hits
+    must agree on failure_type. The closest hit's classification is reused.
+    """
+    if not settings.LABEL_PROPAGATION_ENABLED:
+        return None
+    lines: List[str] = []
+    for line in templated_lines:
+        if line and line not in lines:
+            lines.append(line)
+        if len(lines) >= int(settings.LABEL_PROPAGATION_ISSUE_LINES):
+            break
+    if not lines:
+        return None
+    now = time.time()
+    try:
+        embeddings = _get_provider().embed(lines)
+        hits = _nearest_labelled(os_name, embeddings, now)
+    except Exception as exc:
+        LOG.info("label propagation lookup failed os=%s err=%s", os_name, exc)
+        return None
+    if any(hit is None for hit in hits):
+        return None
+    found = cast(List[Dict[str, Any]], hits)
+    labels = {str((hit["metadata"] or {}).get("label") or "") for hit in found}
+    if len(labels) != 1:
+        return None
+    best = min(found, key=lambda hit: hit["distance"])
+    return _reuse(best["cluster_id"], best["metadata"], best["distance"])
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+
+LOG = logging.getLogger(__name__)
+
+
+def cache_key(provider: str, model: str, system: str, prompt: str, temperature: float | None = None) -> str:
+    """Content address of a chat request: sha256 over provider, model, sampling and messages."""
+    payload = json.dumps([provider, model, temperature, system, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """TTL + LRU cache of parsed LLM JSON responses, with an optional shared Redis tier.
+
+    The in-process tier is an OrderedDict bounded by `max_entries`. With
+    `redis_url`, misses fall through to `llm_cache:<key>` strings (SETEX with the
+    same TTL) so replicas share answers for recurring prompts. Values are copied on
+    the way in and out so callers can annotate results freely.
+    """
+
+    def __init__(self, ttl_sec: float, max_entries: int, redis_url: str | None = None) -> None:
+        self.ttl_sec = float(ttl_sec)
+        self.max_entries = max(1, int(max_entries))
+        self.redis_url = redis_url
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Async Redis clients are bound to the loop that created them (one per worker thread)
+        self._redis_clients: Dict[int, Any] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get_local(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set_local(self, key: str, value: Any) -> None:
+        stored = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_sec, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self) -> Any:
+        # Only called when the Redis tier is enabled (redis_url set)
+        assert self.redis_url is not None
+        loop_id = id(asyncio.get_running_loop())
+        client = self._redis_clients.get(loop_id)
+        if client is None:
+            client = aioredis.from_url(self.redis_url, decode_responses=True)
+            self._redis_clients[loop_id] = client
+        return client
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.get_local(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.redis_url:
+            try:
+                raw = await self._get_redis().get(f"llm_cache:{key}")
+                if raw:
+                    value = json.loads(raw)
+                    self.set_local(key, value)
+                    self.redis_hits += 1
+                    return value
+            except Exception as exc:
+                LOG.debug("llm cache redis get failed err=%s", exc)
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        self.set_local(key, value)
+        if self.redis_url:
+            try:
+                await self._get_redis().setex(f"llm_cache:{key}", int(self.ttl_sec), json.dumps(value))
+            except Exception as exc:
+                LOG.debug("llm cache redis set failed err=%s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "entries": size,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+
+_cache: LLMResponseCache | None = None
+
+
+def get_llm_cache() -> LLMResponseCache | None:
+    """Process-wide response cache, or None when LLM_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = LLMResponseCache(
+            ttl_sec=settings.LLM_CACHE_TTL_SEC,
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+            redis_url=settings.REDIS_URL if settings.LLM_CACHE_REDIS else None,
+        )
+    return _cache
@@ -1,13 +1,26 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+import asyncio
 import logging
 import json
+import time
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
 import ollama
 
 from app.core.config import settings
+from app.services.llm_cache import cache_key, get_llm_cache
+from app.services.prompt_budget import (
+    cap_prompt,
+    distance_priority,
+    estimate_tokens,
+    fit_text,
+    rule_priority,
+    section_budget,
+    select_lines,
+)
 
 
 LOG = logging.getLogger(__name__)
@@ -15,6 +28,10 @@ LOG = logging.getLogger(__name__)
 
 _client: OpenAI | None = None
 _ollama_client: ollama.Client | None = None
+# Async clients (and their httpx connection pools) are bound to the event loop that
+# created them; each stream worker runs its own loop, so keep one per loop.
+_async_clients: Dict[int, AsyncOpenAI] = {}
+_async_ollama_clients: Dict[int, ollama.AsyncClient] = {}
 
 
 def _get_client() -> OpenAI:
@@ -35,6 +52,50 @@ def _get_ollama() -> ollama.Client:
     return _ollama_client
 
 
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+    )
+
+
+def _get_async_client() -> AsyncOpenAI:
+    """Returns the AsyncOpenAI client (pooled connections) for the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    client = _async_clients.get(loop_id)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(limits=_http_limits(), timeout=settings.LLM_TIMEOUT_SEC),
+        )
+        _async_clients[loop_id] = client
+    return client
+
+
+def _get_async_ollama() -> ollama.AsyncClient:
+    """Returns the async Ollama client (pooled connections) for the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    client = _async_ollama_clients.get(loop_id)
+    if client is None:
+        client = ollama.AsyncClient(
+            host=settings.OLLAMA_BASE_URL,
+            timeout=settings.LLM_TIMEOUT_SEC,
+            limits=_http_limits(),
+        )
+        _async_ollama_clients[loop_id] = client
+    return client
+
+
+def _with_usage(result: Any, prompt_tokens: Any, completion_tokens: Any) -> Any:
+    """Attach provider-reported token usage as `_llm_metadata` (dict results only)."""
+    if isinstance(result, dict):
+        result["_llm_metadata"] = {
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+        }
+    return result
+
+
 def _chat_json_with_openai(system: str, user_prompt: str) -> Dict[str, Any]:
     """
     Sends a chat request to OpenAI, ensuring a JSON object is returned.
@@ -51,7 +112,12 @@ def _chat_json_with_openai(system: str, user_prompt: str) -> Dict[str, Any]:
             ]
         )
         content = response.choices[0].message.content or "{}"
-        return json.loads(content)
+        usage = getattr(response, "usage", None)
+        return _with_usage(
+            json.loads(content),
+            getattr(usage, "prompt_tokens", 0),
+            getattr(usage, "completion_tokens", 0),
+        )
     except Exception as e:
         # Fallback for API errors or other issues
         LOG.error("LLM(OpenAI) chat failed model=%s err=%s", settings.OPENAI_CHAT_MODEL, e)
@@ -80,7 +146,7 @@ def _chat_json_with_ollama(system: str, user_prompt: str, temperature: float) ->
         resp_dict: Dict[str, Any] = dict(resp) if resp else {}
         message_data: Dict[str, Any] = resp_dict.get("message") or {}
         text = str(message_data.get("content") or "{}")
-        return json.loads(text)
+        return _with_usage(json.loads(text), resp_dict.get("prompt_eval_count"), resp_dict.get("eval_count"))
     except Exception as e:
         # Fallback is now safe from NameError
         text = ""
@@ -92,63 +158,207 @@ def _chat_json_with_ollama(system: str, user_prompt: str, temperature: float) ->
         return {"raw": text, "error": "Failed to get or parse Ollama response."}
 
 
-SYSTEM = "You are an SRE assistant. Respond ONLY with valid JSON."
+async def _achat_json_with_openai(system: str, user_prompt: str) -> Dict[str, Any]:
+    """Async variant of `_chat_json_with_openai`."""
+    client = _get_async_client()
+    try:
+        response = await client.chat.completions.create(
+            model=settings.OPENAI_CHAT_MODEL,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user_prompt},
+            ]
+        )
+        content = response.choices[0].message.content or "{}"
+        usage = getattr(response, "usage", None)
+        return _with_usage(
+            json.loads(content),
+            getattr(usage, "prompt_tokens", 0),
+            getattr(usage, "completion_tokens", 0),
+        )
+    except Exception as e:
+        LOG.error("LLM(OpenAI) chat failed model=%s err=%s", settings.OPENAI_CHAT_MODEL, e)
+        return {"raw": str(e), "error": "OpenAI API call failed."}
 
 
-def classify_failure(os_name: str, raw: str, templated: str, neighbors: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """LLM-based classification for hardware failure likelihood with structured JSON output."""
-    examples = "\n".join([f"- {n.get('document', '')}" for n in neighbors[:5]])
-    # Expanded failure type taxonomy to capture a broader set of common incident categories.
-    # Keep this list in sync with rule labels in app/rules/rules.yml when practical.
-    # Note: Use lowercase, single tokens where possible for stability.
-    failure_types = "|".join([
-        "disk", "storage", "raid", "nvme", "filesystem", "io",
-        "cpu", "memory", "network", "power", "thermal", "wifi",
-        "windows_update", "service_failure", "sandbox",
-        "application", "configuration", "security", "dependency",
-        "kernel", "driver", "os_update", "unknown"
-    ])
-    prompt = f"""
+async def _achat_json_with_ollama(system: str, user_prompt: str, temperature: float) -> Dict[str, Any]:
+    """Async variant of `_chat_json_with_ollama`."""
+    client = _get_async_ollama()
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_prompt},
+    ]
+    resp = None
+    try:
+        resp = await client.chat(
+            model=settings.OLLAMA_CHAT_MODEL,
+            messages=messages,
+            format="json",
+            options={"temperature": temperature}
+        )
+        resp_dict: Dict[str, Any] = dict(resp) if resp else {}
+        message_data: Dict[str, Any] = resp_dict.get("message") or {}
+        text = str(message_data.get("content") or "{}")
+        return _with_usage(json.loads(text), resp_dict.get("prompt_eval_count"), resp_dict.get("eval_count"))
+    except Exception as e:
+        text = ""
+        if resp and isinstance(resp, dict):
+            text = resp.get("message", {}).get("content", "")
+        else:
+            text = str(e)
+        LOG.error("LLM(Ollama) chat failed model=%s err=%s", settings.OLLAMA_CHAT_MODEL, e)
+        return {"raw": text, "error": "Failed to get or parse Ollama response."}
+
+
+def public_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """An LLM result without internal `_`-prefixed keys (e.g. `_llm_metadata`), for publishing."""
+    return {k: v for k, v in result.items() if not k.startswith("_")}
+
+
+def _request_key(system: str, user_prompt: str, temperature: float) -> str:
+    if settings.LLM_PROVIDER == "ollama":
+        return cache_key("ollama", settings.OLLAMA_CHAT_MODEL, system, user_prompt, temperature)
+    return cache_key("openai", settings.OPENAI_CHAT_MODEL, system, user_prompt)
+
+
+def _cacheable(result: Any) -> bool:
+    return not (isinstance(result, dict) and result.get("error"))
+
+
+def _cache_value(result: Any) -> Any:
+    if isinstance(result, dict):
+        return {k: v for k, v in result.items() if k != "_llm_metadata"}
+    return result
+
+
+def _finish_metadata(result: Any, system: str, user_prompt: str, started: float, cached: bool) -> Any:
+    """Complete `_llm_metadata` with totals, latency and outcome.
+
+    Falls back to estimating prompt tokens when the provider did not report usage;
+    cache hits cost no tokens.
+    """
+    if not isinstance(result, dict):
+        return result
+    meta = dict(result.get("_llm_metadata") or {})
+    prompt_tokens = int(meta.get("prompt_tokens") or 0)
+    completion_tokens = int(meta.get("completion_tokens") or 0)
+    if cached:
+        prompt_tokens = completion_tokens = 0
+    elif not prompt_tokens:
+        prompt_tokens = estimate_tokens(system) + estimate_tokens(user_prompt)
+    meta.update({
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "tokens": prompt_tokens + completion_tokens,
+        "latency_ms": round((time.perf_counter() - started) * 1000.0, 1),
+        "success": not result.get("error"),
+        "cached": cached,
+    })
+    result["_llm_metadata"] = meta
+    return result
+
+
+def _chat_json(system: str, user_prompt: str, temperature: float) -> Any:
+    """Provider dispatch for blocking callers; served from the in-process cache when possible."""
+    started = time.perf_counter()
+    cache = get_llm_cache()
+    key = _request_key(system, user_prompt, temperature) if cache is not None else ""
+    if cache is not None:
+        cached = cache.get_local(key)
+        if cached is not None:
+            return _finish_metadata(cached, system, user_prompt, started, cached=True)
+    if settings.LLM_PROVIDER == "ollama":
+        result: Any = _chat_json_with_ollama(system, user_prompt, temperature=temperature)
+    else:
+        result = _chat_json_with_openai(system, user_prompt)
+    if cache is not None and _cacheable(result):
+        cache.set_local(key, _cache_value(result))
+    return _finish_metadata(result, system, user_prompt, started, cached=False)
+
+
+async def _achat_json(system: str, user_prompt: str, temperature: float) -> Any:
+    """Provider dispatch without blocking the event loop; cached in-process (and in Redis if enabled)."""
+    started = time.perf_counter()
+    cache = get_llm_cache()
+    key = _request_key(system, user_prompt, temperature) if cache is not None else ""
+    if cache is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            return _finish_metadata(cached, system, user_prompt, started, cached=True)
+    if settings.LLM_PROVIDER == "ollama":
+        result: Any = await _achat_json_with_ollama(system, user_prompt, temperature=temperature)
+    else:
+        result = await _achat_json_with_openai(system, user_prompt)
+    if cache is not None and _cacheable(result):
+        await cache.set(key, _cache_value(result))
+    return _finish_metadata(result, system, user_prompt, started, cached=False)
+
+
+SYSTEM = "You are an SRE assistant. Respond ONLY with valid JSON."
+
+# Expanded failure type taxonomy to capture a broader set of common incident categories.
+# Keep this list in sync with rule labels in app/rules/rules.yml when practical.
+# Note: Use lowercase, single tokens where possible for stability.
+FAILURE_TYPES = "|".join([
+    "disk", "storage", "raid", "nvme", "filesystem", "io",
+    "cpu", "memory", "network", "power", "thermal", "wifi",
+    "windows_update", "service_failure", "sandbox",
+    "application", "configuration", "security", "dependency",
+    "kernel", "driver", "os_update", "unknown"
+])
+
+
+def _failure_prompt(os_name: str, raw: str, templated: str, neighbors: List[Dict[str, Any]]) -> str:
+    examples = "\n".join(select_lines(
+        neighbors, lambda n: n.get("document", ""), section_budget(0.3), 5, priority=distance_priority
+    ))
+    return cap_prompt(SYSTEM, f"""
 OS: {os_name}
-Current log (templated): {templated}
-Current log (raw): {raw}
+Current log (templated): {fit_text(templated, 0.15)}
+Current log (raw): {fit_text(raw, 0.15)}
 Similar known templates/logs:
 {examples}
-
+""", f"""
 Return JSON with:
 {{
   "is_hardware_failure": true|false,
-  "failure_type": "{failure_types}",
+  "failure_type": "{FAILURE_TYPES}",
   "confidence": 0..1,
   "evidence": ["..."],
   "recommendation": "..."
 }}
 Only JSON; no extra text.
-"""
-    if settings.LLM_PROVIDER == "ollama":
-        return _chat_json_with_ollama(SYSTEM, prompt, temperature=0.1)
-    else:
-        return _chat_json_with_openai(SYSTEM, prompt)
+""")
 
 
-def generate_hypothesis(os_name: str, templated_summary: str, top_logs: List[Dict[str, Any]], num_queries: int = 3) -> List[str]:
-    """Generate HYDE-style retrieval hypotheses/queries from an issue summary and logs."""
-    logs_snippets = "\n".join([f"- {item.get('templated','')}" for item in top_logs[:20]])
-    prompt = f"""
+def classify_failure(os_name: str, raw: str, templated: str, neighbors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """LLM-based classification for hardware failure likelihood with structured JSON output."""
+    return _chat_json(SYSTEM, _failure_prompt(os_name, raw, templated, neighbors), temperature=0.1)
+
+
+async def aclassify_failure(os_name: str, raw: str, templated: str, neighbors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Async variant of `classify_failure`."""
+    return await _achat_json(SYSTEM, _failure_prompt(os_name, raw, templated, neighbors), temperature=0.1)
+
+
+def _hypothesis_prompt(os_name: str, templated_summary: str, top_logs: List[Dict[str, Any]], num_queries: int) -> str:
+    logs_snippets = "\n".join(select_lines(
+        top_logs, lambda item: item.get("templated", ""), section_budget(0.5), 20, priority=rule_priority
+    ))
+    return cap_prompt(SYSTEM, f"""
 OS: {os_name}
 Issue summary (templated):
-{templated_summary}
+{fit_text(templated_summary, 0.2)}
 
 Key logs (templated):
 {logs_snippets}
+""", f"""
+Write {num_queries} short search queries (max 12 words each) that would retrieve additional logs relevant to diagnosing this issue. Return JSON {{"queries": ["..."]}} only.
+""")
 
-Write {num_queries} short search queries (max 12 words each) that would retrieve additional logs relevant to diagnosing this issue. Return JSON list of strings only.
-"""
-    if settings.LLM_PROVIDER == "ollama":
-        result = _chat_json_with_ollama(SYSTEM, prompt, temperature=0.2)
-    else:
-        result = _chat_json_with_openai(SYSTEM, prompt)
-        
+
+def _parse_queries(result: Any, num_queries: int) -> List[str]:
     # Accept either {"queries": [...]} or a bare list
     if isinstance(result, dict):
         queries = result.get("queries") if isinstance(result.get("queries"), list) else None
@@ -159,20 +369,42 @@ Write {num_queries} short search queries (max 12 words each) that would retrieve
     return []
 
 
-def classify_issue(os_name: str, top_logs: List[Dict[str, Any]], neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """LLM-based classification for an aggregated issue."""
-    examples = "\n".join([f"- {n.get('document', '')}" for n in neighbors[:8]])
-    recent = "\n".join([f"- {log.get('templated','')}" for log in top_logs[:50]])
-    extra = "\n".join([f"- {log.get('templated','')}" for log in retrieved_logs[:20]])
-    # Expanded failure type taxonomy (keep aligned with classify_failure)
-    failure_types = "|".join([
-        "disk", "storage", "raid", "nvme", "filesystem", "io",
-        "cpu", "memory", "network", "power", "thermal", "wifi",
-        "windows_update", "service_failure", "sandbox",
-        "application", "configuration", "security", "dependency",
-        "kernel", "driver", "os_update", "unknown"
-    ])
-    prompt = f"""
+def _call_metadata(result: Any) -> Dict[str, Any]:
+    return dict(result.get("_llm_metadata") or {}) if isinstance(result, dict) else {}
+
+
+def generate_hypothesis(
+    os_name: str, templated_summary: str, top_logs: List[Dict[str, Any]], num_queries: int = 3
+) -> Tuple[List[str], Dict[str, Any]]:
+    """Generate HYDE-style retrieval hypotheses/queries from an issue summary and logs.
+
+    Returns the queries and the call's `_llm_metadata` (tokens, latency, cache hit).
+    """
+    prompt = _hypothesis_prompt(os_name, templated_summary, top_logs, num_queries)
+    result = _chat_json(SYSTEM, prompt, temperature=0.2)
+    return _parse_queries(result, num_queries), _call_metadata(result)
+
+
+async def agenerate_hypothesis(
+    os_name: str, templated_summary: str, top_logs: List[Dict[str, Any]], num_queries: int = 3
+) -> Tuple[List[str], Dict[str, Any]]:
+    """Async variant of `generate_hypothesis`."""
+    prompt = _hypothesis_prompt(os_name, templated_summary, top_logs, num_queries)
+    result = await _achat_json(SYSTEM, prompt, temperature=0.2)
+    return _parse_queries(result, num_queries), _call_metadata(result)
+
+
+def _issue_prompt(os_name: str, top_logs: List[Dict[str, Any]], neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> str:
+    examples = "\n".join(select_lines(
+        neighbors, lambda n: n.get("document", ""), section_budget(0.2), 8, priority=distance_priority
+    ))
+    recent = "\n".join(select_lines(
+        top_logs, lambda log: log.get("templated", ""), section_budget(0.5), 50, priority=rule_priority
+    ))
+    extra = "\n".join(select_lines(
+        retrieved_logs, lambda log: log.get("templated", ""), section_budget(0.2), 20, priority=rule_priority
+    ))
+    return cap_prompt(SYSTEM, f"""
 OS: {os_name}
 Issue logs (templated):
 {recent}
@@ -182,61 +414,173 @@ Similar known templates/logs:
 
 Additional retrieved logs:
 {extra}
-
+""", f"""
 Return JSON with:
 {{
   "is_hardware_failure": true|false,
-  "failure_type": "{failure_types}",
+  "failure_type": "{FAILURE_TYPES}",
   "confidence": 0..1,
   "top_signals": ["..."],
   "summary": "...",
   "recommendation": "..."
 }}
 Only JSON; no extra text.
-"""
-    if settings.LLM_PROVIDER == "ollama":
-        return _chat_json_with_ollama(SYSTEM, prompt, temperature=0.3)
-    else:
-        return _chat_json_with_openai(SYSTEM, prompt)
+""")
 
 
-def classify_cluster(os_name: str, cluster_id: str, medoid_doc: str, neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """LLM-based classification for a cluster (prototype) with cluster-scoped context."""
-    examples = "\n".join([f"- {n.get('document','')}" for n in neighbors[:8]])
-    recent = "\n".join([f"- {log.get('templated','')}" for log in retrieved_logs[:50]])
-    failure_types = "|".join([
-        "disk", "storage", "raid", "nvme", "filesystem", "io",
-        "cpu", "memory", "network", "power", "thermal", "wifi",
-        "windows_update", "service_failure", "sandbox",
-        "application", "configuration", "security", "dependency",
-        "kernel", "driver", "os_update", "unknown"
-    ])
-    prompt = f"""
+def classify_issue(os_name: str, top_logs: List[Dict[str, Any]], neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """LLM-based classification for an aggregated issue."""
+    return _chat_json(SYSTEM, _issue_prompt(os_name, top_logs, neighbors, retrieved_logs), temperature=0.3)
+
+
+async def aclassify_issue(os_name: str, top_logs: List[Dict[str, Any]], neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Async variant of `classify_issue`."""
+    return await _achat_json(SYSTEM, _issue_prompt(os_name, top_logs, neighbors, retrieved_logs), temperature=0.3)
+
+
+def _cluster_prompt(os_name: str, cluster_id: str, medoid_doc: str, neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> str:
+    examples = "\n".join(select_lines(
+        neighbors, lambda n: n.get("document", ""), section_budget(0.25), 8, priority=distance_priority
+    ))
+    recent = "\n".join(select_lines(
+        retrieved_logs, lambda log: log.get("templated", ""), section_budget(0.5), 50, priority=rule_priority
+    ))
+    return cap_prompt(SYSTEM, f"""
 OS: {os_name}
 Cluster: {cluster_id}
 Cluster medoid (templated):
-{medoid_doc}
+{fit_text(medoid_doc, 0.1)}
 
 Logs in this cluster (templated):
 {recent}
 
 Similar templates/logs:
 {examples}
-
+""", f"""
 Return JSON with {{
   "is_hardware_failure": true|false,
-  "failure_type": "{failure_types}",
+  "failure_type": "{FAILURE_TYPES}",
   "confidence": 0..1,
   "top_signals": ["..."],
   "summary": "...",
   "recommendation": "Actionable remediation."
 }}
 Only JSON; no extra text.
-"""
-    if settings.LLM_PROVIDER == "ollama":
-        return _chat_json_with_ollama(SYSTEM, prompt, temperature=0.2)
-    else:
-        return _chat_json_with_openai(SYSTEM, prompt)
+""")
+
+
+def classify_cluster(os_name: str, cluster_id: str, medoid_doc: str, neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """LLM-based classification for a cluster (prototype) with cluster-scoped context."""
+    return _chat_json(SYSTEM, _cluster_prompt(os_name, cluster_id, medoid_doc, neighbors, retrieved_logs), temperature=0.2)
+
+
+async def aclassify_cluster(os_name: str, cluster_id: str, medoid_doc: str, neighbors: List[Dict[str, Any]], retrieved_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Async variant of `classify_cluster`."""
+    return await _achat_json(SYSTEM, _cluster_prompt(os_name, cluster_id, medoid_doc, neighbors, retrieved_logs), temperature=0.2)
+
+
+def _clusters_batch_prompt(os_name: str, items: List[Dict[str, Any]]) -> str:
+    sections = []
+    share = 1.0 / max(1, len(items))
+    for i, item in enumerate(items):
+        examples = "\n".join(f"  {line}" for line in select_lines(
+            item.get("neighbors") or [], lambda n: n.get("document", ""), section_budget(0.2 * share), 5,
+            priority=distance_priority,
+        ))
+        recent = "\n".join(f"  {line}" for line in select_lines(
+            item.get("retrieved") or [], lambda log: log.get("templated", ""), section_budget(0.5 * share), 20,
+            priority=rule_priority,
+        ))
+        sections.append(f"""
+[{i}] Cluster: {item.get("cluster_id", "")}
+Cluster medoid (templated):
+  {fit_text(item.get("medoid_doc", ""), 0.1 * share)}
+Logs in this cluster (templated):
+{recent}
+Similar templates/logs:
+{examples}
+""")
+    return cap_prompt(SYSTEM, f"""
+OS: {os_name}
+Classify each of the following {len(items)} clusters independently.
+{"".join(sections)}""", f"""
+Return JSON with {{
+  "results": [
+    {{
+      "index": 0,
+      "cluster_id": "...",
+      "is_hardware_failure": true|false,
+      "failure_type": "{FAILURE_TYPES}",
+      "confidence": 0..1,
+      "top_signals": ["..."],
+      "summary": "...",
+      "recommendation": "Actionable remediation."
+    }}
+  ]
+}}
+with exactly one entry per cluster, in the same order. Only JSON; no extra text.
+""")
+
+
+def _split_batch_results(result: Any, items: List[Dict[str, Any]]) -> List[Dict[str, Any] | None]:
+    """Align a batched response with its items (by cluster_id, then index/position); None where missing."""
+    if isinstance(result, dict) and result.get("error"):
+        errors: List[Dict[str, Any] | None] = [dict(result) for _ in items]
+        _share_metadata(result, errors)
+        return errors
+    entries = result.get("results") if isinstance(result, dict) else result
+    if not isinstance(entries, list):
+        return [None for _ in items]
+    entries = [e for e in entries if isinstance(e, dict)]
+    by_id = {str(e.get("cluster_id")): e for e in entries if e.get("cluster_id")}
+    by_index: Dict[int, Dict[str, Any]] = {}
+    for e in entries:
+        try:
+            by_index[int(e.get("index"))] = e  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            continue
+    out: List[Dict[str, Any] | None] = []
+    for i, item in enumerate(items):
+        entry = by_id.get(str(item.get("cluster_id"))) or by_index.get(i)
+        if entry is None and len(entries) == len(items):
+            entry = entries[i]
+        if entry is None:
+            out.append(None)
+            continue
+        entry = {k: v for k, v in entry.items() if k not in ("index", "cluster_id")}
+        out.append(entry)
+    _share_metadata(result, out)
+    return out
+
+
+def _share_metadata(result: Any, out: List[Dict[str, Any] | None]) -> None:
+    """Split a batched call's token usage evenly across the items it answered."""
+    meta = result.get("_llm_metadata") if isinstance(result, dict) else None
+    answered = [entry for entry in out if entry is not None]
+    if not meta or not answered:
+        return
+    n = len(answered)
+    for entry in answered:
+        entry["_llm_metadata"] = {
+            **meta,
+            "prompt_tokens": int(meta.get("prompt_tokens", 0)) // n,
+            "completion_tokens": int(meta.get("completion_tokens", 0)) // n,
+            "tokens": int(meta.get("tokens", 0)) // n,
+            "batch_size": n,
+        }
+
+
+async def aclassify_clusters_batch(os_name: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any] | None]:
+    """Classify several clusters of one OS in a single LLM request.
+
+    `items` carry cluster_id, medoid_doc, neighbors and retrieved (logs). Returns one
+    result per item in order; None marks items the model left out, which callers
+    should classify individually with `aclassify_cluster`.
+    """
+    if not items:
+        return []
+    result = await _achat_json(SYSTEM, _clusters_batch_prompt(os_name, items), temperature=0.2)
+    return _split_batch_results(result, items)
 
 
 def llm_healthcheck() -> Dict[str, Any]:
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 import uuid
-import asyncio
 import logging
+from typing import Any, Dict, List, Sequence, cast
+
+from chromadb.api.types import Embedding
 
 from app.services.prototype_router import nearest_prototype
+from app.services.prototype_index import get_prototype_index
 from app.services.chroma_service import ChromaClientProvider
+from app.services.cluster_metrics import get_metrics_buffer
 from app.core.config import settings
-from redis.exceptions import ConnectionError as RedisConnectionError
 
 LOG = logging.getLogger(__name__)
 
@@ -49,17 +52,42 @@ def _coerce_text(value: object) -> str:
     return str(value)
 
 
-def assign_or_create_cluster(os_name: str, templated: str | object, *, threshold: float | None = None) -> str:
+def assign_or_create_cluster(
+    os_name: str,
+    templated: str | object,
+    *,
+    threshold: float | None = None,
+    embedding: Sequence[float] | None = None,
+) -> str:
     """Assign templated text to nearest prototype within threshold or create a new cluster.
 
+    When `embedding` (the vector for `templated`) is provided it is reused for both
+    the prototype lookup and a newly created prototype, so the text is not re-embedded.
+
     Returns the cluster_id (prototype id).
     """
     thresh = threshold if threshold is not None else settings.ONLINE_CLUSTER_DISTANCE_THRESHOLD
 
     text = _coerce_text(templated)
 
+    index = get_prototype_index(os_name) if settings.PROTOTYPE_INDEX_ENABLED else None
+
+    # Exact fast path: this templated text already is a prototype document
+    if index is not None and text:
+        exact_cid = index.lookup_exact(text)
+        if exact_cid:
+            if settings.ENABLE_CLUSTER_METRICS:
+                _record_online_metrics(os_name, exact_cid, 0.0, False)
+            return exact_cid
+
+    nearest: List[Dict[str, Any]] = []
     try:
-        nearest = nearest_prototype(os_name, text, k=1)
+        hit = index.nearest(embedding) if index is not None and index.ready and embedding is not None else None
+        if hit is not None:
+            nearest = [{"id": hit[0], "distance": hit[1]}]
+        elif index is None or not index.ready or len(index) > 0:
+            # No usable in-memory vectors (or no embedding supplied): ask Chroma
+            nearest = nearest_prototype(os_name, text, k=1, query_embedding=embedding)
     except Exception as exc:
         LOG.warning("online clustering: prototype lookup failed os=%s err=%s", os_name, exc)
         nearest = []
@@ -91,12 +119,7 @@ def assign_or_create_cluster(os_name: str, templated: str | object, *, threshold
     try:
         provider = _get_provider()
         collection = provider.get_or_create_collection(collection_name)
-        existing = -1
-        try:
-            cnt = collection.count()  # type: ignore[attr-defined]
-            existing = int(cnt) if isinstance(cnt, int) else -1
-        except Exception:
-            pass
+        existing = len(index) if index is not None else -1
         LOG.debug(
             "online clustering: persisting prototype os=%s cluster=%s collection=%s text_len=%d existing=%d",
             os_name,
@@ -108,6 +131,7 @@ def assign_or_create_cluster(os_name: str, templated: str | object, *, threshold
         collection.add(
             ids=[cid],
             documents=[text],
+            embeddings=cast(List[Embedding], [list(embedding)]) if embedding is not None else None,
             metadatas=[{
                 "os": os_name,
                 "label": "unknown",
@@ -117,6 +141,8 @@ def assign_or_create_cluster(os_name: str, templated: str | object, *, threshold
                 "created_by": "online",
             }],
         )
+        if index is not None:
+            index.add(cid, text, embedding)
     except Exception as exc:
         LOG.exception(
             "online clustering: failed to persist prototype os=%s cluster=%s collection=%s text_len=%d",
@@ -145,64 +171,10 @@ def assign_or_create_cluster(os_name: str, templated: str | object, *, threshold
 
 
 def _record_online_metrics(os_name: str, cluster_id: str, distance: float, is_new_cluster: bool) -> None:
-    """Record online clustering metrics asynchronously."""
+    """Buffer an online assignment sample; flushed to Redis in batches by the metrics buffer."""
     if not settings.ENABLE_CLUSTER_METRICS:
         return
-        
-    # Use a simple approach without creating tasks to avoid "Task was destroyed" errors
     try:
-        import redis.asyncio as aioredis
-        from app.services.cluster_metrics import ClusterMetricsTracker
-        
-        async def _record_sync(os_name: str, cluster_id: str, distance: float, is_new_cluster: bool) -> None:
-            """Synchronous version of metrics recording."""
-            redis_client = None
-            try:
-                redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-                tracker = ClusterMetricsTracker(redis_client)
-                await tracker.record_online_cluster_assignment(os_name, cluster_id, distance, is_new_cluster)
-            except RedisConnectionError as exc:
-                LOG.debug(
-                    "online clustering: metrics skipped os=%s cluster=%s reason=redis_unreachable err=%s",
-                    os_name,
-                    cluster_id,
-                    exc,
-                )
-            except Exception as exc:
-                LOG.debug(
-                    "online clustering: metrics failed os=%s cluster=%s err=%s",
-                    os_name,
-                    cluster_id,
-                    exc,
-                )
-            finally:
-                if redis_client is not None:
-                    await redis_client.close()
-        
-        # Create a new event loop just for this operation to avoid conflicts
-        try:
-            asyncio.get_running_loop()  # Check if loop exists
-            # If there's a running loop, use asyncio.run_coroutine_threadsafe
-            import threading
-            
-            def _run_in_thread():
-                new_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(new_loop)
-                new_loop.run_until_complete(_record_sync(os_name, cluster_id, distance, is_new_cluster))
-                new_loop.close()
-            
-            thread = threading.Thread(target=_run_in_thread, daemon=True)
-            thread.start()
-            
-        except RuntimeError:
-            # No running loop, create a new one
-            asyncio.run(_record_sync(os_name, cluster_id, distance, is_new_cluster))
-            
+        get_metrics_buffer().record_online_assignment(os_name, cluster_id, float(distance), is_new_cluster)
     except Exception as exc:
-        LOG.debug("online clustering: metrics creation failed os=%s cluster=%s err=%s", os_name, cluster_id, exc)
-
-
-
-
-
-
+        LOG.debug("online clustering: metrics buffering failed os=%s cluster=%s err=%s", os_name, cluster_id, exc)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+import re
+from typing import Any, Callable, Dict, List, Sequence
+
+from app.core.config import settings
+
+LOG = logging.getLogger(__name__)
+
+_encoder: Any = None
+_encoder_loaded = False
+
+_NUMERIC = re.compile(r"0x[0-9a-fA-F]+|\d+")
+_SPACES = re.compile(r"\s+")
+
+
+def _get_encoder() -> Any:
+    """tiktoken encoder when the package is installed, otherwise None (heuristic counts)."""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken  # type: ignore
+
+            _encoder = tiktoken.get_encoding(settings.LLM_PROMPT_TOKENIZER)
+        except Exception as exc:
+            LOG.info("prompt budget: tiktoken unavailable, using ~4 chars/token err=%s", exc)
+            _encoder = None
+    return _encoder
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _dedupe_key(line: str) -> str:
+    # Near-identical templated lines differ only in leftover numbers/ids and spacing
+    return _SPACES.sub(" ", _NUMERIC.sub("#", line)).strip().lower()
+
+
+def truncate_tokens(line: str, max_tokens: int) -> str:
+    """`line` cut to about `max_tokens` tokens, marked with a trailing " ..." when cut."""
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    encoder = _get_encoder()
+    if encoder is not None:
+        return encoder.decode(encoder.encode(line, disallowed_special=())[:max_tokens]) + " ..."
+    return line[: max_tokens * 4] + " ..."
+
+
+def select_lines(
+    items: Sequence[Dict[str, Any]],
+    text: Callable[[Dict[str, Any]], str],
+    max_tokens: int,
+    max_items: int,
+    priority: Callable[[Dict[str, Any]], float] | None = None,
+) -> List[str]:
+    """Pick bullet lines for a prompt section within a token budget.
+
+    Lines are deduplicated on a digit-insensitive key, ordered by `priority`
+    (highest first; input order breaks ties), truncated to LLM_PROMPT_MAX_LINE_TOKENS
+    each, and taken while they fit in `max_tokens`, up to `max_items` lines.
+    """
+    ranked = list(enumerate(items))
+    if priority is not None:
+        ranked.sort(key=lambda pair: (-priority(pair[1]), pair[0]))
+    seen = set()
+    out: List[str] = []
+    used = 0
+    max_line_tokens = max(8, int(settings.LLM_PROMPT_MAX_LINE_TOKENS))
+    for _, item in ranked:
+        if len(out) >= max_items:
+            break
+        line = (text(item) or "").strip()
+        if not line:
+            continue
+        key = _dedupe_key(line)
+        if key in seen:
+            continue
+        seen.add(key)
+        line = truncate_tokens(line, max_line_tokens)
+        cost = estimate_tokens(line) + 2  # "- " prefix and newline
+        if used + cost > max_tokens:
+            continue
+        out.append(f"- {line}")
+        used += cost
+    return out
+
+
+def rule_priority(item: Dict[str, Any]) -> float:
+    """Rule-based failure signal score of a log entry (0 when none)."""
+    from app.services.failure_rules import match_failure_signals
+
+    try:
+        signal = match_failure_signals(f"{item.get('templated', '')} {item.get('raw', '')}")
+        return float(signal.get("score") or 0.0)  # type: ignore[arg-type]
+    except Exception:
+        return 0.0
+
+
+def distance_priority(item: Dict[str, Any]) -> float:
+    """Closer neighbors first; entries without a distance keep their order after those with one."""
+    distance = item.get("distance")
+    try:
+        return -float(distance) if distance is not None else float("-inf")
+    except (TypeError, ValueError):
+        return float("-inf")
+
+
+def section_budget(share: float) -> int:
+    """Token budget for a prompt section as a share of LLM_PROMPT_MAX_TOKENS."""
+    return max(64, int(int(settings.LLM_PROMPT_MAX_TOKENS) * share))
+
+
+def fit_text(text: str, share: float) -> str:
+    """A free-text prompt field (summary, medoid, raw log) cut to its section budget."""
+    return truncate_tokens((text or "").strip(), section_budget(share))
+
+
+def cap_prompt(system: str, body: str, instructions: str) -> str:
+    """`body` + `instructions`, with the body cut so the request fits LLM_PROMPT_MAX_TOKENS.
+
+    Section budgets normally keep prompts below the limit; this is the hard cap for
+    the system prompt, the context body and the (never cut) answer instructions.
+    """
+    room = int(settings.LLM_PROMPT_MAX_TOKENS) - estimate_tokens(system) - estimate_tokens(instructions)
+    if estimate_tokens(body) > room:
+        LOG.info("prompt budget: body over budget by %d tokens; truncating", estimate_tokens(body) - room)
+        body = truncate_tokens(body, max(0, room - 2)) + "\n"
+    return body + instructions
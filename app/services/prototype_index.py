@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.chroma_service import ChromaClientProvider
+
+LOG = logging.getLogger(__name__)
+
+_provider: ChromaClientProvider | None = None
+
+
+def _get_provider() -> ChromaClientProvider:
+    global _provider
+    if _provider is None:
+        _provider = ChromaClientProvider()
+    return _provider
+
+
+def _suffix_for_os(os_name: str) -> str:
+    key = (os_name or "").strip().lower()
+    if key in {"mac", "macos", "osx"}:
+        return "macos"
+    if key in {"linux"}:
+        return "linux"
+    if key in {"windows", "win"}:
+        return "windows"
+    return key or "unknown"
+
+
+def _proto_collection_name(os_name: str) -> str:
+    return f"{settings.CHROMA_PROTO_COLLECTION_PREFIX}{_suffix_for_os(os_name)}"
+
+
+def _collection_space(collection: Any) -> str:
+    """Return the distance function Chroma uses for the collection (l2 by default)."""
+    try:
+        meta = collection.metadata or {}
+        space = meta.get("hnsw:space")
+        if space:
+            return str(space).lower()
+    except Exception:
+        pass
+    try:
+        config = collection.configuration or {}
+        space = (config.get("hnsw") or {}).get("space")
+        if space:
+            return str(space).lower()
+    except Exception:
+        pass
+    return "l2"
+
+
+class PrototypeIndex:
+    """Process-local mirror of proto_<os> used on the online clustering hot path.
+
+    Keeps a dict from prototype document (templated text) to cluster_id for exact
+    hits and a growing matrix of prototype vectors for top-1 search. Distances are
+    computed with the same function as the Chroma collection so thresholds keep
+    their meaning. Chroma remains the durable store: the index pulls rows added by
+    other writers incrementally (by offset) and is fully reloaded periodically to
+    pick up rewritten prototypes.
+    """
+
+    def __init__(self, os_name: str) -> None:
+        self.os_name = os_name
+        self._lock = threading.Lock()
+        self._exact: Dict[str, str] = {}
+        self._rows: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._matrix: np.ndarray | None = None
+        self._sq_norms: np.ndarray | None = None
+        self._size = 0
+        self._space = "l2"
+        self._synced = 0
+        self._last_refresh = 0.0
+        self._last_full_reload = 0.0
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded
+
+    def invalidate(self) -> None:
+        """Force a full reload on the next refresh (e.g. after batch re-clustering)."""
+        with self._lock:
+            self._last_full_reload = 0.0
+            self._last_refresh = 0.0
+
+    def refresh(self) -> None:
+        """Pull new prototypes from Chroma; throttled by PROTOTYPE_INDEX_REFRESH_SEC."""
+        now = time.time()
+        if now - self._last_refresh < float(settings.PROTOTYPE_INDEX_REFRESH_SEC):
+            return
+        with self._lock:
+            if now - self._last_refresh < float(settings.PROTOTYPE_INDEX_REFRESH_SEC):
+                return
+            self._last_refresh = now
+            try:
+                collection = _get_provider().get_or_create_collection(_proto_collection_name(self.os_name))
+                count = int(collection.count())
+                full = (
+                    not self._loaded
+                    or count < self._synced
+                    or now - self._last_full_reload >= float(settings.PROTOTYPE_INDEX_FULL_RELOAD_SEC)
+                )
+                if full:
+                    self._reset()
+                    self._space = _collection_space(collection)
+                    self._last_full_reload = now
+                if count > self._synced:
+                    data = collection.get(
+                        include=["embeddings", "documents"],
+                        offset=self._synced,
+                        limit=count - self._synced,
+                    ) or {}
+                    ids = list(data.get("ids") or [])
+                    docs = data.get("documents")
+                    embs = data.get("embeddings")
+                    for i, cid in enumerate(ids):
+                        doc = docs[i] if docs is not None and i < len(docs) else None
+                        emb = embs[i] if embs is not None and i < len(embs) else None
+                        self._add_locked(str(cid), doc, emb)
+                    self._synced += len(ids)
+                self._loaded = True
+            except Exception as exc:
+                LOG.info("prototype index refresh failed os=%s err=%s", self.os_name, exc)
+
+    def _reset(self) -> None:
+        self._exact.clear()
+        self._rows.clear()
+        self._ids = []
+        self._matrix = None
+        self._sq_norms = None
+        self._size = 0
+        self._synced = 0
+
+    def _add_locked(self, cluster_id: str, document: str | None, embedding: Sequence[float] | None) -> None:
+        if document:
+            self._exact.setdefault(document, cluster_id)
+        if embedding is None or cluster_id in self._rows:
+            return
+        vec = np.asarray(embedding, dtype=np.float64).reshape(-1)
+        if self._matrix is None:
+            self._matrix = np.empty((64, vec.shape[0]), dtype=np.float64)
+            self._sq_norms = np.empty(64, dtype=np.float64)
+        if vec.shape[0] != self._matrix.shape[1]:
+            return
+        if self._size == self._matrix.shape[0]:
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+            self._sq_norms = np.concatenate([self._sq_norms, np.empty_like(self._sq_norms)])  # type: ignore[list-item]
+        self._matrix[self._size] = vec
+        self._sq_norms[self._size] = float(vec @ vec)  # type: ignore[index]
+        self._rows[cluster_id] = self._size
+        self._ids.append(cluster_id)
+        self._size += 1
+
+    def add(self, cluster_id: str, document: str, embedding: Sequence[float] | None) -> None:
+        """Write-through for a prototype this process just persisted to Chroma."""
+        with self._lock:
+            self._add_locked(cluster_id, document, embedding)
+
+    def lookup_exact(self, document: str) -> str | None:
+        return self._exact.get(document)
+
+    def nearest(self, embedding: Sequence[float]) -> Tuple[str, float] | None:
+        """Return (cluster_id, distance) of the closest prototype vector, if any."""
+        with self._lock:
+            if self._matrix is None or self._size == 0:
+                return None
+            vec = np.asarray(embedding, dtype=np.float64).reshape(-1)
+            if vec.shape[0] != self._matrix.shape[1]:
+                return None
+            matrix = self._matrix[: self._size]
+            dots = matrix @ vec
+            if self._space == "cosine":
+                denom = np.sqrt(self._sq_norms[: self._size]) * float(np.sqrt(vec @ vec))  # type: ignore[index]
+                distances = 1.0 - dots / np.where(denom > 0, denom, 1.0)
+            elif self._space == "ip":
+                distances = 1.0 - dots
+            else:
+                distances = self._sq_norms[: self._size] + float(vec @ vec) - 2.0 * dots  # type: ignore[index]
+            best = int(np.argmin(distances))
+            return self._ids[best], max(float(distances[best]), 0.0)
+
+
+_indexes: Dict[str, PrototypeIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_prototype_index(os_name: str) -> PrototypeIndex:
+    """Return the process-wide index for proto_<os>, refreshed if due."""
+    key = _suffix_for_os(os_name)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(key, PrototypeIndex(key))
+    index.refresh()
+    return index
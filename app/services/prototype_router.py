@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence, cast
+
+from chromadb.api.types import Embedding
 
 from app.services.chroma_service import ChromaClientProvider
 from app.core.config import settings
@@ -44,46 +46,101 @@ def _coerce_text(value: object) -> str:
     return str(value)
 
 
-def nearest_prototype(os_name: str, templated_text: str | object, k: int = 3) -> List[Dict[str, Any]]:
-    """Return top-k nearest prototypes from proto_<os> with distances.
-
-    Output per item: {id, document, distance, metadata}
+def _is_recoverable_index_error(exc: Exception) -> bool:
+    err_msg = str(exc)
+    return "Nothing found on disk" in err_msg or "hnsw segment reader" in err_msg or "list index out of range" in err_msg
+
+
+def _unpack_query_row(result: Dict[str, Any], row: int) -> List[Dict[str, Any]]:
+    ids = (result.get("ids") or [])
+    docs = (result.get("documents") or [])
+    dists = (result.get("distances") or [])
+    metas = (result.get("metadatas") or [])
+    row_ids = ids[row] if row < len(ids) else []
+    row_docs = docs[row] if row < len(docs) else []
+    row_dists = dists[row] if row < len(dists) else []
+    row_metas = metas[row] if row < len(metas) else []
+    out: List[Dict[str, Any]] = []
+    for i in range(len(row_ids)):
+        out.append({
+            "id": row_ids[i],
+            "document": row_docs[i] if i < len(row_docs) else "",
+            "distance": row_dists[i] if i < len(row_dists) else None,
+            "metadata": row_metas[i] if i < len(row_metas) else {},
+        })
+    return out
+
+
+def nearest_prototypes(
+    os_name: str,
+    templated_texts: Sequence[str | object],
+    k: int = 1,
+    *,
+    query_embeddings: Sequence[Sequence[float]] | None = None,
+) -> List[List[Dict[str, Any]]]:
+    """Batched variant of `nearest_prototype` for many texts of the same OS.
+
+    All non-empty texts are embedded in a single call and resolved with one
+    multi-query `collection.query`. When `query_embeddings` (aligned with
+    `templated_texts`) is given, those vectors are used and nothing is embedded.
+    The result list is aligned with the input; empty texts (and an empty
+    collection) yield an empty neighbor list.
     """
+    results: List[List[Dict[str, Any]]] = [[] for _ in templated_texts]
+    if not templated_texts:
+        return results
     provider = _get_provider()
     collection = provider.get_or_create_collection(_proto_collection_name(os_name))
-    sanitized_text = _coerce_text(templated_text)
-    if not sanitized_text:
-        return []
-    
+
+    positions: List[int] = []
+    queries: List[str] = []
+    for pos, value in enumerate(templated_texts):
+        sanitized_text = _coerce_text(value)
+        if sanitized_text:
+            positions.append(pos)
+            queries.append(sanitized_text)
+    if not queries:
+        return results
+
     # Skip query if collection is empty — ChromaDB raises errors on empty HNSW index
     try:
         if collection.count() == 0:
-            return []
+            return results
     except Exception:
         pass
 
     try:
-        result = collection.query(query_texts=[sanitized_text], n_results=max(1, k), include=["distances", "metadatas", "documents"])
-        out: List[Dict[str, Any]] = []
-        ids = (result.get("ids") or [[]])[0]
-        docs = (result.get("documents") or [[]])[0]
-        dists = (result.get("distances") or [[]])[0]
-        metas = (result.get("metadatas") or [[]])[0]
-        for i in range(len(ids)):
-            out.append({
-                "id": ids[i],
-                "document": docs[i] if i < len(docs) else "",
-                "distance": dists[i] if i < len(dists) else None,
-                "metadata": metas[i] if i < len(metas) else {},
-            })
-        return out
+        if query_embeddings is not None:
+            vectors = [list(query_embeddings[pos]) for pos in positions]
+            result = collection.query(
+                query_embeddings=cast(List[Embedding], vectors),
+                n_results=max(1, k),
+                include=["distances", "metadatas", "documents"],
+            )
+        else:
+            result = collection.query(query_texts=queries, n_results=max(1, k), include=["distances", "metadatas", "documents"])
     except Exception as e:
         # Handle ChromaDB HNSW index errors gracefully
-        err_msg = str(e)
-        if "Nothing found on disk" in err_msg or "hnsw segment reader" in err_msg or "list index out of range" in err_msg:
-            # Index is corrupted or empty, return empty list to trigger new cluster creation
-            return []
+        if _is_recoverable_index_error(e):
+            # Index is corrupted or empty, return empty lists to trigger new cluster creation
+            return results
         # Re-raise other exceptions
         raise
+    for row, pos in enumerate(positions):
+        results[pos] = _unpack_query_row(result, row)
+    return results
+
+
+def nearest_prototype(
+    os_name: str,
+    templated_text: str | object,
+    k: int = 3,
+    *,
+    query_embedding: Sequence[float] | None = None,
+) -> List[Dict[str, Any]]:
+    """Return top-k nearest prototypes from proto_<os> with distances.
 
-
+    Output per item: {id, document, distance, metadata}
+    """
+    embeddings = [query_embedding] if query_embedding is not None else None
+    return nearest_prototypes(os_name, [templated_text], k=k, query_embeddings=embeddings)[0]
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, Mapping, Optional
+
+
+class DDSketch:
+    """Fixed-accuracy streaming quantile sketch (DDSketch, positive values only).
+
+    A value `x` is counted in bin `ceil(log_gamma(x))` with
+    `gamma = (1 + alpha) / (1 - alpha)`, so every quantile estimate is within a
+    relative error `alpha` of the true value. Values at or below `min_value` share a
+    single zero bin, which bounds the number of bins to
+    `log(max / min_value) / log(gamma)` (about 500 for alpha=0.01 over [1e-4, 2]).
+
+    Bins are plain counters, so sketches merge by addition. That is how they are
+    stored in Redis: one hash per series and time bucket, updated with HINCRBY on
+    fields `b<index>`, plus `z` for the zero bin and `n` for the total.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-4) -> None:
+        if not 0.0 < relative_accuracy < 1.0:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = float(relative_accuracy)
+        self.min_value = float(min_value)
+        self.gamma = (1.0 + self.relative_accuracy) / (1.0 - self.relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def key(self, value: float) -> Optional[int]:
+        """Bin index for a value, or None for the zero bin."""
+        if value <= self.min_value:
+            return None
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def bin_value(self, index: int) -> float:
+        return 2.0 * self.gamma ** index / (self.gamma + 1.0)
+
+    def add(self, value: float, count: int = 1) -> None:
+        index = self.key(float(value))
+        if index is None:
+            self.zero_count += count
+        else:
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise ValueError("cannot merge sketches with different parameters")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated q-quantile (0 <= q <= 1), or None for an empty sketch."""
+        if self.count <= 0:
+            return None
+        rank = max(0.0, min(1.0, float(q))) * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return self.bin_value(index)
+        return self.bin_value(max(self.bins))
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[str, Optional[float]]:
+        """{"p50": ..., "p90": ...} for the given quantiles."""
+        out: Dict[str, Optional[float]] = {}
+        for q in qs:
+            value = self.quantile(q)
+            out[f"p{q * 100:g}"] = round(value, 6) if value is not None else None
+        return out
+
+    @staticmethod
+    def field_for(index: Optional[int]) -> str:
+        return "z" if index is None else f"b{index}"
+
+    def to_fields(self) -> Dict[str, int]:
+        fields = {self.field_for(index): count for index, count in self.bins.items()}
+        if self.zero_count:
+            fields["z"] = self.zero_count
+        fields["n"] = self.count
+        return fields
+
+    @classmethod
+    def from_fields(
+        cls, fields: Mapping[str, object], relative_accuracy: float = 0.01, min_value: float = 1e-4
+    ) -> "DDSketch":
+        sketch = cls(relative_accuracy, min_value)
+        for field, raw in fields.items():
+            try:
+                count = int(float(raw))  # type: ignore[arg-type]
+            except (TypeError, ValueError):
+                continue
+            if field == "z":
+                sketch.zero_count += count
+            elif field.startswith("b"):
+                try:
+                    sketch.bins[int(field[1:])] = sketch.bins.get(int(field[1:]), 0) + count
+                except ValueError:
+                    continue
+            else:
+                continue
+            sketch.count += count
+        return sketch
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+
+LOG = logging.getLogger(__name__)
+
+# Published by the /sources CRUD endpoints; payload is the source id or "*" for all
+INVALIDATION_CHANNEL = "datasource:invalidate"
+
+
+class SourceConfigCache:
+    """In-process TTL cache of DataSource.config by id for the ingestion hot path.
+
+    Misses (including ids with no row) load from Postgres once and are kept for
+    SOURCE_CONFIG_CACHE_TTL_SEC. Writes through the /sources endpoints publish the id
+    on INVALIDATION_CHANNEL; every process runs a listener that drops the entry, so
+    edits apply immediately and the TTL only bounds staleness when a message is lost.
+    A load that overlaps an invalidation is returned but not cached, since its row may
+    predate the write.
+    """
+
+    def __init__(self, ttl_sec: float) -> None:
+        self.ttl_sec = float(ttl_sec)
+        self._entries: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        # One pub/sub listener per event loop that reads from the cache
+        self._listeners: Dict[int, asyncio.Task] = {}
+        # Other per-source caches that must drop entries together with this one
+        self._callbacks: List[Callable[[int | None], None]] = []
+        # Bumped by every invalidation; loads only cache if it did not move meanwhile
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_local(self, source_id: int) -> Dict[str, Any] | None:
+        with self._lock:
+            item = self._entries.get(source_id)
+            if item is None:
+                return None
+            expires_at, config = item
+            if expires_at <= time.monotonic():
+                del self._entries[source_id]
+                return None
+        return copy.deepcopy(config)
+
+    def set_local(self, source_id: int, config: Dict[str, Any], generation: int | None = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[source_id] = (time.monotonic() + self.ttl_sec, copy.deepcopy(config))
+
+    def invalidate(self, source_id: int | None = None) -> None:
+        with self._lock:
+            if source_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(source_id, None)
+            self._generation += 1
+        self.invalidations += 1
+        for callback in list(self._callbacks):
+            try:
+                callback(source_id)
+            except Exception as exc:
+                LOG.info("source invalidation callback failed id=%s err=%s", source_id, exc)
+
+    def add_invalidation_callback(self, callback: Callable[[int | None], None]) -> None:
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    async def get(self, source_id: int) -> Dict[str, Any]:
+        """Config dict of a data source ({} when it does not exist)."""
+        self.ensure_listener()
+        config = self.get_local(source_id)
+        if config is not None:
+            self.hits += 1
+            return config
+        self.misses += 1
+        generation = self._generation
+        from app.db.session import AsyncSessionLocal
+        from app.models.data_source import DataSource
+
+        async with AsyncSessionLocal() as db:  # type: ignore
+            row = await db.get(DataSource, source_id)
+        config = dict(row.config) if row is not None and isinstance(row.config, dict) else {}
+        self.set_local(source_id, config, generation)
+        return copy.deepcopy(config)
+
+    def ensure_listener(self) -> None:
+        """Start the invalidation subscriber for the running event loop (idempotent)."""
+        loop_id = id(asyncio.get_running_loop())
+        task = self._listeners.get(loop_id)
+        if task is None or task.done():
+            self._listeners[loop_id] = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        backoff = 1.0
+        while True:
+            client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything published while we were not subscribed is unknown: start clean
+                self.invalidate()
+                backoff = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = str(message.get("data") or "")
+                    self.invalidate(int(data) if data.isdigit() else None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                LOG.info("source config cache listener failed err=%s; resubscribing in %.1fs", exc, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                try:
+                    await client.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {"entries": size, "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+_cache: SourceConfigCache | None = None
+
+
+def get_source_config_cache() -> SourceConfigCache:
+    global _cache
+    if _cache is None:
+        _cache = SourceConfigCache(ttl_sec=settings.SOURCE_CONFIG_CACHE_TTL_SEC)
+    return _cache
+
+
+async def publish_source_invalidation(redis_client: Any, source_id: int | None = None) -> None:
+    """Tell every process to drop a cached source config (all of them when source_id is None)."""
+    get_source_config_cache().invalidate(source_id)
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, "*" if source_id is None else str(source_id))
+    except Exception as exc:
+        LOG.info("source config invalidation publish failed id=%s err=%s", source_id, exc)
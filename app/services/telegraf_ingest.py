@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Tuple
+
+from redis.exceptions import WatchError
+
+from app.core.config import settings
+from app.services.source_config_cache import get_source_config_cache
+
+LOG = logging.getLogger(__name__)
+
+# Redis tier of the token index: field = sha256(token), value = JSON list of agents
+TOKEN_INDEX_KEY = "telegraf:token_index"
+# Bumped by every invalidation; a rebuild that started under an older generation is discarded
+TOKEN_INDEX_GEN_KEY = "telegraf:token_index:gen"
+_BUILT_FIELD = "__built__"
+
+
+class TokenIndexUnavailable(RuntimeError):
+    """The token index is not built (rebuild throttled or discarded); retry shortly."""
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _agent_record(row: Any) -> Dict[str, Any]:
+    cfg = row.config or {}
+    return {
+        "id": row.id,
+        "name": row.name,
+        "agent_id": str(cfg.get("agent_id") or ""),
+        "allowed_hosts": list(cfg.get("allowed_hosts") or []),
+    }
+
+
+class TelegrafAgentIndex:
+    """Hashed-token -> enabled telegraf agents, for authenticating ingest batches.
+
+    Lookups hit an in-memory TTL map first, then the Redis hash TOKEN_INDEX_KEY shared
+    by all replicas. When that hash is missing it is rebuilt from the enabled telegraf
+    DataSources in one query (at most once per TELEGRAF_AUTH_REBUILD_MIN_SEC, so bad
+    tokens cannot hammer Postgres). Unknown tokens are cached as misses only when the
+    index was actually built; while it is not, lookups of uncached tokens raise
+    TokenIndexUnavailable instead of rejecting them. Source writes bump TOKEN_INDEX_GEN_KEY and delete the
+    Redis hash, and through the source invalidation channel clear every replica's
+    memory tier; rebuilds and memory fills that began before an invalidation are
+    dropped, so a stale DB read cannot hide a new token. Plain tokens are never stored.
+    """
+
+    def __init__(self, ttl_sec: float) -> None:
+        self.ttl_sec = float(ttl_sec)
+        self._entries: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+        self._rebuild_lock: asyncio.Lock | None = None
+        self._last_rebuild = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def invalidate(self, source_id: int | None = None) -> None:
+        # Agents are keyed by token, not id: any source change clears the memory tier
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        self._last_rebuild = 0.0
+
+    def _get_local(self, digest: str) -> List[Dict[str, Any]] | None:
+        with self._lock:
+            item = self._entries.get(digest)
+            if item is None or item[0] <= time.monotonic():
+                return None
+            return item[1]
+
+    def _set_local(self, digest: str, agents: List[Dict[str, Any]], generation: int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return  # invalidated while loading
+            self._entries[digest] = (time.monotonic() + self.ttl_sec, agents)
+            if len(self._entries) > int(settings.TELEGRAF_AUTH_CACHE_MAX_ENTRIES):
+                self._entries.pop(next(iter(self._entries)))
+
+    async def _rebuild(self, redis_client: Any) -> None:
+        if self._rebuild_lock is None:
+            self._rebuild_lock = asyncio.Lock()
+        async with self._rebuild_lock:
+            if time.monotonic() - self._last_rebuild < float(settings.TELEGRAF_AUTH_REBUILD_MIN_SEC):
+                return
+            self._last_rebuild = time.monotonic()
+            generation = await redis_client.get(TOKEN_INDEX_GEN_KEY)
+            from sqlalchemy import select
+
+            from app.db.session import AsyncSessionLocal
+            from app.models.data_source import DataSource
+
+            async with AsyncSessionLocal() as db:  # type: ignore
+                res = await db.execute(select(DataSource).where(DataSource.type == "telegraf", DataSource.enabled.is_(True)))
+                rows = list(res.scalars().all())
+            index: Dict[str, List[Dict[str, Any]]] = {}
+            for row in rows:
+                tok = str((row.config or {}).get("token") or "")
+                if tok:
+                    index.setdefault(token_hash(tok), []).append(_agent_record(row))
+            mapping = {digest: json.dumps(agents) for digest, agents in index.items()}
+            mapping[_BUILT_FIELD] = str(time.time())
+            try:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    await pipe.watch(TOKEN_INDEX_GEN_KEY)
+                    if await pipe.get(TOKEN_INDEX_GEN_KEY) != generation:
+                        raise WatchError("token index invalidated during rebuild")
+                    pipe.multi()
+                    pipe.delete(TOKEN_INDEX_KEY)
+                    pipe.hset(TOKEN_INDEX_KEY, mapping=mapping)
+                    pipe.expire(TOKEN_INDEX_KEY, int(settings.TELEGRAF_AUTH_INDEX_TTL_SEC))
+                    await pipe.execute()
+            except WatchError:
+                # Sources changed after our query; the next lookup rebuilds from fresh rows
+                self._last_rebuild = 0.0
+                LOG.info("telegraf token index rebuild discarded (sources changed)")
+                return
+            self.rebuilds += 1
+            LOG.info("telegraf token index rebuilt agents=%d tokens=%d", len(rows), len(index))
+
+    async def _load(self, redis_client: Any, digest: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Agents for a token hash and whether the answer came from a built index."""
+        for attempt in (0, 1):
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hget(TOKEN_INDEX_KEY, _BUILT_FIELD)
+                pipe.hget(TOKEN_INDEX_KEY, digest)
+                built, raw = await pipe.execute()
+            if built:
+                return (json.loads(raw) if raw else []), True
+            if attempt == 0:
+                await self._rebuild(redis_client)
+        return [], False
+
+    async def lookup(self, redis_client: Any, token: str, agent_id: str | None = None) -> Dict[str, Any] | None:
+        """The enabled agent owning `token` (and `agent_id` when both sides set one), or None.
+
+        Raises TokenIndexUnavailable when the token is not cached and the index could
+        not be built, since the token may well be valid.
+        """
+        get_source_config_cache().ensure_listener()
+        digest = token_hash(token)
+        agents = self._get_local(digest)
+        if agents is None:
+            self.misses += 1
+            generation = self._generation
+            agents, built = await self._load(redis_client, digest)
+            # An unbuilt index (rebuild throttled or discarded) proves nothing: don't cache it
+            if not built:
+                raise TokenIndexUnavailable("telegraf token index is being rebuilt")
+            self._set_local(digest, agents, generation)
+        else:
+            self.hits += 1
+        for agent in agents:
+            aid = agent.get("agent_id") or ""
+            if aid and agent_id and aid != agent_id:
+                continue
+            return agent
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {"entries": size, "hits": self.hits, "misses": self.misses, "rebuilds": self.rebuilds}
+
+
+_index: TelegrafAgentIndex | None = None
+
+
+def get_telegraf_index() -> TelegrafAgentIndex:
+    global _index
+    if _index is None:
+        _index = TelegrafAgentIndex(ttl_sec=settings.TELEGRAF_AUTH_CACHE_TTL_SEC)
+        get_source_config_cache().add_invalidation_callback(_index.invalidate)
+    return _index
+
+
+async def invalidate_telegraf_index(redis_client: Any) -> None:
+    """Drop the shared Redis tier; call before publishing the source invalidation."""
+    get_telegraf_index().invalidate()
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(TOKEN_INDEX_GEN_KEY)
+            pipe.delete(TOKEN_INDEX_KEY)
+            await pipe.execute()
+    except Exception as exc:
+        LOG.info("telegraf token index invalidation failed err=%s", exc)
+
+
+# --- request bodies ---
+
+def _gunzip(body: bytes, limit: int) -> bytes:
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = inflater.decompress(body, limit + 1)
+    if len(out) > limit:
+        raise ValueError("decompressed body too large")
+    return out
+
+
+def _split(text: str, sep: str, quoted: bool = False) -> List[str]:
+    """Split on `sep` outside backslash escapes (and double quotes when `quoted`)."""
+    parts: List[str] = []
+    buf: List[str] = []
+    escaped = in_quotes = False
+    for ch in text:
+        if escaped:
+            buf.append(ch)
+            escaped = False
+        elif ch == "\\":
+            buf.append(ch)
+            escaped = True
+        elif quoted and ch == '"':
+            buf.append(ch)
+            in_quotes = not in_quotes
+        elif ch == sep and not in_quotes:
+            parts.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    parts.append("".join(buf))
+    return parts
+
+
+def _unescape(text: str) -> str:
+    out: List[str] = []
+    escaped = False
+    for ch in text:
+        if escaped or ch != "\\":
+            out.append(ch)
+            escaped = False
+        else:
+            escaped = True
+    return "".join(out)
+
+
+def _field_value(raw: str) -> Any:
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if raw in {"t", "T", "true", "True", "TRUE"}:
+        return True
+    if raw in {"f", "F", "false", "False", "FALSE"}:
+        return False
+    if raw[-1:] in {"i", "u"}:
+        return int(raw[:-1])
+    return float(raw)
+
+
+def _epoch_seconds(ts: int) -> int:
+    # Telegraf precision may be ns/us/ms/s; the batch model carries seconds
+    for threshold, divisor in ((10**17, 10**9), (10**14, 10**6), (10**11, 10**3)):
+        if abs(ts) >= threshold:
+            return ts // divisor
+    return ts
+
+
+def parse_line_protocol(text: str) -> List[Dict[str, Any]]:
+    """InfluxDB line protocol (Telegraf's influx output) as telegraf JSON metric dicts."""
+    metrics: List[Dict[str, Any]] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        sections = [s for s in _split(line, " ", quoted=True) if s]
+        if len(sections) < 2:
+            raise ValueError(f"invalid line protocol: {line[:80]}")
+        head = _split(sections[0], ",")
+        tags: Dict[str, Any] = {}
+        for item in head[1:]:
+            key, _, value = item.partition("=")
+            tags[_unescape(key)] = _unescape(value)
+        fields: Dict[str, Any] = {}
+        for item in _split(sections[1], ",", quoted=True):
+            key, _, value = item.partition("=")
+            if key:
+                fields[_unescape(key)] = _field_value(value)
+        timestamp = _epoch_seconds(int(sections[2])) if len(sections) > 2 else None
+        metrics.append({"name": _unescape(head[0]), "tags": tags, "fields": fields, "timestamp": timestamp})
+    return metrics
+
+
+def decode_body(body: bytes, content_type: str | None, content_encoding: str | None) -> List[Dict[str, Any]]:
+    """Telegraf metric dicts from a raw request body: JSON or line protocol, optionally gzipped."""
+    limit = int(settings.TELEGRAF_MAX_BODY_BYTES)
+    if "gzip" in (content_encoding or "").lower() or body[:2] == b"\x1f\x8b":
+        body = _gunzip(body, limit)
+    elif len(body) > limit:
+        raise ValueError("body too large")
+    text = body.decode("utf-8", errors="replace")
+    stripped = text.lstrip()
+    if "json" in (content_type or "").lower() or stripped[:1] in {"{", "["}:
+        doc = json.loads(text)
+        if isinstance(doc, dict):
+            return list(doc.get("metrics") or []) if "metrics" in doc else [doc]
+        return list(doc)
+    return parse_line_protocol(text)
@@ -14,6 +14,7 @@ from fastapi import FastAPI
 
 from app.core.config import get_settings
 from app.rules.automations import load_rules
+from app.streams.utils import GroupReader, consumer_name
 
 
 LOG = logging.getLogger(__name__)
@@ -152,7 +153,8 @@ async def run_automations() -> None:
     global _total_triggered, _provider_counts, _last_trigger_iso
     rules = load_rules()
     group = "automations"
-    consumer = "auto_1"
+    consumer = consumer_name("auto")
+    reader = GroupReader(redis, settings.ALERTS_STREAM, group, consumer)
     try:
         await redis.xgroup_create(settings.ALERTS_STREAM, group, id="$", mkstream=True)
     except Exception:
@@ -163,7 +165,7 @@ async def run_automations() -> None:
             if not enabled:
                 await asyncio.sleep(1)
                 continue
-            resp = await redis.xreadgroup(group, consumer, {settings.ALERTS_STREAM: ">"}, count=50, block=1000)
+            resp = await reader.read(count=50, block=1000)
         except Exception as exc:
             LOG.info("automations read failed err=%s", exc)
             await asyncio.sleep(1)
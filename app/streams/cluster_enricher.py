@@ -3,14 +3,17 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
-from typing import Any, Dict, List, Sequence, cast
+from typing import Any, Dict, List, Sequence, Tuple, cast
 
 import redis.asyncio as aioredis
 
 from fastapi import FastAPI
 from app.core.config import get_settings
 from app.services.chroma_service import ChromaClientProvider, collection_name_for_os
-from app.services.llm_service import classify_cluster, generate_hypothesis
+from app.streams.retention import xadd_args
+from app.streams.utils import GroupReader, consumer_name
+from app.services.llm_service import aclassify_cluster, aclassify_clusters_batch, public_result
+from app.services.label_propagation import classification_for_cluster, classification_metadata
 import threading
 
 
@@ -114,192 +117,307 @@ def _get_prototype(os_name: str, cluster_id: str) -> tuple[list[float] | None, s
     return centroid, medoid_doc, meta
 
 
+def _prepare_candidate(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Gather prototype, neighbor and in-cluster log context for one candidate (blocking Chroma I/O)."""
+    os_name = data.get("os") or "unknown"
+    cluster_id = data.get("cluster_id") or ""
+    centroid, medoid_doc, proto_meta = _get_prototype(os_name, cluster_id)
+
+    # neighbors from templates via centroid
+    neighbors: List[Dict[str, Any]] = []
+    # Avoid numpy truthiness ambiguity on arrays by coercing to list and checking size explicitly
+    centroid_vec: list[float] | None = None
+    if centroid is not None:
+        try:
+            import numpy as np  # type: ignore
+            if isinstance(centroid, np.ndarray):
+                centroid_vec = centroid.tolist()
+            else:
+                centroid_vec = list(centroid)
+        except Exception:
+            centroid_vec = list(centroid) if centroid else None
+    # Reuse a stored classification (own or nearest labelled prototype) instead of the LLM
+    propagated = classification_for_cluster(os_name, cluster_id, proto_meta, centroid_vec)
+    if propagated is None and centroid_vec and len(centroid_vec) > 0:
+        try:
+            tcoll = _get_provider().get_or_create_collection(collection_name_for_os(os_name))
+            q = tcoll.query(query_embeddings=[centroid_vec], n_results=8, include=["documents", "metadatas", "distances"]) or {}
+            ids = _first_result_list(q, "ids")
+            docs = _first_result_list(q, "documents")
+            dists = _first_result_list(q, "distances")
+            metas = _first_result_list(q, "metadatas")
+            for i in range(len(ids)):
+                neighbors.append({
+                    "id": ids[i],
+                    "document": docs[i] if i < len(docs) else "",
+                    "distance": dists[i] if i < len(dists) else None,
+                    "metadata": metas[i] if i < len(metas) else {},
+                })
+        except Exception as e:
+            # Handle ChromaDB HNSW index errors gracefully
+            if "Nothing found on disk" in str(e) or "hnsw segment reader" in str(e):
+                LOG.info("cluster enricher: template collection index corrupted, skipping neighbor lookup id=%s os=%s err=%s", cluster_id, os_name, e)
+            else:
+                raise
+
+    # retrieve logs within same cluster via where filter (use get instead of query to avoid vector/text requirement)
+    retrieved: List[Dict[str, Any]] = []
+    env_ids_set: set[str] = set()
+    lcoll = _get_provider().get_or_create_collection(_logs_collection_name(os_name))
+    try:
+        res = cast(Dict[str, Any], lcoll.get(where={"cluster_id": cluster_id}, include=["documents", "metadatas"], limit=30)) or {}
+    except Exception:
+        res = {}
+    ids = list(res.get("ids") or [])
+    docs = list(res.get("documents") or [])
+    metas = list(res.get("metadatas") or [])
+    for i in range(len(ids)):
+        meta_i = metas[i] if i < len(metas) else {}
+        env_val = (meta_i or {}).get("env_id")
+        if env_val:
+            env_ids_set.add(str(env_val))
+        retrieved.append({
+            "id": ids[i],
+            "templated": docs[i] if i < len(docs) else "",
+            "raw": (meta_i or {}).get("raw", ""),
+            "source": (meta_i or {}).get("source", ""),
+            "os": (meta_i or {}).get("os", os_name),
+            "env_id": env_val,
+        })
+
+    # Fallback: use sample logs from candidate if Chroma lookup was empty.
+    if not retrieved:
+        try:
+            sample_logs = json.loads(data.get("sample_logs") or "[]")
+        except Exception:
+            sample_logs = []
+        if isinstance(sample_logs, list) and sample_logs:
+            for s in sample_logs[:10]:
+                if not isinstance(s, dict):
+                    continue
+                env_val = s.get("env_id")
+                if env_val:
+                    env_ids_set.add(str(env_val))
+                retrieved.append({
+                    "id": s.get("id") or "",
+                    "templated": s.get("templated") or "",
+                    "raw": s.get("raw") or "",
+                    "source": s.get("source") or "",
+                    "os": s.get("os") or os_name,
+                    "env_id": env_val,
+                })
+    if not env_ids_set:
+        try:
+            env_ids_list = json.loads(data.get("env_ids") or "[]")
+            for env_val in env_ids_list or []:
+                if env_val:
+                    env_ids_set.add(str(env_val))
+        except Exception:
+            pass
+    return {
+        "os": os_name,
+        "cluster_id": cluster_id,
+        "medoid_doc": medoid_doc,
+        "proto_meta": proto_meta,
+        "neighbors": neighbors,
+        "retrieved": retrieved,
+        "env_ids": sorted(env_ids_set),
+        "propagated": propagated,
+    }
+
+
+async def _publish_result(ctx: Dict[str, Any], result: Dict[str, Any], operation: str) -> None:
+    os_name = ctx["os"]
+    cluster_id = ctx["cluster_id"]
+    retrieved = ctx["retrieved"]
+    proto_meta = ctx["proto_meta"]
+    env_ids_list = list(ctx["env_ids"])
+    # Record LLM metrics if enabled
+    if settings.ENABLE_CLUSTER_METRICS and "propagated_from" not in result:
+        try:
+            from app.services.cluster_metrics import get_metrics_buffer
+            metadata = result.get("_llm_metadata", {})
+            get_metrics_buffer().record_llm_call(
+                os_name=os_name,
+                cluster_id=cluster_id,
+                operation=operation,
+                confidence=result.get("confidence"),
+                tokens_used=metadata.get("tokens", 0),
+                latency_ms=metadata.get("latency_ms", 0),
+                success=metadata.get("success", True),
+                prompt_tokens=metadata.get("prompt_tokens", 0),
+                completion_tokens=metadata.get("completion_tokens", 0),
+                cached=metadata.get("cached", False),
+            )
+        except Exception:
+            pass  # Don't fail enrichment if metrics fail
+    
+    payload = {
+        "type": "cluster",
+        "os": os_name,
+        "cluster_id": cluster_id,
+        "failure_type": result.get("failure_type", ""),
+        "confidence": str(result.get("confidence") or ""),
+        "result": json.dumps(public_result(result)),
+        "env_id": env_ids_list[0] if len(env_ids_list) == 1 else "",
+        "env_ids": json.dumps(env_ids_list),
+        "evidence_logs": json.dumps(retrieved),
+    }
+    entry_id = await redis.xadd(settings.ALERTS_STREAM, payload, **xadd_args(settings.ALERTS_STREAM))  # type: ignore[arg-type]
+    try:
+        import logging as _logging
+        _logging.getLogger("app.kaboom").info(
+            "alert_published id=%s os=%s type=%s cluster_id=%s",
+            entry_id, os_name, "cluster", cluster_id
+        )
+    except Exception:
+        pass
+
+    # Update prototype metadata with learned label/solution (Chroma I/O in a worker thread)
+    await asyncio.to_thread(_store_prototype_label, os_name, cluster_id, proto_meta, result)
+
+
+def _store_prototype_label(os_name: str, cluster_id: str, proto_meta: Dict[str, Any] | None, result: Dict[str, Any]) -> None:
+    try:
+        source = result.get("propagated_from")
+        if source and source.get("cluster_id") == cluster_id:
+            # Reused this prototype's own classification: it stays a propagation source as-is
+            return
+        pcoll = _get_provider().get_or_create_collection(_proto_collection_name(os_name))
+        meta = dict(proto_meta or {})
+        meta["label"] = result.get("failure_type", meta.get("label", "unknown"))
+        meta["rationale"] = "propagated" if source else "llm_cluster"
+        if result.get("recommendation"):
+            meta["solution"] = result.get("recommendation")
+        if source:
+            # Propagated labels are never a propagation source themselves (no A->B->C chains)
+            for key in ("classification", "classification_confidence", "classified_at"):
+                meta.pop(key, None)
+        elif not result.get("error"):
+            meta.update(classification_metadata(result))
+        pcoll.update(ids=[cluster_id], metadatas=[meta])
+    except Exception:
+        pass
+
+
+async def _classify_batch(batch: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], str]]:
+    """Classify candidates of one OS; several at once in a single LLM request when batching is on."""
+    if len(batch) == 1:
+        ctx = batch[0]
+        result = await aclassify_cluster(ctx["os"], ctx["cluster_id"], ctx["medoid_doc"], ctx["neighbors"], ctx["retrieved"])
+        return [(result, "classify_cluster")]
+    results = await aclassify_clusters_batch(batch[0]["os"], batch)
+    out: List[Tuple[Dict[str, Any], str]] = []
+    for ctx, batch_result in zip(batch, results):
+        if batch_result is None:
+            # The model skipped this item; fall back to a dedicated request
+            single = await aclassify_cluster(ctx["os"], ctx["cluster_id"], ctx["medoid_doc"], ctx["neighbors"], ctx["retrieved"])
+            out.append((single, "classify_cluster"))
+        else:
+            out.append((batch_result, "classify_clusters_batch"))
+    return out
+
+
+async def _flush_pending(group: str, pending: List[Tuple[str, Dict[str, Any]]]) -> None:
+    by_os: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for msg_id, ctx in pending:
+        if ctx.get("propagated") is not None:
+            try:
+                await _publish_result(ctx, ctx["propagated"], "label_propagation")
+                LOG.info(
+                    "cluster enricher reused label os=%s cluster_id=%s from=%s",
+                    ctx["os"], ctx["cluster_id"], ctx["propagated"]["propagated_from"]["cluster_id"],
+                )
+            except Exception as exc:
+                _log_candidate_failure(msg_id, ctx.get("os"), ctx.get("cluster_id"), exc)
+            finally:
+                try:
+                    await redis.xack(settings.CLUSTERS_CANDIDATES_STREAM, group, msg_id)
+                except Exception:
+                    pass
+            continue
+        by_os.setdefault(ctx["os"], []).append((msg_id, ctx))
+    for os_name, items in by_os.items():
+        try:
+            results = await _classify_batch([ctx for _, ctx in items])
+        except Exception as exc:
+            LOG.exception("cluster enricher classification failed os=%s n=%d err=%s", os_name, len(items), exc)
+            results = []
+        for i, (msg_id, ctx) in enumerate(items):
+            try:
+                if i >= len(results):
+                    raise RuntimeError("no classification result")
+                result, operation = results[i]
+                await _publish_result(ctx, result, operation)
+            except Exception as exc:
+                _log_candidate_failure(msg_id, ctx.get("os"), ctx.get("cluster_id"), exc)
+            finally:
+                try:
+                    await redis.xack(settings.CLUSTERS_CANDIDATES_STREAM, group, msg_id)
+                except Exception:
+                    pass
+
+
+def _log_candidate_failure(msg_id: str, os_name: Any, cluster_id: Any, exc: Exception) -> None:
+    LOG.exception("cluster enricher processing failed id=%s err=%s", msg_id, exc)
+    try:
+        import logging as _logging
+        _logging.getLogger("app.kaboom").info(
+            "cluster_enricher_failed id=%s os=%s cluster_id=%s err=%s",
+            msg_id, os_name, cluster_id, exc
+        )
+    except Exception:
+        pass
+
+
 async def run_cluster_enricher() -> None:
+    """Classify cluster candidates, micro-batching them per OS.
+
+    Up to CLUSTER_ENRICHER_BATCH_SIZE prepared candidates are held for at most
+    CLUSTER_ENRICHER_BATCH_MAX_WAIT_SEC, then each OS group is classified in one
+    LLM request. Candidates are acked only after their alert is published.
+    """
     group = "clusters_enrichers"
-    consumer = "cluster_enricher_1"
+    consumer = consumer_name("cluster_enricher")
+    reader = GroupReader(redis, settings.CLUSTERS_CANDIDATES_STREAM, group, consumer)
     try:
         await redis.xgroup_create(settings.CLUSTERS_CANDIDATES_STREAM, group, id="$", mkstream=True)
     except Exception:
         pass
 
+    batch_size = max(1, int(settings.CLUSTER_ENRICHER_BATCH_SIZE))
+    max_wait = max(0.0, float(settings.CLUSTER_ENRICHER_BATCH_MAX_WAIT_SEC))
+    loop = asyncio.get_running_loop()
+    pending: List[Tuple[str, Dict[str, Any]]] = []
+    deadline = 0.0
+
     while True:
+        block = 1000
+        if pending:
+            block = max(1, int((deadline - loop.time()) * 1000))
         try:
-            response = await redis.xreadgroup(group, consumer, {settings.CLUSTERS_CANDIDATES_STREAM: ">"}, count=5, block=1000)
+            response = await reader.read(count=max(1, batch_size - len(pending)), block=block)
         except Exception as exc:
             LOG.info("cluster enricher read failed err=%s", exc)
+            response = None
             await asyncio.sleep(1)
-            continue
-        if not response:
-            continue
-        for _, messages in response:
+        for _, messages in response or []:
             for msg_id, data in messages:
                 try:
-                    os_name = data.get("os") or "unknown"
-                    cluster_id = data.get("cluster_id") or ""
-                    centroid, medoid_doc, proto_meta = _get_prototype(os_name, cluster_id)
-
-                    # neighbors from templates via centroid
-                    neighbors: List[Dict[str, Any]] = []
-                    # Avoid numpy truthiness ambiguity on arrays by coercing to list and checking size explicitly
-                    centroid_vec: list[float] | None = None
-                    if centroid is not None:
-                        try:
-                            import numpy as np  # type: ignore
-                            if isinstance(centroid, np.ndarray):
-                                centroid_vec = centroid.tolist()
-                            else:
-                                centroid_vec = list(centroid)
-                        except Exception:
-                            centroid_vec = list(centroid) if centroid else None
-                    if centroid_vec and len(centroid_vec) > 0:
-                        try:
-                            tcoll = _get_provider().get_or_create_collection(collection_name_for_os(os_name))
-                            q = tcoll.query(query_embeddings=[centroid_vec], n_results=8, include=["documents", "metadatas", "distances"]) or {}
-                            ids = _first_result_list(q, "ids")
-                            docs = _first_result_list(q, "documents")
-                            dists = _first_result_list(q, "distances")
-                            metas = _first_result_list(q, "metadatas")
-                            for i in range(len(ids)):
-                                neighbors.append({
-                                    "id": ids[i],
-                                    "document": docs[i] if i < len(docs) else "",
-                                    "distance": dists[i] if i < len(dists) else None,
-                                    "metadata": metas[i] if i < len(metas) else {},
-                                })
-                        except Exception as e:
-                            # Handle ChromaDB HNSW index errors gracefully
-                            if "Nothing found on disk" in str(e) or "hnsw segment reader" in str(e):
-                                LOG.info("cluster enricher: template collection index corrupted, skipping neighbor lookup id=%s os=%s err=%s", cluster_id, os_name, e)
-                            else:
-                                raise
-
-                    # HYDE queries using medoid (kept for future use), but retrieval will not use query()
-                    seed_logs = [{"templated": medoid_doc}] if medoid_doc else []
-                    _queries = generate_hypothesis(os_name, medoid_doc, seed_logs, num_queries=3)  # noqa: F841
-
-                    # retrieve logs within same cluster via where filter (use get instead of query to avoid vector/text requirement)
-                    retrieved: List[Dict[str, Any]] = []
-                    env_ids_set: set[str] = set()
-                    lcoll = _get_provider().get_or_create_collection(_logs_collection_name(os_name))
-                    try:
-                        res = cast(Dict[str, Any], lcoll.get(where={"cluster_id": cluster_id}, include=["documents", "metadatas"], limit=30)) or {}
-                    except Exception:
-                        res = {}
-                    ids = list(res.get("ids") or [])
-                    docs = list(res.get("documents") or [])
-                    metas = list(res.get("metadatas") or [])
-                    for i in range(len(ids)):
-                        meta_i = metas[i] if i < len(metas) else {}
-                        env_val = (meta_i or {}).get("env_id")
-                        if env_val:
-                            env_ids_set.add(str(env_val))
-                        retrieved.append({
-                            "id": ids[i],
-                            "templated": docs[i] if i < len(docs) else "",
-                            "raw": (meta_i or {}).get("raw", ""),
-                            "source": (meta_i or {}).get("source", ""),
-                            "os": (meta_i or {}).get("os", os_name),
-                            "env_id": env_val,
-                        })
-
-                    # Fallback: use sample logs from candidate if Chroma lookup was empty.
-                    if not retrieved:
-                        try:
-                            sample_logs = json.loads(data.get("sample_logs") or "[]")
-                        except Exception:
-                            sample_logs = []
-                        if isinstance(sample_logs, list) and sample_logs:
-                            for s in sample_logs[:10]:
-                                if not isinstance(s, dict):
-                                    continue
-                                env_val = s.get("env_id")
-                                if env_val:
-                                    env_ids_set.add(str(env_val))
-                                retrieved.append({
-                                    "id": s.get("id") or "",
-                                    "templated": s.get("templated") or "",
-                                    "raw": s.get("raw") or "",
-                                    "source": s.get("source") or "",
-                                    "os": s.get("os") or os_name,
-                                    "env_id": env_val,
-                                })
-                    if not env_ids_set:
-                        try:
-                            env_ids_list = json.loads(data.get("env_ids") or "[]")
-                            for env_val in env_ids_list or []:
-                                if env_val:
-                                    env_ids_set.add(str(env_val))
-                        except Exception:
-                            pass
-
-                    result = classify_cluster(os_name, cluster_id, medoid_doc, neighbors, retrieved)
-                    
-                    # Record LLM metrics if enabled
-                    if settings.ENABLE_CLUSTER_METRICS:
-                        try:
-                            from app.services.cluster_metrics import ClusterMetricsTracker
-                            metadata = result.get("_llm_metadata", {})
-                            tracker = ClusterMetricsTracker(redis)
-                            await tracker.record_llm_call(
-                                os_name=os_name,
-                                cluster_id=cluster_id,
-                                operation="classify_cluster",
-                                confidence=result.get("confidence"),
-                                tokens_used=metadata.get("tokens", 0),
-                                latency_ms=metadata.get("latency_ms", 0),
-                                success=metadata.get("success", True),
-                            )
-                        except Exception:
-                            pass  # Don't fail enrichment if metrics fail
-                    
-                    env_ids_list = list(env_ids_set)
-                    payload = {
-                        "type": "cluster",
-                        "os": os_name,
-                        "cluster_id": cluster_id,
-                        "failure_type": result.get("failure_type", ""),
-                        "confidence": str(result.get("confidence") or ""),
-                        "result": json.dumps(result),
-                        "env_id": env_ids_list[0] if len(env_ids_list) == 1 else "",
-                        "env_ids": json.dumps(env_ids_list),
-                        "evidence_logs": json.dumps(retrieved),
-                    }
-                    entry_id = await redis.xadd(settings.ALERTS_STREAM, payload)  # type: ignore[arg-type]
-                    try:
-                        import logging as _logging
-                        _logging.getLogger("app.kaboom").info(
-                            "alert_published id=%s os=%s type=%s cluster_id=%s",
-                            entry_id, os_name, "cluster", cluster_id
-                        )
-                    except Exception:
-                        pass
-
-                    # Update prototype metadata with learned label/solution
-                    try:
-                        pcoll = _get_provider().get_or_create_collection(_proto_collection_name(os_name))
-                        meta = dict(proto_meta or {})
-                        meta["label"] = result.get("failure_type", meta.get("label", "unknown"))
-                        meta["rationale"] = "llm_cluster"
-                        if result.get("recommendation"):
-                            meta["solution"] = result.get("recommendation")
-                        pcoll.update(ids=[cluster_id], metadatas=[meta])
-                    except Exception:
-                        pass
+                    ctx = await asyncio.to_thread(_prepare_candidate, data)
                 except Exception as exc:
-                    LOG.exception("cluster enricher processing failed id=%s err=%s", msg_id, exc)
-                    try:
-                        import logging as _logging
-                        _logging.getLogger("app.kaboom").info(
-                            "cluster_enricher_failed id=%s os=%s cluster_id=%s err=%s",
-                            msg_id, data.get("os"), data.get("cluster_id"), exc
-                        )
-                    except Exception:
-                        pass
-                finally:
+                    _log_candidate_failure(msg_id, data.get("os"), data.get("cluster_id"), exc)
                     try:
                         await redis.xack(settings.CLUSTERS_CANDIDATES_STREAM, group, msg_id)
                     except Exception:
                         pass
+                    continue
+                if not pending:
+                    deadline = loop.time() + max_wait
+                pending.append((msg_id, ctx))
+        if pending and (len(pending) >= batch_size or loop.time() >= deadline):
+            batch, pending = pending, []
+            await _flush_pending(group, batch)
 
 
 def attach_cluster_enricher(app: FastAPI):
@@ -2,7 +2,9 @@ import asyncio
 import logging
 import re
 from collections import defaultdict
-from typing import Any, Dict, List
+from typing import Any, Dict, List, cast
+
+from chromadb.api.types import Embedding
 
 import redis.asyncio as aioredis
 from redis.exceptions import ResponseError
@@ -11,11 +13,8 @@ import threading
 
 from app.core.config import get_settings
 from app.services.chroma_service import ChromaClientProvider
-from app.services.failure_rules import match_failure_signals
-from app.services.prototype_router import nearest_prototype
-from app.parsers.linux import parse_linux_line
-from app.parsers.macos import parse_macos_line
-from app.parsers.templating import render_templated_line
+from app.services.cpu_pool import parse_lines
+from app.services.prototype_router import nearest_prototypes
 from app.services.metrics_normalization import normalize
 # Ensure normalizers are registered at import time
 from app.services.normalizers import telegraf as _telegraf_norm  # noqa: F401
@@ -23,16 +22,22 @@ from app.services.normalizers import dcim_http as _dcim_http_norm  # noqa: F401
 from app.services.normalizers import snmp as _snmp_norm  # noqa: F401
 from app.services.normalizers import redfish as _redfish_norm  # noqa: F401
 from app.services.otel_exporter import export_metrics
-from app.db.session import AsyncSessionLocal
-from app.models.data_source import DataSource
+from app.services.source_config_cache import get_source_config_cache
+from app.streams.metrics_stream import write_points
+from app.streams.retention import xadd_args
+from app.streams.utils import GroupReader, consumer_name
+from app.streams.issues_aggregator import (
+    aggregate_entries,
+    close_idle_issues,
+    normalize_json_for_clustering,
+)
 
 settings = get_settings()
 redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
 
 STREAM_NAME = "logs"
 GROUP_NAME = "log_consumers"
-CONSUMER_NAME = "consumer_1"
-METRICS_STREAM = "metrics"
+CONSUMER_BASE_NAME = "consumer"
 
 _provider: ChromaClientProvider | None = None
 LOG = logging.getLogger(__name__)
@@ -102,25 +107,66 @@ def _derive_env_id(line: str, parsed: Dict[str, str]) -> str | None:
     return env
 
 
-def _parse_and_template(os_name: str, line: str) -> tuple[str, Dict[str, str]]:
-    parsed: Dict[str, str] | None = None
-    if os_name == "linux":
-        parsed = parse_linux_line(0, line) or None
-    elif os_name == "macos":
-        parsed = parse_macos_line(0, line) or None
-    if not parsed:
-        templated = render_templated_line(component="unknown", pid=None, content=line)
-        return templated, {"content": line, "component": "unknown"}
-    templated = render_templated_line(
-        component=parsed.get("component", ""),
-        pid=parsed.get("PID"),
-        content=parsed.get("content", ""),
-    )
-    return templated, parsed
-
-
-async def consume_logs():
+def _log_message_failure(msg_id: str, data: Dict[str, Any], exc: Exception) -> None:
+    LOG.info("consumer message processing failed id=%s err=%s", msg_id, exc)
+    try:
+        logging.getLogger("app.kaboom").info(
+            "consumer_failed id=%s source=%s kind=%s os_guess=%s err=%s line_len=%s",
+            msg_id, data.get("source"), (data.get("source") or "").split(":",1)[0],
+            _os_from_source(data.get("source")), exc, len((data.get("line") or "")),
+        )
+    except Exception:
+        pass
+
+
+def _candidate_from_route(os_name: str, item: Dict[str, Any], nearest: List[Dict[str, Any]]) -> Dict[str, Any] | None:
+    """Decide whether a routed line becomes a per-line candidate."""
+    rule = item["rule"]
+    distance = nearest[0]["distance"] if nearest else None
+    label = (nearest[0]["metadata"] or {}).get("label") if nearest else None
+
+    should_candidate = False
+    if rule.get("has_signal"):
+        should_candidate = True
+    if distance is None or (isinstance(distance, (int, float)) and distance > settings.NEAREST_PROTO_THRESHOLD):
+        should_candidate = True
+    if not should_candidate:
+        return None
+    return {
+        "os": os_name,
+        "raw": item["raw"],
+        "templated": item["templated"],
+        "rule_label": rule.get("label"),
+        "rule_score": rule.get("score"),
+        "nearest_distance": distance if distance is not None else "",
+        "nearest_label": label or "",
+    }
+
+
+def _upsert_collections(provider: Any, batched: Dict[str, Dict[str, Any]], embedded: Dict[str, List[float]]) -> None:
+    for coll_name, payload in batched.items():
+        try:
+            collection = provider.get_or_create_collection(coll_name)
+            if payload["ids"]:
+                doc_vectors = [embedded.get(doc) for doc in payload["documents"]]
+                if all(v is not None for v in doc_vectors):
+                    collection.upsert(
+                        ids=payload["ids"],
+                        documents=payload["documents"],
+                        embeddings=cast(List[Embedding], doc_vectors),
+                        metadatas=payload["metadatas"],
+                    )
+                else:
+                    collection.upsert(ids=payload["ids"], documents=payload["documents"], metadatas=payload["metadatas"])
+                LOG.info("upserted collection=%s count=%d", coll_name, len(payload["ids"]))
+        except Exception:
+            LOG.exception("upsert failed collection=%s", coll_name)
+
+
+async def consume_logs(worker: int = 0):
     """Consume new messages from Redis Stream and acknowledge them."""
+    consumer = consumer_name(CONSUMER_BASE_NAME, worker)
+    reader = GroupReader(redis, STREAM_NAME, GROUP_NAME, consumer)
     # create consumer group if not exists
     try:
         await redis.xgroup_create(STREAM_NAME, GROUP_NAME, id="$", mkstream=True)
@@ -128,28 +174,29 @@ async def consume_logs():
     except ResponseError as exc:
         LOG.info("consumer group exists stream=%s group=%s info=%s", STREAM_NAME, GROUP_NAME, exc)
 
-    LOG.info("consumer ready and entering read loop stream=%s group=%s consumer=%s", STREAM_NAME, GROUP_NAME, CONSUMER_NAME)
+    LOG.info("consumer ready and entering read loop stream=%s group=%s consumer=%s", STREAM_NAME, GROUP_NAME, consumer)
 
     while True:
         try:
-            response = await redis.xreadgroup(
-                GROUP_NAME,
-                CONSUMER_NAME,
-                {STREAM_NAME: ">"},
-                count=50,
-                block=1000,
-            )
+            response = await reader.read(count=50, block=1000)
         except Exception as exc:
-            LOG.info("xreadgroup failed stream=%s group=%s consumer=%s err=%s", STREAM_NAME, GROUP_NAME, CONSUMER_NAME, exc)
+            LOG.info("xreadgroup failed stream=%s group=%s consumer=%s err=%s", STREAM_NAME, GROUP_NAME, consumer, exc)
             await asyncio.sleep(1)
             continue
         if not response:
+            if settings.UNIFIED_PIPELINE:
+                await close_idle_issues()
             continue
 
         provider = _get_provider()
         # Accumulate per collection for batch upserts
         batched: dict[str, dict[str, List[Any]]] = defaultdict(lambda: {"ids": [], "documents": [], "metadatas": []})
+        to_route: dict[str, List[Dict[str, Any]]] = defaultdict(list)
         candidates: List[Dict[str, Any]] = []
+        # Issue-aggregation entries (UNIFIED_PIPELINE): parsed/templated/embedded once here
+        to_aggregate: List[Dict[str, Any]] = []
+        # Log lines awaiting the batched parse/template stage
+        to_parse: List[Dict[str, Any]] = []
         ack_ids: List[str] = []
 
         total_msgs = 0
@@ -170,16 +217,12 @@ async def consume_logs():
                         except Exception:
                             payload_obj = None
                         if isinstance(payload_obj, dict):
-                            # find DataSource config by source_id if present
+                            # find DataSource config by source_id if present (cached, invalidated on /sources writes)
                             cfg: Dict[str, Any] = {}
                             try:
                                 src_id_str = data.get("source_id")
                                 if src_id_str:
-                                    src_id = int(src_id_str)
-                                    async with AsyncSessionLocal() as db:  # type: ignore
-                                        row = await db.get(DataSource, src_id)
-                                    if row and isinstance(row.config, dict):
-                                        cfg = row.config
+                                    cfg = await get_source_config_cache().get(int(src_id_str))
                             except Exception:
                                 cfg = {}
                             try:
@@ -193,22 +236,13 @@ async def consume_logs():
                             if points:
                                 LOG.info("consumer: normalized metrics kind=%s points=%d", kind, len(points))
                                 # Export to OTEL if enabled (cast to satisfy type checker)
-                                from typing import cast, Sequence
+                                from typing import Sequence
                                 export_metrics(cast(Sequence[Dict[str, Any]], points))
-                                # Also write to Redis metrics stream for internal uses
-                                for mp in points:
-                                    try:
-                                        import json as _json
-                                        await redis.xadd(METRICS_STREAM, {
-                                            "name": mp.get("name", ""),
-                                            "type": mp.get("type", "gauge"),
-                                            "value": str(mp.get("value", "")),
-                                            "unit": (mp.get("unit") or ""),
-                                            "resource": _json.dumps(mp.get("resource") or {}),
-                                            "attributes": _json.dumps(mp.get("attributes") or {}),
-                                        })
-                                    except Exception:
-                                        pass
+                                # Also write to Redis metrics stream for internal uses (one pipelined batch)
+                                try:
+                                    await write_points(redis, cast(Sequence[Dict[str, Any]], points))
+                                except Exception as exc:
+                                    LOG.info("consumer: metrics stream write failed kind=%s points=%d err=%s", kind, len(points), exc)
                                 # Derive incident candidates from normalized telemetry (network-aware)
                                 norm_candidates: List[Dict[str, Any]] = []
                                 try:
@@ -325,7 +359,7 @@ async def consume_logs():
                                             "issue_key": c.get("issue_key", ""),
                                             "templated_summary": c.get("templated", "") or c.get("raw", ""),
                                             "logs": logs_field,
-                                        })
+                                        }, **xadd_args(settings.ISSUES_CANDIDATES_STREAM))
                                         try:
                                             logging.getLogger("app.kaboom").info(
                                                 "norm_incident_published id=%s kind=%s os=%s", _eid, kind, c.get("os")
@@ -355,7 +389,7 @@ async def consume_logs():
                                                 "templated": summary_text,
                                                 "raw": line if isinstance(line, str) else "",
                                             }]),
-                                        })
+                                        }, **xadd_args(settings.ISSUES_CANDIDATES_STREAM))
                                         try:
                                             logging.getLogger("app.kaboom").info(
                                                 "norm_incident_published id=%s kind=%s os=%s", _eid2, kind, "network"
@@ -430,7 +464,7 @@ async def consume_logs():
                                         "issue_key": "",
                                         "templated_summary": c2.get("templated", "") or c2.get("raw", ""),
                                         "logs": logs_field2,
-                                    })
+                                    }, **xadd_args(settings.ISSUES_CANDIDATES_STREAM))
                                     try:
                                         logging.getLogger("app.kaboom").info(
                                             "norm_incident_published id=%s kind=%s os=%s", _eidx, kind, c2.get("os")
@@ -455,87 +489,119 @@ async def consume_logs():
                             os_name = "network"
                         elif kind in {"redfish"}:
                             os_name = "linux"
-                    templated, parsed = _parse_and_template(os_name, line)
-                    env_id = _derive_env_id(line, parsed or {})
-
-                    # Choose document text based on embedding mode
-                    use_raw = settings.EMBEDDING_PROVIDER.lower() == "logbert" and getattr(settings, "LOGBERT_USE_RAW_LOGS", False)
-                    doc_text = line if use_raw else templated
-
-                    # route to logs_<os>
-                    coll_name = _log_collection_name(os_name)
-                    batched[coll_name]["ids"].append(msg_id)
-                    batched[coll_name]["documents"].append(doc_text)
-                    metadata_obj: Dict[str, Any] = {
-                        "os": os_name,
-                        "source": source or "",
-                        "raw": line,
-                        "embedding_mode": "raw" if use_raw else "templated",
-                        **parsed,
-                    }
-                    if env_id:
-                        metadata_obj["env_id"] = env_id
-                    batched[coll_name]["metadatas"].append(metadata_obj)
-
-                    # quick rule signal
-                    rule = match_failure_signals(f"{templated} {line}")
-
-                    # nearest prototype distance (guard failures)
-                    distance = None
-                    label = None
-                    try:
-                        query_text = doc_text  # align with what's stored and embedded
-                        nearest = nearest_prototype(os_name, query_text, k=1)
-                        distance = nearest[0]["distance"] if nearest else None
-                        label = (nearest[0]["metadata"] or {}).get("label") if nearest else None
-                    except Exception as exc:
-                        LOG.info("prototype routing failed os=%s err=%s", os_name, exc)
-
-                    should_candidate = False
-                    if rule.get("has_signal"):
-                        should_candidate = True
-                    if distance is None or (isinstance(distance, (int, float)) and distance > settings.NEAREST_PROTO_THRESHOLD):
-                        should_candidate = True
-
-                    if should_candidate:
-                        candidates.append({
-                            "os": os_name,
-                            "raw": line,
-                            "templated": templated,
-                            "rule_label": rule.get("label"),
-                            "rule_score": rule.get("score"),
-                            "nearest_distance": distance if distance is not None else "",
-                            "nearest_label": label or "",
-                        })
+                    to_parse.append({"id": msg_id, "data": data, "source": source, "line": line, "os": os_name})
                 except Exception as exc:
-                    LOG.info("consumer message processing failed id=%s err=%s", msg_id, exc)
-                    try:
-                        logging.getLogger("app.kaboom").info(
-                            "consumer_failed id=%s source=%s kind=%s os_guess=%s err=%s line_len=%s",
-                            msg_id, data.get("source"), (data.get("source") or "").split(":",1)[0],
-                            _os_from_source(data.get("source")), exc, len((data.get("line") or "")),
-                        )
-                    except Exception:
-                        pass
+                    _log_message_failure(msg_id, data, exc)
                 finally:
                     ack_ids.append(msg_id)
 
-        LOG.info("processing batch size=%d collections=%d candidates=%d", total_msgs, len(batched), len(candidates))
-        # Perform upserts per collection
-        for coll_name, payload in batched.items():
+        # Parse, template and rule-match all log lines in one batched work item off the loop
+        try:
+            parsed_lines = await parse_lines([(it["os"], it["line"]) for it in to_parse], with_rules=True)
+        except Exception as exc:
+            LOG.info("batch parsing failed lines=%d err=%s", len(to_parse), exc)
+            parsed_lines = [None] * len(to_parse)
+        for item, parsed_line in zip(to_parse, parsed_lines):
+            msg_id = item["id"]
             try:
-                collection = provider.get_or_create_collection(coll_name)
-                if payload["ids"]:
-                    collection.upsert(ids=payload["ids"], documents=payload["documents"], metadatas=payload["metadatas"])
-                    LOG.info("upserted collection=%s count=%d", coll_name, len(payload["ids"]))
-            except Exception:
-                LOG.exception("upsert failed collection=%s", coll_name)
+                if parsed_line is None:
+                    raise ValueError("parse/template failed")
+                templated, parsed, rule = parsed_line
+                source = item["source"]
+                line = item["line"]
+                os_name = item["os"]
+                env_id = _derive_env_id(line, parsed or {})
+
+                # Choose document text based on embedding mode
+                use_raw = settings.EMBEDDING_PROVIDER.lower() == "logbert" and getattr(settings, "LOGBERT_USE_RAW_LOGS", False)
+                doc_text = line if use_raw else templated
+
+                # route to logs_<os>
+                coll_name = _log_collection_name(os_name)
+                batched[coll_name]["ids"].append(msg_id)
+                batched[coll_name]["documents"].append(doc_text)
+                metadata_obj: Dict[str, Any] = {
+                    "os": os_name,
+                    "source": source or "",
+                    "raw": line,
+                    "embedding_mode": "raw" if use_raw else "templated",
+                    **parsed,
+                }
+                if env_id:
+                    metadata_obj["env_id"] = env_id
+                batched[coll_name]["metadatas"].append(metadata_obj)
+
+                # prototype routing is resolved per OS after the batch is assembled
+                to_route[os_name].append({
+                    "query_text": doc_text,  # align with what's stored and embedded
+                    "raw": line,
+                    "templated": templated,
+                    "rule": rule,
+                })
+                if settings.UNIFIED_PIPELINE:
+                    normalized = normalize_json_for_clustering(source, line)
+                    agg_templated, agg_parsed = normalized if normalized else (templated, parsed)
+                    to_aggregate.append({
+                        "id": msg_id,
+                        "source": source,
+                        "raw": line,
+                        "os": os_name,
+                        "templated": agg_templated,
+                        "parsed": agg_parsed,
+                        # receives cluster_id before the upsert below
+                        "metadata": metadata_obj,
+                    })
+            except Exception as exc:
+                _log_message_failure(msg_id, item["data"], exc)
+
+        # Embed each document once per batch; the vectors are reused for the logs_<os>
+        # upserts and the proto_<os> lookups so Chroma never embeds internally.
+        embedded: Dict[str, List[float]] = {}
+        all_docs = [doc for payload in batched.values() for doc in payload["documents"]]
+        if all_docs:
+            try:
+                embedded = dict(zip(all_docs, await asyncio.to_thread(provider.embed, all_docs)))
+            except Exception as exc:
+                LOG.info("batch embedding failed docs=%d err=%s; falling back to collection embedding", len(all_docs), exc)
+                embedded = {}
+
+        # nearest prototype distance: one multi-query per OS (guard failures)
+        for os_name, items in to_route.items():
+            texts = [it["query_text"] for it in items]
+            vectors = [embedded.get(t) for t in texts]
+            query_embeddings = vectors if all(v is not None for v in vectors) else None
+            try:
+                nearest_per_item = await asyncio.to_thread(
+                    nearest_prototypes, os_name, texts, k=1, query_embeddings=query_embeddings,  # type: ignore[arg-type]
+                )
+            except Exception as exc:
+                LOG.info("prototype routing failed os=%s items=%d err=%s", os_name, len(items), exc)
+                nearest_per_item = [[] for _ in items]
+            for item, nearest in zip(items, nearest_per_item):
+                candidate = _candidate_from_route(os_name, item, nearest)
+                if candidate is not None:
+                    candidates.append(candidate)
+
+        # Issue aggregation / online clustering on the same parse + embeddings
+        if to_aggregate:
+            for entry in to_aggregate:
+                vec = embedded.get(entry["templated"])
+                if vec is not None:
+                    entry["embedding"] = vec
+            try:
+                await aggregate_entries(to_aggregate)
+            except Exception as exc:
+                LOG.info("unified issue aggregation failed entries=%d err=%s", len(to_aggregate), exc)
+
+        LOG.info("processing batch size=%d collections=%d candidates=%d", total_msgs, len(batched), len(candidates))
+        # Perform upserts per collection (Chroma I/O in a worker thread)
+        await asyncio.to_thread(_upsert_collections, provider, batched, embedded)
 
         # Publish per-line candidates if enabled
         if settings.ENABLE_PER_LINE_CANDIDATES:
             for c in candidates:
                 try:
-                    await redis.xadd(settings.ISSUES_CANDIDATES_STREAM, c)
+                    await redis.xadd(settings.ISSUES_CANDIDATES_STREAM, c, **xadd_args(settings.ISSUES_CANDIDATES_STREAM))
                 except Exception as exc:
                     LOG.info("publish candidate failed stream=%s err=%s", settings.ALERTS_CANDIDATES_STREAM, exc)
 
@@ -547,14 +613,17 @@ async def consume_logs():
             except Exception as exc:
                 LOG.info("ack failed count=%d err=%s", len(ack_ids), exc)
 
+        if settings.UNIFIED_PIPELINE:
+            await close_idle_issues()
+
 
 def attach_consumer(app: FastAPI):
-    async def _run_forever():
+    async def _run_forever(worker: int):
         backoff = 1.0
         while True:
             try:
-                LOG.info("starting consumer stream=%s group=%s consumer=%s", STREAM_NAME, GROUP_NAME, CONSUMER_NAME)
-                await consume_logs()
+                LOG.info("starting consumer stream=%s group=%s worker=%d", STREAM_NAME, GROUP_NAME, worker)
+                await consume_logs(worker)
             except Exception as exc:
                 LOG.info("consumer crashed err=%s; restarting in %.1fs", exc, backoff)
                 await asyncio.sleep(backoff)
@@ -567,7 +636,8 @@ def attach_consumer(app: FastAPI):
 
         def _runner():
             asyncio.set_event_loop(loop)
-            loop.create_task(_run_forever())
+            for worker in range(max(1, int(settings.STREAM_WORKERS_PER_PROCESS))):
+                loop.create_task(_run_forever(worker))
             loop.run_forever()
 
         thread = threading.Thread(target=_runner, name="consumer-thread", daemon=True)
@@ -1,14 +1,19 @@
 import asyncio
 import json
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, cast
 
 import redis.asyncio as aioredis
+from chromadb.api.types import Embedding
 
 from fastapi import FastAPI
 from app.core.config import get_settings
-from app.services.llm_service import generate_hypothesis, classify_issue
+from app.services.llm_service import agenerate_hypothesis, aclassify_issue, public_result
 from app.services.chroma_service import ChromaClientProvider, collection_name_for_os
+from app.services.cluster_metrics import get_metrics_buffer
+from app.services.label_propagation import classification_for_issue
+from app.streams.retention import xadd_args
+from app.streams.utils import GroupReader, consumer_name
 import threading
 
 
@@ -25,7 +30,7 @@ def _get_provider() -> ChromaClientProvider:
     return _provider
 
 
-async def _retrieve_neighbors(os_name: str, templated: str, k: int = 5) -> List[Dict[str, Any]]:
+def _retrieve_neighbors_sync(os_name: str, templated: str, k: int = 5) -> List[Dict[str, Any]]:
     provider = _get_provider()
     # Query templates first; could extend to logs_<os> as well
     collection = provider.get_or_create_collection(collection_name_for_os(os_name))
@@ -40,7 +45,7 @@ async def _retrieve_neighbors(os_name: str, templated: str, k: int = 5) -> List[
         return []
 
     result = collection.query(
-        query_texts=[templated],
+        query_embeddings=cast(List[Embedding], provider.embed([templated])),
         n_results=k,
         include=["distances", "metadatas", "documents"],
     )
@@ -59,6 +64,10 @@ async def _retrieve_neighbors(os_name: str, templated: str, k: int = 5) -> List[
     return out
 
 
+async def _retrieve_neighbors(os_name: str, templated: str, k: int = 5) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(_retrieve_neighbors_sync, os_name, templated, k)
+
+
 def _logs_collection_name(os_name: str) -> str:
     suffix = os_name.strip().lower()
     if suffix in {"mac", "macos", "osx"}:
@@ -70,7 +79,8 @@ def _logs_collection_name(os_name: str) -> str:
     return f"{settings.CHROMA_LOG_COLLECTION_PREFIX}{suffix}"
 
 
-async def _retrieve_logs_by_queries(os_name: str, queries: List[str], k_per_query: int = 5) -> List[Dict[str, Any]]:
+def _retrieve_logs_by_queries_sync(os_name: str, queries: List[str], k_per_query: int = 5) -> List[Dict[str, Any]]:
+    queries = [q for q in queries[:3] if q]
     if not queries:
         return []
     provider = _get_provider()
@@ -85,18 +95,27 @@ async def _retrieve_logs_by_queries(os_name: str, queries: List[str], k_per_quer
     if l_empty:
         return []
 
+    # All HyDE queries in one embedding call and one multi-query request
+    result = collection.query(
+        query_embeddings=cast(List[Embedding], provider.embed(queries)),
+        n_results=k_per_query,
+        include=["documents", "metadatas", "distances"],
+    )
+    ids_rows = result.get("ids") or []
+    docs_rows = result.get("documents") or []
+    dists_rows = result.get("distances") or []
+    metas_rows = result.get("metadatas") or []
     out: List[Dict[str, Any]] = []
-    for q in queries[:3]:
-        result = collection.query(
-            query_texts=[q],
-            n_results=k_per_query,
-            include=["documents", "metadatas", "distances"],
-        )
-        ids = (result.get("ids") or [[]])[0]
-        docs = (result.get("documents") or [[]])[0]
-        dists = (result.get("distances") or [[]])[0]
-        metas = (result.get("metadatas") or [[]])[0]
+    seen: set[str] = set()
+    for row, ids in enumerate(ids_rows):
+        docs = docs_rows[row] if row < len(docs_rows) else []
+        dists = dists_rows[row] if row < len(dists_rows) else []
+        metas = metas_rows[row] if row < len(metas_rows) else []
         for i in range(len(ids)):
+            # The same log can answer several queries; send it to the LLM once
+            if ids[i] in seen:
+                continue
+            seen.add(ids[i])
             out.append({
                 "id": ids[i],
                 "document": docs[i] if i < len(docs) else "",
@@ -106,108 +125,174 @@ async def _retrieve_logs_by_queries(os_name: str, queries: List[str], k_per_quer
     return out
 
 
+async def _retrieve_logs_by_queries(os_name: str, queries: List[str], k_per_query: int = 5) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(_retrieve_logs_by_queries_sync, os_name, queries, k_per_query)
+
+
+def _record_llm_call(os_name: str, issue_key: str, operation: str, confidence: Any, metadata: Dict[str, Any]) -> None:
+    if not settings.ENABLE_CLUSTER_METRICS:
+        return
+    try:
+        get_metrics_buffer().record_llm_call(
+            os_name=os_name,
+            cluster_id=issue_key,
+            operation=operation,
+            confidence=confidence,
+            tokens_used=metadata.get("tokens", 0),
+            latency_ms=metadata.get("latency_ms", 0),
+            success=metadata.get("success", True),
+            prompt_tokens=metadata.get("prompt_tokens", 0),
+            completion_tokens=metadata.get("completion_tokens", 0),
+            cached=metadata.get("cached", False),
+        )
+    except Exception:
+        pass  # Don't fail enrichment if metrics fail
+
+
+async def _enrich_candidate(group: str, msg_id: str, data: Dict[str, Any]) -> None:
+    """Enrich one issue candidate (neighbors, HyDE retrieval, LLM classification), publish and ack it."""
+    try:
+        os_name = data.get("os") or "unknown"
+        templated_summary = data.get("templated_summary") or ""
+        raw_logs = data.get("logs")
+        if isinstance(raw_logs, str):
+            try:
+                logs: List[Dict[str, Any]] = json.loads(raw_logs)
+            except Exception:
+                logs = []
+        else:
+            logs = raw_logs or []
+        # Fallback: synthesize a single-log incident if only 'templated'/'raw' are provided
+        if not templated_summary and not logs:
+            tmpl = data.get("templated")
+            raw = data.get("raw")
+            if tmpl or raw:
+                logs = [{
+                    "templated": tmpl or "",
+                    "raw": raw or "",
+                }]
+                templated_summary = tmpl or (raw or "")
+
+        # Reuse the stored classification of nearby labelled prototypes before calling the LLM
+        result = await asyncio.to_thread(
+            classification_for_issue, os_name, [str(log.get("templated") or "") for log in logs]
+        )
+        if result is None:
+            # neighbors from templates for coarse context
+            templated_for_neighbors = templated_summary or (logs[0].get("templated") if logs else None) or ""
+            neighbors = await _retrieve_neighbors(os_name, templated_for_neighbors, k=8)
+            # HYDE queries and retrieval from logs_<os>
+            queries, hypothesis_meta = await agenerate_hypothesis(os_name, templated_summary, logs, num_queries=3)
+            _record_llm_call(os_name, data.get("issue_key", ""), "generate_hypothesis", None, hypothesis_meta)
+            retrieved = await _retrieve_logs_by_queries(os_name, queries, k_per_query=5)
+            retrieved_logs = [{
+                "templated": item.get("document", ""),
+                "raw": (item.get("metadata") or {}).get("raw", ""),
+            } for item in retrieved]
+
+            result = await aclassify_issue(os_name, logs, neighbors, retrieved_logs)
+            _record_llm_call(
+                os_name, data.get("issue_key", ""), "classify_issue", result.get("confidence"), result.get("_llm_metadata") or {}
+            )
+        # Normalize fields for easier consumption on the UI
+        is_hw = bool(result.get("is_hardware_failure"))
+        failure_type = str(result.get("failure_type", ""))
+        confidence = result.get("confidence")
+        log_ids = [log.get("id") for log in logs if log.get("id")]
+        payload = {
+            "type": "issue",
+            "os": os_name,
+            "issue_key": data.get("issue_key", ""),
+            "is_hardware_failure": str(is_hw).lower(),  # streams are strings
+            "failure_type": failure_type,
+            "confidence": str(confidence) if confidence is not None else "",
+            "result": json.dumps(public_result(result)),
+            "log_ids": json.dumps(log_ids),
+        }
+        entry_id = await redis.xadd(settings.ALERTS_STREAM, payload, **xadd_args(settings.ALERTS_STREAM))  # type: ignore[misc]
+        try:
+            logging.getLogger("app.kaboom").info(
+                "alert_published id=%s os=%s type=%s",
+                entry_id, os_name, "issue"
+            )
+        except Exception:
+            pass
+        # Mirror alert into a hash with a TTL for ~24h visibility; allow persisting later
+        try:
+            key = f"alert:{entry_id}"
+            # Store fields as strings for consistency
+            to_store = {**payload, "id": entry_id}
+            await redis.hset(key, mapping=to_store)  # type: ignore[misc]
+            await redis.expire(key, int(settings.ALERTS_TTL_SEC))  # type: ignore[misc]
+        except Exception as e:
+            LOG.info("failed to store alert hash id=%s err=%s", entry_id, e)
+    except Exception as exc:
+        LOG.info("enricher processing failed id=%s err=%s", msg_id, exc)
+        try:
+            logging.getLogger("app.kaboom").info(
+                "enricher_failed id=%s os=%s err=%s tmpl_len=%s logs_len=%s",
+                msg_id, data.get("os"), exc,
+                len(data.get("templated_summary") or ""),
+                len(data.get("logs") or ""),
+            )
+        except Exception:
+            pass
+    finally:
+        try:
+            await redis.xack(settings.ISSUES_CANDIDATES_STREAM, group, msg_id)
+        except Exception as exc:
+            LOG.info("enricher ack failed id=%s err=%s", msg_id, exc)
+
+
 async def run_enricher():
-    """Consume issues_candidates stream, enrich via LLM with HYDE, and write to alerts stream."""
+    """Consume issues_candidates stream, enrich via LLM with HYDE, and write to alerts stream.
+
+    Up to ENRICHER_CONCURRENCY candidates are enriched at once; new messages are only
+    read when a slot is free, so unread backlog stays in the stream (and claimable by
+    other replicas) instead of piling up in memory.
+    """
     group = "issues_enrichers"
-    consumer = "enricher_1"
+    consumer = consumer_name("enricher")
+    reader = GroupReader(redis, settings.ISSUES_CANDIDATES_STREAM, group, consumer)
     try:
         await redis.xgroup_create(settings.ISSUES_CANDIDATES_STREAM, group, id="$", mkstream=True)
     except Exception:
         pass
 
+    concurrency = max(1, int(settings.ENRICHER_CONCURRENCY))
+    slots = asyncio.Semaphore(concurrency)
+    in_flight: set[asyncio.Task] = set()
+
+    async def _run_slot(msg_id: str, data: Dict[str, Any], acquired: bool) -> None:
+        if not acquired:
+            await slots.acquire()
+        try:
+            await _enrich_candidate(group, msg_id, data)
+        finally:
+            slots.release()
+
     while True:
+        await slots.acquire()
+        free = 1
+        # Take every free slot for this read
+        while free < concurrency and not slots.locked():
+            await slots.acquire()
+            free += 1
         try:
-            response = await redis.xreadgroup(group, consumer, {settings.ISSUES_CANDIDATES_STREAM: ">"}, count=5, block=1000)
+            response = await reader.read(count=free, block=1000)
         except Exception as exc:
             LOG.info("enricher read failed err=%s", exc)
+            response = []
             await asyncio.sleep(1)
-            continue
-        if not response:
-            continue
-        for _, messages in response:
-            for msg_id, data in messages:
-                try:
-                    os_name = data.get("os") or "unknown"
-                    templated_summary = data.get("templated_summary") or ""
-                    raw_logs = data.get("logs")
-                    if isinstance(raw_logs, str):
-                        try:
-                            logs: List[Dict[str, Any]] = json.loads(raw_logs)
-                        except Exception:
-                            logs = []
-                    else:
-                        logs = raw_logs or []
-                    # Fallback: synthesize a single-log incident if only 'templated'/'raw' are provided
-                    if not templated_summary and not logs:
-                        tmpl = data.get("templated")
-                        raw = data.get("raw")
-                        if tmpl or raw:
-                            logs = [{
-                                "templated": tmpl or "",
-                                "raw": raw or "",
-                            }]
-                            templated_summary = tmpl or (raw or "")
-
-                    # neighbors from templates for coarse context
-                    templated_for_neighbors = templated_summary or (logs[0].get("templated") if logs else None) or ""
-                    neighbors = await _retrieve_neighbors(os_name, templated_for_neighbors, k=8)
-                    # HYDE queries and retrieval from logs_<os>
-                    queries = generate_hypothesis(os_name, templated_summary, logs, num_queries=3)
-                    retrieved = await _retrieve_logs_by_queries(os_name, queries, k_per_query=5)
-                    retrieved_logs = [{
-                        "templated": item.get("document", ""),
-                        "raw": (item.get("metadata") or {}).get("raw", ""),
-                    } for item in retrieved]
-
-                    result = classify_issue(os_name, logs, neighbors, retrieved_logs)
-                    # Normalize fields for easier consumption on the UI
-                    is_hw = bool(result.get("is_hardware_failure"))
-                    failure_type = str(result.get("failure_type", ""))
-                    confidence = result.get("confidence")
-                    log_ids = [log.get("id") for log in logs if log.get("id")]
-                    payload = {
-                        "type": "issue",
-                        "os": os_name,
-                        "issue_key": data.get("issue_key", ""),
-                        "is_hardware_failure": str(is_hw).lower(),  # streams are strings
-                        "failure_type": failure_type,
-                        "confidence": str(confidence) if confidence is not None else "",
-                        "result": json.dumps(result),
-                        "log_ids": json.dumps(log_ids),
-                    }
-                    entry_id = await redis.xadd(settings.ALERTS_STREAM, payload)  # type: ignore[misc]
-                    try:
-                        logging.getLogger("app.kaboom").info(
-                            "alert_published id=%s os=%s type=%s",
-                            entry_id, os_name, "issue"
-                        )
-                    except Exception:
-                        pass
-                    # Mirror alert into a hash with a TTL for ~24h visibility; allow persisting later
-                    try:
-                        key = f"alert:{entry_id}"
-                        # Store fields as strings for consistency
-                        to_store = {**payload, "id": entry_id}
-                        await redis.hset(key, mapping=to_store)  # type: ignore[misc]
-                        await redis.expire(key, int(settings.ALERTS_TTL_SEC))  # type: ignore[misc]
-                    except Exception as e:
-                        LOG.info("failed to store alert hash id=%s err=%s", entry_id, e)
-                except Exception as exc:
-                    LOG.info("enricher processing failed id=%s err=%s", msg_id, exc)
-                    try:
-                        logging.getLogger("app.kaboom").info(
-                            "enricher_failed id=%s os=%s err=%s tmpl_len=%s logs_len=%s",
-                            msg_id, data.get("os"), exc,
-                            len(data.get("templated_summary") or ""),
-                            len(data.get("logs") or ""),
-                        )
-                    except Exception:
-                        pass
-                finally:
-                    try:
-                        await redis.xack(settings.ISSUES_CANDIDATES_STREAM, group, msg_id)
-                    except Exception as exc:
-                        LOG.info("enricher ack failed id=%s err=%s", msg_id, exc)
+        messages = [(msg_id, data) for _, batch in (response or []) for msg_id, data in batch]
+        # Reclaimed entries can exceed the free slots; those tasks wait for a slot themselves
+        for idx, (msg_id, data) in enumerate(messages):
+            task = asyncio.create_task(_run_slot(msg_id, data, acquired=idx < free))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        # Return slots that got no message
+        for _ in range(max(0, free - len(messages))):
+            slots.release()
 
 
 if __name__ == "__main__":
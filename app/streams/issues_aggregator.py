@@ -11,9 +11,12 @@ import redis.asyncio as aioredis
 from app.core.config import get_settings
 from app.services.chroma_service import ChromaClientProvider
 from app.services.online_clustering import assign_or_create_cluster
-from app.parsers.linux import parse_linux_line
-from app.parsers.macos import parse_macos_line
+from app.services.prototype_index import get_prototype_index
+from app.parsers.pipeline import parse_and_template
 from app.parsers.templating import render_templated_line
+from app.services.cpu_pool import parse_lines
+from app.streams.retention import xadd_args
+from app.streams.utils import GroupReader, consumer_name
 import threading
 
 
@@ -76,7 +79,7 @@ def _try_parse_json_line(line: str) -> Dict[str, Any] | None:
     return obj if isinstance(obj, dict) else None
 
 
-def _normalize_json_for_clustering(source: str | None, line: str) -> Tuple[str, Dict[str, str]] | None:
+def normalize_json_for_clustering(source: str | None, line: str) -> Tuple[str, Dict[str, str]] | None:
     """Normalize JSON integration payloads into stable text for clustering."""
     obj = _try_parse_json_line(line)
     if not obj:
@@ -164,23 +167,6 @@ def _normalize_json_for_clustering(source: str | None, line: str) -> Tuple[str,
     return templated, parsed
 
 
-def _parse_and_template(os_name: str, line: str) -> Tuple[str, Dict[str, str]]:
-    parsed: Dict[str, str] | None = None
-    if os_name == "linux":
-        parsed = parse_linux_line(0, line) or None
-    elif os_name == "macos":
-        parsed = parse_macos_line(0, line) or None
-    if not parsed:
-        templated = render_templated_line(component="unknown", pid=None, content=line)
-        return templated, {"content": line, "component": "unknown"}
-    templated = render_templated_line(
-        component=parsed.get("component", ""),
-        pid=parsed.get("PID"),
-        content=parsed.get("content", ""),
-    )
-    return templated, parsed
-
-
 def _issue_key(os_name: str, parsed: Dict[str, str]) -> str:
     component = parsed.get("component", "unknown").lower().strip()
     pid = parsed.get("PID", "").strip()
@@ -211,6 +197,61 @@ class Issue:
 
 
 _issues: Dict[str, Issue] = {}
+_assign_lock = threading.Lock()
+
+
+def _attach_embeddings(os_name: str, entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Resolve one embedding per entry for a single OS, reusing what the consumer stored.
+
+    Reads the batch's docs from logs_<os> in one call. When the stored document is the
+    same templated text, its embedding is reused; the remaining distinct texts are
+    embedded with a single provider call. Sets `entry["embedding"]` (or leaves it unset
+    on failure) and returns the stored metadatas keyed by message id.
+
+    Entries handed over by the unified pipeline carry their own `metadata` (not yet
+    written) and usually their `embedding`; those skip the Chroma read.
+    """
+    provider = _get_provider()
+    stored_metas: Dict[str, Dict[str, Any]] = {}
+    reusable: Dict[str, List[float]] = {
+        e["templated"]: e["embedding"] for e in entries if e.get("embedding") is not None
+    }
+    lookup_ids = [e["id"] for e in entries if "metadata" not in e]
+    if lookup_ids:
+        try:
+            coll_name = f"{settings.CHROMA_LOG_COLLECTION_PREFIX}{os_name}"
+            collection = provider.get_or_create_collection(coll_name)
+            current = collection.get(ids=lookup_ids, include=["embeddings", "documents", "metadatas"]) or {}
+            ids = list(current.get("ids") or [])
+            docs = current.get("documents")
+            embs = current.get("embeddings")
+            metas = current.get("metadatas")
+            for i, doc_id in enumerate(ids):
+                meta = metas[i] if metas is not None and i < len(metas) else None
+                stored_metas[doc_id] = dict(meta or {})
+                doc = docs[i] if docs is not None and i < len(docs) else None
+                emb = embs[i] if embs is not None and i < len(embs) else None
+                if doc is not None and emb is not None:
+                    reusable[doc] = emb.tolist() if hasattr(emb, "tolist") else list(emb)
+        except Exception:
+            pass
+
+    # Lines that exactly match a known prototype are assigned without a vector
+    index = get_prototype_index(os_name) if settings.PROTOTYPE_INDEX_ENABLED else None
+    missing = list({
+        e["templated"] for e in entries
+        if e["templated"] not in reusable and not (index is not None and index.lookup_exact(e["templated"]))
+    })
+    if missing:
+        try:
+            reusable.update(zip(missing, provider.embed(missing)))
+        except Exception as exc:
+            LOG.info("issues aggregator embedding failed os=%s texts=%d err=%s", os_name, len(missing), exc)
+    for entry in entries:
+        vec = reusable.get(entry["templated"])
+        if vec is not None:
+            entry["embedding"] = vec
+    return stored_metas
 
 
 async def _close_and_publish(issue: Issue) -> None:
@@ -232,15 +273,181 @@ async def _close_and_publish(issue: Issue) -> None:
         "templated_summary": " \n".join([log["templated"] for log in issue.top_logs(settings.ISSUE_MAX_LOGS_FOR_LLM)]),
         "logs": json.dumps(logs_list),
     }
-    await redis.xadd(settings.ISSUES_CANDIDATES_STREAM, payload)  # type: ignore[arg-type]
+    await redis.xadd(settings.ISSUES_CANDIDATES_STREAM, payload, **xadd_args(settings.ISSUES_CANDIDATES_STREAM))  # type: ignore[arg-type]
     LOG.info("published issue os=%s key=%s logs=%d", issue.os, issue.key, len(issue.logs))
 
 
-async def run_issues_aggregator() -> None:
+def build_entry(
+    msg_id: str,
+    source: str | None,
+    raw: str,
+    parsed_line: Tuple[str, Dict[str, str]] | None = None,
+) -> Dict[str, Any]:
+    """Parse and template one `logs` stream message into an aggregation entry.
+
+    `parsed_line` is a precomputed (templated, parsed) from the batched parse stage;
+    integration JSON payloads are always normalized here. Log lines are only looked
+    up in the Drain tree: the consumer has already mined the same line.
+    """
+    os_name = _os_from_source(source)
+    normalized = normalize_json_for_clustering(source, raw)
+    if normalized:
+        templated, parsed = normalized
+    elif parsed_line is not None:
+        templated, parsed = parsed_line
+    else:
+        templated, parsed = parse_and_template(os_name, raw, mine=False)
+    return {
+        "id": msg_id,
+        "source": source,
+        "raw": raw,
+        "os": os_name,
+        "templated": templated,
+        "parsed": parsed,
+    }
+
+
+async def aggregate_entries(entries: List[Dict[str, Any]], now: float | None = None) -> List[str]:
+    """Assign clusters, group entries into issues and publish cluster candidates.
+
+    Entries are dicts as built by `build_entry`; the unified pipeline may also set
+    `embedding` and `metadata` (the logs_<os> metadata about to be upserted, which
+    receives `cluster_id` in place). Returns the ids that were handled.
+    """
+    now = time.time() if now is None else now
+    handled: List[str] = []
+
+    # One Chroma read and at most one embedding call per OS for the whole batch
+    by_os: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        by_os.setdefault(entry["os"], []).append(entry)
+    stored_metas: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for os_name, os_entries in by_os.items():
+        stored_metas[os_name] = await asyncio.to_thread(_attach_embeddings, os_name, os_entries)
+    cluster_ids = await asyncio.to_thread(_assign_clusters, entries)
+
+    for entry, cluster_id in zip(entries, cluster_ids):
+        msg_id = entry["id"]
+        processed_ok = True
+        try:
+            source = entry["source"]
+            raw = entry["raw"]
+            os_name = entry["os"]
+            templated = entry["templated"]
+            parsed = entry["parsed"]
+
+            # Record cluster_id for the log doc metadata in logs_<os> (written once per OS below)
+            metas = entry.get("metadata")
+            if metas is None:
+                metas = stored_metas.get(os_name, {}).get(msg_id)
+            if metas is not None:
+                metas["cluster_id"] = cluster_id
+
+            key = _issue_key(os_name, parsed)
+            issue = _issues.get(key)
+            if issue is None:
+                issue = Issue(os=os_name, key=key, created_at=now, last_seen_at=now)
+                _issues[key] = issue
+            issue.add_log(raw=raw, templated=templated, parsed=parsed)
+
+            # Track per-cluster size and publish cluster candidate at threshold (and occasionally thereafter).
+            try:
+                if cluster_id:
+                    counter_key = f"cluster:count:{os_name}:{cluster_id}"
+                    new_count = await redis.incr(counter_key)
+                    min_count = int(settings.CLUSTER_MIN_LOGS_FOR_CLASSIFICATION)
+                    should_publish = new_count == min_count
+
+                    repub_every = int(getattr(settings, "CLUSTER_CANDIDATE_REPUBLISH_EVERY", 0) or 0)
+                    min_interval = float(getattr(settings, "CLUSTER_CANDIDATE_REPUBLISH_MIN_INTERVAL_SEC", 0) or 0)
+                    if (not should_publish) and repub_every > 0 and new_count > min_count and (new_count % repub_every == 0):
+                        last_key = f"cluster:last_candidate_ts:{os_name}:{cluster_id}"
+                        try:
+                            last_ts = float(await redis.get(last_key) or 0.0)
+                        except Exception:
+                            last_ts = 0.0
+                        if (now - last_ts) >= min_interval:
+                            should_publish = True
+                            try:
+                                await redis.setex(last_key, 60 * 60, str(now))
+                            except Exception:
+                                pass
+
+                    if should_publish:
+                        env_val = parsed.get("env_id") if isinstance(parsed, dict) else None
+                        sample_logs = [{
+                            "raw": raw,
+                            "templated": templated,
+                            "os": os_name,
+                            "source": source,
+                            "env_id": env_val,
+                        }]
+                        await redis.xadd(settings.CLUSTERS_CANDIDATES_STREAM, {
+                            "os": os_name,
+                            "cluster_id": cluster_id,
+                            "env_ids": json.dumps([env_val] if env_val else []),
+                            "sample_logs": json.dumps(sample_logs),
+                        }, **xadd_args(settings.CLUSTERS_CANDIDATES_STREAM))
+            except Exception:
+                pass
+        except Exception as exc:
+            processed_ok = False
+            LOG.info("issues aggregator failed message id=%s err=%s", msg_id, exc)
+        finally:
+            if processed_ok:
+                handled.append(msg_id)
+
+    # Persist cluster_id onto the log docs that already exist in logs_<os>
+    await asyncio.to_thread(_update_log_metas, stored_metas)
+    return handled
+
+
+def _assign_clusters(entries: List[Dict[str, Any]]) -> List[str]:
+    """Online assign/create a cluster per entry (blocking Chroma/index work; run in a thread).
+
+    Serialized process-wide so concurrent workers cannot both create a prototype for the
+    same new template, as they could not when this ran on the shared event loop.
+    """
+    out: List[str] = []
+    with _assign_lock:
+        for entry in entries:
+            try:
+                out.append(assign_or_create_cluster(entry["os"], entry["templated"], embedding=entry.get("embedding")))
+            except Exception:
+                out.append("")
+    return out
+
+
+def _update_log_metas(stored_metas: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+    for os_name, metas_by_id in stored_metas.items():
+        if not metas_by_id:
+            continue
+        try:
+            coll_name = f"{settings.CHROMA_LOG_COLLECTION_PREFIX}{os_name}"
+            collection = _get_provider().get_or_create_collection(coll_name)
+            collection.update(ids=list(metas_by_id.keys()), metadatas=list(metas_by_id.values()))  # type: ignore[arg-type]
+        except Exception:
+            pass
+
+
+async def close_idle_issues(now: float | None = None) -> None:
+    """Publish and drop issues that saw no new logs for ISSUE_INACTIVITY_SEC."""
+    now = time.time() if now is None else now
+    inactivity = float(settings.ISSUE_INACTIVITY_SEC)
+    # Workers sharing this loop add issues while we await publishes: iterate a snapshot and
+    # take each issue out before publishing so it can never be published twice
+    for key, issue in list(_issues.items()):
+        if now - issue.last_seen_at >= inactivity and _issues.get(key) is issue:
+            _issues.pop(key, None)
+            await _close_and_publish(issue)
+
+
+async def run_issues_aggregator(worker: int = 0) -> None:
     """Consume raw logs from 'logs' stream, group them into issues, publish issues when idle."""
     stream = "logs"
     group = "issues_aggregator"
-    consumer = "aggregator_1"
+    consumer = consumer_name("aggregator", worker)
+    reader = GroupReader(redis, stream, group, consumer)
     # Create group if it doesn't exist
     try:
         await redis.xgroup_create(stream, group, id="$", mkstream=True)
@@ -248,106 +455,43 @@ async def run_issues_aggregator() -> None:
     except Exception as exc:
         LOG.info("group exists stream=%s group=%s info=%s", stream, group, exc)
 
-    inactivity = float(settings.ISSUE_INACTIVITY_SEC)
-
     LOG.info("starting issues aggregator stream=%s group=%s consumer=%s", stream, group, consumer)
     while True:
         # read new messages
         try:
-            response = await redis.xreadgroup(group, consumer, {stream: ">"}, count=100, block=1000)
+            response = await reader.read(count=100, block=1000)
         except Exception as exc:
             LOG.info("xreadgroup failed stream=%s group=%s consumer=%s err=%s", stream, group, consumer, exc)
             await asyncio.sleep(1)
             continue
         now = time.time()
         if response:
-            processed = 0
-            ack_ids: List[str] = []
-            for _, messages in response:
-                for msg_id, data in messages:
-                    processed_ok = True
-                    try:
-                        processed += 1
-                        source = data.get("source")
-                        raw = data.get("line") or ""
-                        os_name = _os_from_source(source)
-
-                        normalized = _normalize_json_for_clustering(source, raw)
-                        if normalized:
-                            templated, parsed = normalized
-                        else:
-                            templated, parsed = _parse_and_template(os_name, raw)
-
-                        # Online assign/create cluster for this templated log
-                        try:
-                            cluster_id = assign_or_create_cluster(os_name, templated)
-                        except Exception:
-                            cluster_id = ""
-
-                        # Attempt to persist cluster_id onto the log doc metadata in logs_<os>
-                        try:
-                            coll_name = f"{settings.CHROMA_LOG_COLLECTION_PREFIX}{os_name}"
-                            collection = _get_provider().get_or_create_collection(coll_name)
-                            current = collection.get(ids=[msg_id], include=["metadatas"]) or {}
-                            metas = (current.get("metadatas") or [[]])[0] or {}
-                            metas["cluster_id"] = cluster_id
-                            collection.update(ids=[msg_id], metadatas=[metas])
-                        except Exception:
-                            pass
-
-                        key = _issue_key(os_name, parsed)
-                        issue = _issues.get(key)
-                        if issue is None:
-                            issue = Issue(os=os_name, key=key, created_at=now, last_seen_at=now)
-                            _issues[key] = issue
-                        issue.add_log(raw=raw, templated=templated, parsed=parsed)
+            entries: List[Dict[str, Any]] = []
+            messages_flat = [(msg_id, data) for _, messages in response for msg_id, data in messages]
+            processed = len(messages_flat)
+            # Parse/template the batch in one work item off the event loop. The consumer
+            # group mines these same lines into the shared Drain tree, so only look up
+            # their templates here instead of counting (and generalizing) them twice.
+            try:
+                parsed_lines = await parse_lines(
+                    [(_os_from_source(data.get("source")), data.get("line") or "") for _, data in messages_flat],
+                    mine=False,
+                )
+            except Exception as exc:
+                LOG.info("issues aggregator batch parsing failed lines=%d err=%s", processed, exc)
+                parsed_lines = [None] * processed
+            for (msg_id, data), parsed_line in zip(messages_flat, parsed_lines):
+                try:
+                    entries.append(build_entry(
+                        msg_id,
+                        data.get("source"),
+                        data.get("line") or "",
+                        parsed_line[:2] if parsed_line is not None else None,
+                    ))
+                except Exception as exc:
+                    LOG.info("issues aggregator failed message id=%s err=%s", msg_id, exc)
 
-                        # Track per-cluster size and publish cluster candidate at threshold (and occasionally thereafter).
-                        try:
-                            if cluster_id:
-                                counter_key = f"cluster:count:{os_name}:{cluster_id}"
-                                new_count = await redis.incr(counter_key)
-                                min_count = int(settings.CLUSTER_MIN_LOGS_FOR_CLASSIFICATION)
-                                should_publish = new_count == min_count
-
-                                repub_every = int(getattr(settings, "CLUSTER_CANDIDATE_REPUBLISH_EVERY", 0) or 0)
-                                min_interval = float(getattr(settings, "CLUSTER_CANDIDATE_REPUBLISH_MIN_INTERVAL_SEC", 0) or 0)
-                                if (not should_publish) and repub_every > 0 and new_count > min_count and (new_count % repub_every == 0):
-                                    last_key = f"cluster:last_candidate_ts:{os_name}:{cluster_id}"
-                                    try:
-                                        last_ts = float(await redis.get(last_key) or 0.0)
-                                    except Exception:
-                                        last_ts = 0.0
-                                    if (now - last_ts) >= min_interval:
-                                        should_publish = True
-                                        try:
-                                            await redis.setex(last_key, 60 * 60, str(now))
-                                        except Exception:
-                                            pass
-
-                                if should_publish:
-                                    env_val = parsed.get("env_id") if isinstance(parsed, dict) else None
-                                    sample_logs = [{
-                                        "raw": raw,
-                                        "templated": templated,
-                                        "os": os_name,
-                                        "source": source,
-                                        "env_id": env_val,
-                                    }]
-                                    await redis.xadd(settings.CLUSTERS_CANDIDATES_STREAM, {
-                                        "os": os_name,
-                                        "cluster_id": cluster_id,
-                                        "env_ids": json.dumps([env_val] if env_val else []),
-                                        "sample_logs": json.dumps(sample_logs),
-                                    })
-                        except Exception:
-                            pass
-                    except Exception as exc:
-                        processed_ok = False
-                        LOG.info("issues aggregator failed message id=%s err=%s", msg_id, exc)
-                    finally:
-                        if processed_ok:
-                            ack_ids.append(msg_id)
+            ack_ids = await aggregate_entries(entries, now)
 
             # Ack for this consumer group so the PEL doesn't grow unbounded.
             if ack_ids:
@@ -358,26 +502,25 @@ async def run_issues_aggregator() -> None:
                     pass
             LOG.debug("aggregated messages=%d open_issues=%d", processed, len(_issues))
         # periodically close idle issues
-        to_close: List[str] = []
-        for key, issue in _issues.items():
-            if now - issue.last_seen_at >= inactivity:
-                await _close_and_publish(issue)
-                to_close.append(key)
-        for key in to_close:
-            _issues.pop(key, None)
+        await close_idle_issues(now)
 
 
 def attach_issues_aggregator(app):
-    async def _run_forever():
+    async def _run_forever(worker: int):
         backoff = 1.0
         while True:
             try:
-                await run_issues_aggregator()
+                await run_issues_aggregator(worker)
             except Exception as exc:
                 LOG.info("issues aggregator crashed err=%s; restarting in %.1fs", exc, backoff)
                 await asyncio.sleep(backoff)
                 backoff = min(backoff * 2, 10)
 
+    if settings.UNIFIED_PIPELINE:
+        # The consumer runs build/aggregate/close in-process; no second consumer group on `logs`
+        LOG.info("issues aggregator not attached: UNIFIED_PIPELINE runs it inside the consumer")
+        return
+
     @app.on_event("startup")
     async def startup_event():
         LOG.info("starting issues aggregator in dedicated thread")
@@ -385,7 +528,8 @@ def attach_issues_aggregator(app):
 
         def _runner():
             asyncio.set_event_loop(loop)
-            loop.create_task(_run_forever())
+            for worker in range(max(1, int(settings.STREAM_WORKERS_PER_PROCESS))):
+                loop.create_task(_run_forever(worker))
             loop.run_forever()
 
         thread = threading.Thread(target=_runner, name="issues-aggregator-thread", daemon=True)
@@ -12,6 +12,7 @@ from fastapi import FastAPI
 from app.core.config import get_settings
 from app.services.chroma_service import ChromaClientProvider
 from app.services.cluster_metrics import ClusterMetricsTracker
+from app.streams.retention import xadd_args
 
 settings = get_settings()
 redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
@@ -191,7 +192,7 @@ async def run_metrics_aggregation():
                     all_alerts = quality_alerts + drift_alerts
                     for alert in all_alerts:
                         try:
-                            await redis.xadd(settings.ALERTS_STREAM, alert)  # type: ignore[arg-type]
+                            await redis.xadd(settings.ALERTS_STREAM, alert, **xadd_args(settings.ALERTS_STREAM))  # type: ignore[arg-type]
                             LOG.warning(
                                 "cluster metric alert type=%s os=%s message=%s",
                                 alert.get("type"),
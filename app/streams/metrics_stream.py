@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import base64
+import json
+import logging
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+from app.core.config import settings
+from app.streams.retention import xadd_args
+
+LOG = logging.getLogger(__name__)
+
+METRICS_STREAM = "metrics"
+
+# Packed entries carry {"encoding": "packed", "codec": "msgpack"|"json", "count", "points"}.
+# The body interns resource and attribute dicts (devices repeat the same resource for
+# every point) and stores each point as
+# [name, type, value, unit, time_unix_nano, resource_idx, attributes_idx].
+PACKED = "packed"
+
+
+def _pack_body(points: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+    resources: List[Any] = []
+    attributes: List[Any] = []
+    resource_ids: Dict[str, int] = {}
+    attribute_ids: Dict[str, int] = {}
+
+    def _intern(value: Any, table: List[Any], ids: Dict[str, int]) -> int:
+        key = json.dumps(value or {}, sort_keys=True, default=str)
+        idx = ids.get(key)
+        if idx is None:
+            idx = ids[key] = len(table)
+            table.append(value or {})
+        return idx
+
+    rows = []
+    for mp in points:
+        rows.append([
+            mp.get("name", ""),
+            mp.get("type", "gauge"),
+            mp.get("value"),
+            mp.get("unit") or "",
+            mp.get("time_unix_nano"),
+            _intern(mp.get("resource"), resources, resource_ids),
+            _intern(mp.get("attributes"), attributes, attribute_ids),
+        ])
+    return {"v": 1, "resources": resources, "attributes": attributes, "points": rows}
+
+
+_msgpack_missing_logged = False
+
+
+def _packb(body: Dict[str, Any]) -> Tuple[str, str]:
+    """Serialize a packed body with METRICS_STREAM_PACK_CODEC (msgpack is base64'd: streams are read as text)."""
+    global _msgpack_missing_logged
+    if (settings.METRICS_STREAM_PACK_CODEC or "json").strip().lower() == "msgpack":
+        try:
+            import msgpack  # type: ignore
+
+            return "msgpack", base64.b64encode(msgpack.packb(body, use_bin_type=True, default=str)).decode("ascii")
+        except ImportError:
+            if not _msgpack_missing_logged:
+                LOG.warning("METRICS_STREAM_PACK_CODEC=msgpack but msgpack is not installed; writing json")
+                _msgpack_missing_logged = True
+    return "json", json.dumps(body, separators=(",", ":"), default=str)
+
+
+def _value_text(value: Any) -> str:
+    # Both encodings hand values to readers as text, like the rows fields
+    return "" if value is None else str(value)
+
+
+def _unpackb(codec: str, data: str) -> Dict[str, Any]:
+    if codec == "msgpack":
+        import msgpack  # type: ignore
+
+        return msgpack.unpackb(base64.b64decode(data), raw=False)
+    return json.loads(data)
+
+
+def encode_points(points: Sequence[Mapping[str, Any]], encoding: str | None = None) -> List[Dict[str, str]]:
+    """Stream entries for normalized MetricPoints: one per point ("rows") or packed chunks."""
+    mode = (encoding or settings.METRICS_STREAM_ENCODING or "rows").strip().lower()
+    if mode != PACKED:
+        return [
+            {
+                "name": mp.get("name", ""),
+                "type": mp.get("type", "gauge"),
+                "value": _value_text(mp.get("value")),
+                "unit": (mp.get("unit") or ""),
+                "resource": json.dumps(mp.get("resource") or {}),
+                "attributes": json.dumps(mp.get("attributes") or {}),
+            }
+            for mp in points
+        ]
+    chunk = max(1, int(settings.METRICS_STREAM_PACK_MAX_POINTS))
+    entries = []
+    for start in range(0, len(points), chunk):
+        part = points[start:start + chunk]
+        codec, data = _packb(_pack_body(part))
+        entries.append({"encoding": PACKED, "codec": codec, "count": str(len(part)), "points": data})
+    return entries
+
+
+def decode_entry(fields: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Metric points of one metrics-stream entry, whichever encoding wrote it."""
+    if fields.get("encoding") == PACKED:
+        body = _unpackb(str(fields.get("codec") or "json"), str(fields.get("points") or ""))
+        resources = body.get("resources") or []
+        attributes = body.get("attributes") or []
+        out = []
+        for name, typ, value, unit, ts, ri, ai in body.get("points") or []:
+            out.append({
+                "name": name,
+                "type": typ,
+                "value": _value_text(value),
+                "unit": unit,
+                "time_unix_nano": ts,
+                "resource": resources[ri] if 0 <= ri < len(resources) else {},
+                "attributes": attributes[ai] if 0 <= ai < len(attributes) else {},
+            })
+        return out
+    try:
+        resource = json.loads(fields.get("resource") or "{}")
+    except Exception:
+        resource = {}
+    try:
+        attrs = json.loads(fields.get("attributes") or "{}")
+    except Exception:
+        attrs = {}
+    return [{
+        "name": fields.get("name"),
+        "type": fields.get("type"),
+        "value": fields.get("value"),
+        "unit": fields.get("unit"),
+        "resource": resource,
+        "attributes": attrs,
+    }]
+
+
+async def write_points(client: Any, points: Sequence[Mapping[str, Any]], encoding: str | None = None) -> int:
+    """Append points to the metrics stream in one pipelined round-trip; returns entries written."""
+    entries = encode_points(points, encoding)
+    if not entries:
+        return 0
+    trim = xadd_args(METRICS_STREAM)
+    async with client.pipeline(transaction=False) as pipe:
+        for entry in entries:
+            pipe.xadd(METRICS_STREAM, entry, **trim)
+        await pipe.execute()
+    return len(entries)
@@ -10,6 +10,7 @@ from redis.exceptions import ConnectionError as RedisConnectionError
 import threading
 
 from app.core.config import get_settings
+from app.streams.retention import xadd_args
 
 settings = get_settings()
 redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
@@ -60,7 +61,7 @@ async def _wait_for_redis() -> None:
 async def _safe_xadd(stream: str, fields: dict, *, retry: int = 1) -> None:
     """Perform xadd with one automatic reconnect/retry on connection errors."""
     try:
-        await redis.xadd(stream, fields, id="*")
+        await redis.xadd(stream, fields, id="*", **xadd_args(stream))
     except RedisConnectionError as exc:
         LOG.info("xadd failed (%s). Waiting for Redis and retrying...", exc)
         await _wait_for_redis()
@@ -12,6 +12,7 @@ from sqlalchemy import select
 from app.db.session import AsyncSessionLocal
 from app.models.data_source import DataSource
 from app.streams.producers.registry import get_factory
+from app.streams.utils import get_stream_writer
 
 if TYPE_CHECKING:
     from sqlalchemy.ext.asyncio import AsyncSession
@@ -90,9 +91,10 @@ class ProducerManager:
                         ptype = getattr(inst, "name", inst.__class__.__name__)
                         details.append(f"{rid}:{ptype}")
                 LOG.info(
-                    "producers heartbeat active=%d running=%s",
+                    "producers heartbeat active=%d running=%s writer=%s",
                     num_active,
                     ", ".join(details) if details else "-",
+                    get_stream_writer().stats(),
                 )
                 await asyncio.sleep(self._heartbeat_interval_seconds)
             except asyncio.CancelledError:
@@ -125,6 +127,20 @@ class ProducerManager:
         self.tasks[source_id] = task
         LOG.info("started producer id=%s type=%s", source_id, type_)
 
+    async def flush_writer(self) -> None:
+        """Send whatever the producers loop's stream writer still buffers."""
+        if self.loop is None or not self.loop.is_running():
+            return
+
+        async def _flush() -> int:
+            return await get_stream_writer().flush()
+
+        future = asyncio.run_coroutine_threadsafe(_flush(), self.loop)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(future), timeout=5)
+        except Exception as exc:  # noqa: BLE001
+            LOG.info("producers stream writer flush failed err=%s", exc)
+
     async def stop(self, source_id: int) -> None:
         inst = self.instances.pop(source_id, None)
         task = self.tasks.pop(source_id, None)
@@ -133,6 +149,8 @@ class ProducerManager:
                 await inst.shutdown()  # type: ignore[attr-defined]
         if task is not None:
             task.cancel()
+        # Don't leave the stopped producer's last lines in the writer buffer
+        await self.flush_writer()
         LOG.info("stopped producer id=%s", source_id)
 
     async def reconcile_all(self) -> None:
@@ -170,6 +188,7 @@ def attach_producers(app: FastAPI) -> None:
         for rid in list(manager.tasks.keys()):
             with suppress(Exception):
                 await manager.stop(rid)
+        await manager.flush_writer()
         if manager.loop is not None:
             manager.loop.call_soon_threadsafe(manager.loop.stop)
         if manager.thread is not None:
@@ -2,20 +2,49 @@ from __future__ import annotations
 
 import asyncio
 import os
+import time
 from pathlib import Path
 import logging
+from typing import Any, List, Tuple
 
-import aiofiles  # type: ignore[import-untyped]
+from redis.exceptions import ConnectionError as RedisConnectionError
 
+from app.core.config import settings
 from app.streams.producers.base import ProducerPlugin
 from app.streams.producers.registry import register
-from app.streams.utils import STREAM_NAME, safe_xadd, wait_for_redis
+from app.streams.utils import STREAM_NAME, get_stream_writer, redis, safe_xadd, wait_for_redis
 
 
 LOG = logging.getLogger(__name__)
 
 
+def _inotify() -> Any:
+    """inotify_simple.INotify on Linux when installed and enabled, else None (polling)."""
+    if not settings.FILETAIL_INOTIFY:
+        return None
+    try:
+        from inotify_simple import INotify  # type: ignore
+
+        return INotify()
+    except Exception:
+        return None
+
+
 class FileTail(ProducerPlugin):
+    """Tails log files into the logs stream with a per-path (inode, offset) checkpoint.
+
+    Files are read with pread in FILETAIL_READ_BLOCK_BYTES blocks and split into lines
+    in bulk; a trailing partial line stays unread until its newline arrives. The
+    checkpoint hash `filetail:checkpoint:<source_id>:<path>` is saved at most every
+    FILETAIL_CHECKPOINT_INTERVAL_SEC, after the stream writer has flushed, so a
+    restart resumes where delivery stopped (at-least-once). If the writer dropped any
+    of this path's entries since the last checkpoint, the offset is not advanced and
+    reading rewinds to the checkpoint instead. A changed inode means the file was
+    rotated: the old handle is drained, then the new file is read from 0.
+    A size below the offset means truncation and restarts at 0. Following waits on
+    inotify events for the file's directory when available, otherwise polls.
+    """
+
     name = "filetail"
 
     def __init__(self, config: dict):
@@ -24,16 +53,120 @@ class FileTail(ProducerPlugin):
         # Text decoding configuration; Windows defaults can cause decode errors on arbitrary logs
         self.encoding = config.get("encoding") or "utf-8"
         self.errors = config.get("errors") or "replace"
+        # Where to start when there is no usable checkpoint: "beginning" (backfill) or "end"
+        self.start_position = str(config.get("start_position") or "beginning").lower()
+        self.source_id = config.get("_source_id")
+        self.block_bytes = max(4096, int(settings.FILETAIL_READ_BLOCK_BYTES))
         self._stop = False
         LOG.info(
-            "filetail: configured paths=%s encoding=%s errors=%s",
+            "filetail: configured paths=%s encoding=%s errors=%s start=%s",
             ", ".join(str(p) for p in self.paths),
             self.encoding,
             self.errors,
+            self.start_position,
         )
 
-    async def _tail(self, path: Path) -> None:
+    def _checkpoint_key(self, path: Path) -> str:
+        return f"filetail:checkpoint:{self.source_id if self.source_id is not None else '-'}:{path.resolve()}"
+
+    async def _load_checkpoint(self, path: Path) -> Tuple[int, int] | None:
+        try:
+            data = await redis.hgetall(self._checkpoint_key(path))
+        except RedisConnectionError:
+            await wait_for_redis()
+            return None
+        if not data:
+            return None
+        try:
+            return int(data.get("inode") or 0), int(data.get("offset") or 0)
+        except (TypeError, ValueError):
+            return None
+
+    def _producer_key(self, path: Path) -> str:
+        """Stream writer producer key for one path, so its drops are counted separately."""
+        return f"filetail:{self.source_id if self.source_id is not None else '-'}:{path}"
+
+    async def _save_checkpoint(self, path: Path, inode: int, offset: int) -> None:
+        try:
+            await redis.hset(
+                self._checkpoint_key(path),
+                mapping={"inode": inode, "offset": offset, "updated_at": time.time()},
+            )
+        except RedisConnectionError:
+            await wait_for_redis()
+
+    async def _commit(self, path: Path, inode: int, offset: int, state: dict) -> int:
+        """Checkpoint `offset` once everything read so far has reached Redis.
+
+        Returns the offset to continue from: `offset` when it was saved, or the last
+        checkpoint when the writer dropped entries of this path since then, so those
+        lines are read again.
+        """
+        if settings.STREAM_WRITER_ENABLED:
+            writer = get_stream_writer()
+            await writer.flush()
+            failed = writer.failed_count(self._producer_key(path))
+            if failed != state["failed"]:
+                state["failed"] = failed
+                state["saved_at"] = time.monotonic()
+                if state["inode"] == inode:
+                    LOG.info(
+                        "filetail: %s lost entries before offset=%d; re-reading from %d",
+                        path, offset, state["offset"],
+                    )
+                    return int(state["offset"])
+        await self._save_checkpoint(path, inode, offset)
+        state.update(inode=inode, offset=offset, saved_at=time.monotonic())
+        return offset
+
+    def _split(self, data: bytes) -> Tuple[List[str], int]:
+        """Complete lines in `data` and the number of bytes they span."""
+        end = data.rfind(b"\n")
+        if end < 0:
+            return [], 0
+        text = data[:end + 1].decode(self.encoding, errors=self.errors)
+        return text.split("\n")[:-1], end + 1
+
+    async def _drain(self, path: Path, fd: int, offset: int, inode: int, state: dict, final: bool = False) -> int:
+        """Ship every complete line from `offset` to EOF; returns the new offset.
+
+        With `final` (the file was rotated away) a trailing line without a newline is
+        shipped too, since nothing more will be appended to it.
+        """
         source = path.name
+        producer = self._producer_key(path)
+        while not self._stop:
+            size = os.fstat(fd).st_size
+            if size <= offset:
+                break
+            data = await asyncio.to_thread(os.pread, fd, self.block_bytes, offset)
+            lines, consumed = self._split(data)
+            if consumed == 0:
+                if len(data) < self.block_bytes and not final:
+                    break  # partial last line; wait for its newline
+                # A single line longer than a block, or the rotated file's last line: ship it as is
+                lines, consumed = [data.decode(self.encoding, errors=self.errors)], len(data)
+            for line in lines:
+                await safe_xadd(STREAM_NAME, {"source": source, "line": line.strip()}, producer=producer)
+            offset += consumed
+            if time.monotonic() - state["saved_at"] >= float(settings.FILETAIL_CHECKPOINT_INTERVAL_SEC):
+                offset = await self._commit(path, inode, offset, state)
+        return offset
+
+    async def _wait_for_change(self, notifier: Any, event: asyncio.Event) -> None:
+        timeout = float(settings.FILETAIL_POLL_INTERVAL_SEC)
+        if notifier is None:
+            await asyncio.sleep(timeout)
+            return
+        # Events only wake us early; stat() below decides what changed
+        try:
+            await asyncio.wait_for(event.wait(), timeout=max(timeout, 1.0))
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+        notifier.read(timeout=0)
+
+    async def _tail(self, path: Path) -> None:
         backoff = 1.0
         while not self._stop:
             # Wait for file to appear if it's not there yet
@@ -41,30 +174,81 @@ class FileTail(ProducerPlugin):
                 await asyncio.sleep(1.0)
             if self._stop:
                 return
+            notifier = None
+            event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            fd = -1
             try:
-                LOG.info("filetail: opening %s", path)
-                async with aiofiles.open(path, mode="r", encoding=self.encoding, errors=self.errors) as f:
-                    # Read existing content once
-                    await f.seek(0)
-                    while not self._stop:
-                        line = await f.readline()
-                        if not line:
-                            break
-                        await safe_xadd(STREAM_NAME, {"source": source, "line": line.strip()})
-                    # Seek to EOF and follow
-                    await f.seek(0, os.SEEK_END)
-                    while not self._stop:
-                        line = await f.readline()
-                        if not line:
-                            await asyncio.sleep(0.5)
-                            continue
-                        await safe_xadd(STREAM_NAME, {"source": source, "line": line.strip()})
+                fd = os.open(path, os.O_RDONLY)
+                st = os.fstat(fd)
+                inode = st.st_ino
+                checkpoint = await self._load_checkpoint(path)
+                if checkpoint and checkpoint[0] == inode and checkpoint[1] <= st.st_size:
+                    offset = checkpoint[1]
+                elif checkpoint is None and self.start_position == "end":
+                    offset = st.st_size
+                else:
+                    offset = 0
+                LOG.info("filetail: opening %s inode=%s offset=%d size=%d", path, inode, offset, st.st_size)
+                notifier = _inotify()
+                if notifier is not None:
+                    from inotify_simple import flags  # type: ignore
+
+                    notifier.add_watch(
+                        str(path.parent.resolve()),
+                        flags.MODIFY | flags.CREATE | flags.MOVED_TO | flags.DELETE | flags.CLOSE_WRITE,
+                    )
+                    loop.add_reader(notifier.fileno(), event.set)
+                failed = get_stream_writer().failed_count(self._producer_key(path)) if settings.STREAM_WRITER_ENABLED else 0
+                state = {"saved_at": time.monotonic(), "inode": inode, "offset": offset, "failed": failed}
+                while not self._stop:
+                    offset = await self._drain(path, fd, offset, inode, state)
+                    try:
+                        current = os.stat(path)
+                    except FileNotFoundError:
+                        current = None
+                    if current is not None and current.st_ino != inode:
+                        # Rotated: finish the old file (re-reading anything dropped), then
+                        # switch to the new one from the start
+                        while True:
+                            offset = await self._drain(path, fd, offset, inode, state, final=True)
+                            resume = await self._commit(path, inode, offset, state)
+                            if resume == offset or self._stop:
+                                break
+                            offset = resume
+                        LOG.info("filetail: %s rotated inode=%s -> %s", path, inode, current.st_ino)
+                        os.close(fd)
+                        fd = -1
+                        fd = os.open(path, os.O_RDONLY)
+                        inode, offset = os.fstat(fd).st_ino, 0
+                        await self._save_checkpoint(path, inode, offset)
+                        state.update(inode=inode, offset=offset, saved_at=time.monotonic())
+                        continue
+                    if os.fstat(fd).st_size < offset:
+                        LOG.info("filetail: %s truncated at offset=%d; restarting from 0", path, offset)
+                        offset = 0
+                        await self._save_checkpoint(path, inode, offset)
+                        state.update(offset=offset, saved_at=time.monotonic())
+                        continue
+                    if time.monotonic() - state["saved_at"] >= float(settings.FILETAIL_CHECKPOINT_INTERVAL_SEC):
+                        offset = await self._commit(path, inode, offset, state)
+                        continue  # a rewound offset is drained before waiting
+                    await self._wait_for_change(notifier, event)
+                await self._commit(path, inode, offset, state)
                 # successful pass; reset backoff
                 backoff = 1.0
             except Exception as exc:  # noqa: BLE001
                 LOG.exception("filetail: error while tailing %s: %s", path, exc)
                 await asyncio.sleep(backoff)
                 backoff = min(backoff * 2, 10.0)
+            finally:
+                if notifier is not None:
+                    try:
+                        loop.remove_reader(notifier.fileno())
+                    finally:
+                        notifier.close()
+                if fd >= 0:
+                    os.close(fd)
 
     async def run(self) -> None:
         await wait_for_redis()
@@ -84,6 +268,3 @@ class FileTail(ProducerPlugin):
 @register("filetail")
 def _factory(cfg: dict):
     return FileTail(cfg)
-
-
-
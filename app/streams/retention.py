@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+import redis.asyncio as aioredis
+from fastapi import FastAPI
+from redis.exceptions import ResponseError
+
+from app.core.config import get_settings
+
+settings = get_settings()
+redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+LOG = logging.getLogger(__name__)
+
+# Per-stream trim results for the health endpoint, updated by the trimmer thread
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def parse_policies(spec: str | None = None) -> Dict[str, Tuple[str, int]]:
+    """Parse STREAM_RETENTION ("stream=maxlen:N,stream=minid:SECONDS") into {stream: (kind, value)}."""
+    policies: Dict[str, Tuple[str, int]] = {}
+    for item in (spec if spec is not None else settings.STREAM_RETENTION or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            stream, rule = item.split("=", 1)
+            kind, value = rule.split(":", 1)
+            kind = kind.strip().lower()
+            if kind not in {"maxlen", "minid"}:
+                raise ValueError(kind)
+            policies[stream.strip()] = (kind, int(float(value)))
+        except ValueError:
+            LOG.info("stream retention: ignoring invalid policy %r", item)
+    return policies
+
+
+_policies: Dict[str, Tuple[str, int]] | None = None
+
+
+def get_policies() -> Dict[str, Tuple[str, int]]:
+    global _policies
+    if _policies is None:
+        _policies = parse_policies()
+    return _policies
+
+
+def xadd_args(stream: str) -> Dict[str, Any]:
+    """Approximate write-time cap for XADD on `stream` ({} when it has no policy).
+
+    The cap is the policy scaled by STREAM_RETENTION_WRITE_HEADROOM: a memory ceiling
+    that only bites when consumers fall far behind. The exact policy is applied by
+    the trimmer, which never removes entries a consumer group still needs.
+    """
+    headroom = float(settings.STREAM_RETENTION_WRITE_HEADROOM)
+    policy = get_policies().get(stream)
+    if policy is None or headroom <= 0:
+        return {}
+    kind, value = policy
+    if kind == "maxlen":
+        return {"maxlen": max(1, int(value * headroom)), "approximate": True}
+    cutoff_ms = int((time.time() - value * headroom) * 1000)
+    return {"minid": f"{max(0, cutoff_ms)}-0", "approximate": True}
+
+
+def _parse_id(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = str(entry_id).partition("-")
+    return int(ms or 0), int(seq or 0)
+
+
+async def _protected_floor(stream: str) -> str | None:
+    """Oldest entry any consumer group still needs: its oldest pending entry, else its
+    last-delivered ID. None when the stream has no groups."""
+    try:
+        groups = await redis.xinfo_groups(stream)
+    except ResponseError:
+        return None
+    floor: str | None = None
+    for group in groups:
+        candidate = str(group.get("last-delivered-id") or "0-0")
+        if int(group.get("pending") or 0) > 0:
+            summary = await redis.xpending(stream, str(group["name"]))
+            if summary and summary.get("min"):
+                candidate = str(summary["min"])
+        if floor is None or _parse_id(candidate) < _parse_id(floor):
+            floor = candidate
+    return floor
+
+
+async def _policy_minid(stream: str, kind: str, value: int, length: int) -> str | None:
+    """The MINID the policy alone would trim to (None when nothing is due)."""
+    if kind == "minid":
+        return f"{int((time.time() - value) * 1000)}-0"
+    excess = length - value
+    if excess <= 0:
+        return None
+    # Streams have no index access: find the first entry to keep, a bounded batch per pass
+    count = min(excess, max(1, int(settings.STREAM_TRIM_BATCH))) + 1
+    entries = await redis.xrange(stream, min="-", max="+", count=count) or []
+    if len(entries) < count:
+        return None
+    return str(entries[-1][0])
+
+
+async def trim_stream(stream: str, kind: str, value: int) -> Dict[str, Any]:
+    """Apply one stream's policy, bounded by its slowest consumer group; returns stats."""
+    length = int(await redis.xlen(stream))
+    target = await _policy_minid(stream, kind, value, length)
+    floor = await _protected_floor(stream)
+    limited = False
+    if target is not None and floor is not None and _parse_id(floor) < _parse_id(target):
+        target, limited = floor, True
+    trimmed = 0
+    if target is not None:
+        trimmed = int(await redis.xtrim(stream, minid=target, approximate=True) or 0)
+    prev = _stats.get(stream) or {}
+    stats = {
+        "policy": f"{kind}:{value}",
+        "length": length - trimmed,
+        "trimmed_last": trimmed,
+        "trimmed_total": int(prev.get("trimmed_total") or 0) + trimmed,
+        "protected_floor": floor,
+        "limited_by_consumers": limited,
+        "last_run": time.time(),
+    }
+    _stats[stream] = stats
+    return stats
+
+
+async def run_stream_trimmer() -> None:
+    while True:
+        for stream, (kind, value) in get_policies().items():
+            try:
+                stats = await trim_stream(stream, kind, value)
+                if stats["trimmed_last"] or stats["limited_by_consumers"]:
+                    LOG.info(
+                        "stream trim stream=%s policy=%s trimmed=%d length=%d limited=%s",
+                        stream,
+                        stats["policy"],
+                        stats["trimmed_last"],
+                        stats["length"],
+                        stats["limited_by_consumers"],
+                    )
+            except Exception as exc:
+                LOG.info("stream trim failed stream=%s err=%s", stream, exc)
+                (_stats.setdefault(stream, {}))["last_error"] = str(exc)
+        await asyncio.sleep(float(settings.STREAM_TRIM_INTERVAL_SEC))
+
+
+def retention_stats() -> Dict[str, Any]:
+    """Latest trim results per stream (no Redis round-trips; safe for liveness checks)."""
+    return {
+        "enabled": bool(settings.ENABLE_STREAM_TRIMMER),
+        "streams": {stream: dict(stats) for stream, stats in _stats.items()},
+    }
+
+
+def attach_stream_trimmer(app: FastAPI) -> None:
+    """Attach the stream retention trimmer as a background task."""
+
+    async def _run_forever():
+        backoff = 1.0
+        while True:
+            try:
+                LOG.info("starting stream trimmer interval=%ss policies=%s", settings.STREAM_TRIM_INTERVAL_SEC, get_policies())
+                await run_stream_trimmer()
+            except Exception as exc:
+                LOG.error("stream trimmer crashed err=%s; restarting in %.1fs", exc, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    @app.on_event("startup")
+    async def startup_event():
+        if not settings.ENABLE_STREAM_TRIMMER:
+            LOG.info("stream trimmer disabled via ENABLE_STREAM_TRIMMER=False")
+            return
+        loop = asyncio.new_event_loop()
+
+        def _runner():
+            asyncio.set_event_loop(loop)
+            loop.create_task(_run_forever())
+            loop.run_forever()
+
+        thread = threading.Thread(target=_runner, name="stream-trimmer-thread", daemon=True)
+        thread.start()
+        app.state.stream_trimmer_loop = loop
+        app.state.stream_trimmer_thread = thread
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        loop = getattr(app.state, "stream_trimmer_loop", None)
+        thread = getattr(app.state, "stream_trimmer_thread", None)
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(timeout=5)
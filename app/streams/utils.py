@@ -1,10 +1,15 @@
 import asyncio
 import logging
+import os
+import socket
+import time
+from typing import Any, Dict, List, Tuple, cast
 
 import redis.asyncio as aioredis
 from redis.exceptions import ConnectionError as RedisConnectionError
 
 from app.core.config import get_settings
+from app.streams.retention import xadd_args
 
 
 settings = get_settings()
@@ -25,18 +30,254 @@ async def wait_for_redis() -> None:
             delay = min(delay * 2, 5)
 
 
-async def safe_xadd(stream: str, fields: dict, *, retry: int = 1) -> None:
+async def safe_xadd(stream: str, fields: dict, *, retry: int = 1, producer: str | None = None) -> None:
+    """Append to a stream through the loop's batching writer (or directly when it is disabled)."""
+    if settings.STREAM_WRITER_ENABLED:
+        await get_stream_writer().enqueue(stream, fields, producer=producer)
+        return
     try:
-        await redis.xadd(stream, fields, id="*")
+        await redis.xadd(stream, fields, id="*", **xadd_args(stream))
     except RedisConnectionError:
         await wait_for_redis()
         if retry > 0:
-            await safe_xadd(stream, fields, retry=retry - 1)
+            await safe_xadd(stream, fields, retry=retry - 1, producer=producer)
 
 
+class StreamBatchWriter:
+    """Coalesces XADDs from many producer tasks into pipelined batches.
 
+    Entries are buffered and sent as one non-transactional pipeline when
+    STREAM_WRITER_MAX_BATCH entries are queued or STREAM_WRITER_LINGER_MS after the
+    first one, whichever comes first; a single lock keeps batches in order. Each
+    pipeline also reads XLEN of the streams it wrote, and while a stream is above
+    STREAM_BACKPRESSURE_MAXLEN, `enqueue` for it waits until consumers catch up.
+    Enqueue/flush counters are kept per producer (the `source` prefix by default).
+    """
 
+    def __init__(self, client: aioredis.Redis) -> None:
+        self.client = client
+        self.max_batch = max(1, int(settings.STREAM_WRITER_MAX_BATCH))
+        self.linger = max(0.0, float(settings.STREAM_WRITER_LINGER_MS) / 1000.0)
+        self.maxlen = int(settings.STREAM_BACKPRESSURE_MAXLEN or 0)
+        self._buffer: List[Tuple[str, Dict[str, Any], str]] = []
+        self._lock = asyncio.Lock()
+        self._linger_task: asyncio.Task | None = None
+        self._saturated: Dict[str, int] = {}
+        self.enqueued: Dict[str, int] = {}
+        self.flushed: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self.batches = 0
+        self.backpressure_waits = 0
 
+    @staticmethod
+    def _producer_key(stream: str, fields: Dict[str, Any], producer: str | None) -> str:
+        if producer:
+            return producer
+        source = str(fields.get("source") or "")
+        return source.split(":", 1)[0] if source else stream
 
+    async def enqueue(self, stream: str, fields: Dict[str, Any], *, producer: str | None = None) -> None:
+        if self.maxlen > 0 and stream in self._saturated:
+            await self._wait_for_room(stream)
+        key = self._producer_key(stream, fields, producer)
+        self.enqueued[key] = self.enqueued.get(key, 0) + 1
+        self._buffer.append((stream, fields, key))
+        if len(self._buffer) >= self.max_batch:
+            await self.flush()
+        elif self._linger_task is None or self._linger_task.done():
+            self._linger_task = asyncio.create_task(self._flush_later())
 
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.linger)
+        try:
+            await self.flush()
+        except Exception as exc:
+            LOG.info("stream writer linger flush failed err=%s", exc)
+
+    async def _wait_for_room(self, stream: str) -> None:
+        self.backpressure_waits += 1
+        delay = float(settings.STREAM_BACKPRESSURE_POLL_SEC)
+        while True:
+            try:
+                length = int(await self.client.xlen(stream))
+            except RedisConnectionError:
+                await wait_for_redis()
+                continue
+            if length <= self.maxlen:
+                self._saturated.pop(stream, None)
+                return
+            self._saturated[stream] = length
+            await asyncio.sleep(delay)
+
+    async def flush(self) -> int:
+        """Write everything buffered so far; returns the number of entries sent."""
+        async with self._lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            streams = sorted({stream for stream, _, _ in batch})
+            for attempt in (0, 1):
+                try:
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for stream, fields, _ in batch:
+                            pipe.xadd(stream, fields, id="*", **xadd_args(stream))  # type: ignore[arg-type]
+                        for stream in streams:
+                            pipe.xlen(stream)
+                        results = await pipe.execute()
+                    break
+                except RedisConnectionError as exc:
+                    if attempt == 1:
+                        self._drop(batch, exc)
+                        return 0
+                    await wait_for_redis()
+                except Exception as exc:
+                    # e.g. ResponseError from a bad entry or a read-only replica: retrying won't help
+                    self._drop(batch, exc)
+                    return 0
+            self.batches += 1
+            for _, _, key in batch:
+                self.flushed[key] = self.flushed.get(key, 0) + 1
+            if self.maxlen > 0:
+                for stream, length in zip(streams, results[len(batch):]):
+                    if int(length or 0) > self.maxlen:
+                        self._saturated[stream] = int(length)
+                    else:
+                        self._saturated.pop(stream, None)
+            return len(batch)
+
+    def _drop(self, batch: List[Tuple[str, Dict[str, Any], str]], exc: Exception) -> None:
+        for _, _, key in batch:
+            self.failed[key] = self.failed.get(key, 0) + 1
+        LOG.info("stream writer dropped batch size=%d err=%s", len(batch), exc)
+
+    def failed_count(self, producer: str) -> int:
+        """Entries of `producer` dropped so far; callers compare it across flushes."""
+        return self.failed.get(producer, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "batches": self.batches,
+            "enqueued": dict(self.enqueued),
+            "flushed": dict(self.flushed),
+            "failed": dict(self.failed),
+            "backpressure_waits": self.backpressure_waits,
+            "saturated_streams": dict(self._saturated),
+        }
+
+
+# One writer per event loop: its lock, linger task and connections belong to that loop
+_writers: Dict[int, StreamBatchWriter] = {}
+
+
+def get_stream_writer() -> StreamBatchWriter:
+    loop_id = id(asyncio.get_running_loop())
+    writer = _writers.get(loop_id)
+    if writer is None:
+        writer = _writers[loop_id] = StreamBatchWriter(redis)
+    return writer
+
+
+def stream_writer_stats() -> List[Dict[str, Any]]:
+    return [writer.stats() for writer in list(_writers.values())]
 
+
+def consumer_name(base: str, worker: int = 0) -> str:
+    """Per-replica consumer identity for a stream group: `<base>-<instance>-<worker>`.
+
+    The instance defaults to `<hostname>-<pid>` so replicas and uvicorn workers never
+    share a consumer (and its pending entries); STREAM_CONSUMER_ID overrides it, e.g.
+    with a StatefulSet pod name that is stable across restarts.
+    """
+    instance = (settings.STREAM_CONSUMER_ID or "").strip() or f"{socket.gethostname()}-{os.getpid()}"
+    return f"{base}-{instance}-{worker}"
+
+
+class GroupReader:
+    """XREADGROUP for one consumer that also reclaims stale pending entries.
+
+    Every STREAM_RECLAIM_INTERVAL_SEC the reader XAUTOCLAIMs entries that have been
+    pending on any consumer of the group (crashed or scaled-down replicas, previous
+    process incarnations) for longer than STREAM_RECLAIM_MIN_IDLE_MS and returns them
+    ahead of new messages, so they go through the normal processing and ack path.
+    Consumers that have been idle for STREAM_CONSUMER_PRUNE_IDLE_SEC and hold no
+    pending entries are removed from the group.
+    """
+
+    def __init__(self, client: aioredis.Redis, stream: str, group: str, consumer: str) -> None:
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self._cursor = "0-0"
+        self._next_claim_at = 0.0
+        self.reclaimed = 0
+
+    async def read(self, *, count: int, block: int) -> List[Tuple[str, List[Tuple[str, Dict[str, Any]]]]]:
+        claimed = await self._reclaim()
+        # Do not block on new messages when reclaimed work is already waiting
+        response = await self.client.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: ">"},
+            count=count,
+            block=None if claimed else block,
+        )
+        out = cast(List[Tuple[str, List[Tuple[str, Dict[str, Any]]]]], list(response or []))
+        if claimed:
+            out.insert(0, (self.stream, claimed))
+        return out
+
+    async def _reclaim(self) -> List[Tuple[str, Dict[str, Any]]]:
+        if not settings.STREAM_RECLAIM_ENABLED:
+            return []
+        now = time.monotonic()
+        if now < self._next_claim_at:
+            return []
+        try:
+            result = await self.client.xautoclaim(
+                self.stream,
+                self.group,
+                self.consumer,
+                min_idle_time=int(settings.STREAM_RECLAIM_MIN_IDLE_MS),
+                start_id=self._cursor,
+                count=int(settings.STREAM_RECLAIM_COUNT),
+            )
+        except Exception as exc:
+            LOG.info("xautoclaim failed stream=%s group=%s consumer=%s err=%s", self.stream, self.group, self.consumer, exc)
+            self._next_claim_at = now + float(settings.STREAM_RECLAIM_INTERVAL_SEC)
+            return []
+        self._cursor = str(result[0] or "0-0")
+        if self._cursor in {"0-0", "0"}:
+            # Full pass over the PEL finished; wait for the next interval
+            self._cursor = "0-0"
+            self._next_claim_at = now + float(settings.STREAM_RECLAIM_INTERVAL_SEC)
+            await self._prune_consumers()
+        # Entries deleted from the stream come back without fields (Redis < 7)
+        claimed = [(msg_id, fields) for msg_id, fields in (result[1] or []) if msg_id and fields is not None]
+        if claimed:
+            self.reclaimed += len(claimed)
+            LOG.info(
+                "reclaimed pending stream=%s group=%s consumer=%s count=%d",
+                self.stream,
+                self.group,
+                self.consumer,
+                len(claimed),
+            )
+        return claimed
+
+    async def _prune_consumers(self) -> None:
+        prune_after_ms = int(settings.STREAM_CONSUMER_PRUNE_IDLE_SEC) * 1000
+        if prune_after_ms <= 0:
+            return
+        try:
+            consumers = await self.client.xinfo_consumers(self.stream, self.group)
+            for info in consumers or []:
+                name = info.get("name")
+                if not name or name == self.consumer:
+                    continue
+                if int(info.get("pending") or 0) == 0 and int(info.get("idle") or 0) >= prune_after_ms:
+                    await self.client.xgroup_delconsumer(self.stream, self.group, name)
+                    LOG.info("removed idle consumer stream=%s group=%s consumer=%s", self.stream, self.group, name)
+        except Exception as exc:
+            LOG.debug("consumer prune failed stream=%s group=%s err=%s", self.stream, self.group, exc)
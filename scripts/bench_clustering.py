@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services.clustering_service import _single_pass_cluster
+
+
+def _normalize(vec: List[float]) -> List[float]:
+    n = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / n for v in vec]
+
+
+def _cosine_distance(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    dot = max(min(dot, 1.0), -1.0)
+    return 1.0 - dot
+
+
+def _mean(vectors: List[List[float]]) -> List[float]:
+    dim = len(vectors[0])
+    acc = [0.0] * dim
+    for v in vectors:
+        for i in range(dim):
+            acc[i] += v[i]
+    return [x / float(len(vectors)) for x in acc]
+
+
+def single_pass_cluster_reference(
+    embeddings: List[List[float]],
+    threshold: float,
+    min_size: int,
+) -> Tuple[List[List[int]], List[List[float]]]:
+    """The original pure-Python implementation (re-averages all members on every join)."""
+    normalized = [_normalize(e) for e in embeddings]
+    clusters: List[List[int]] = []
+    centroids: List[List[float]] = []
+    for idx, vec in enumerate(normalized):
+        if not centroids:
+            clusters.append([idx])
+            centroids.append(vec[:])
+            continue
+        distances = [_cosine_distance(vec, c) for c in centroids]
+        best_i = min(range(len(distances)), key=lambda i: distances[i])
+        if distances[best_i] <= threshold:
+            clusters[best_i].append(idx)
+            centroids[best_i] = _normalize(_mean([normalized[i] for i in clusters[best_i]]))
+        else:
+            clusters.append([idx])
+            centroids.append(vec[:])
+    kept = [(c, ctr) for c, ctr in zip(clusters, centroids) if len(c) >= max(1, min_size)]
+    return [c for c, _ in kept], [ctr for _, ctr in kept]
+
+
+def synthetic_embeddings(n: int, dim: int, topics: int, noise: float, seed: int) -> List[List[float]]:
+    """Unit vectors scattered around `topics` random directions (template-like structure)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dim))
+    picks = rng.integers(0, topics, size=n)
+    vectors = centers[picks] + noise * rng.normal(size=(n, dim))
+    return vectors.tolist()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark _single_pass_cluster against the pure-Python reference (run as python -m scripts.bench_clustering)")
+    parser.add_argument("--n", type=int, default=100_000, help="Number of embeddings")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.15)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--reference-n", type=int, default=1_500, help="Subset size for the (slow) reference comparison")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    embs = synthetic_embeddings(args.n, args.dim, args.topics, args.noise, args.seed)
+
+    subset = embs[: args.reference_n]
+    start = time.perf_counter()
+    ref_clusters, ref_centroids = single_pass_cluster_reference(subset, args.threshold, 1)
+    reference = time.perf_counter() - start
+    clusters, centroids = _single_pass_cluster(subset, args.threshold, 1)
+    if clusters != ref_clusters or not np.allclose(centroids, ref_centroids, atol=1e-9):
+        print("MISMATCH against the reference implementation")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    clusters, _ = _single_pass_cluster(embs, args.threshold, 1)
+    engine = time.perf_counter() - start
+
+    print(f"n={args.n} dim={args.dim} clusters={len(clusters)}")
+    print(f"reference (n={len(subset)})  {reference:8.3f}s")
+    print(f"engine    (n={len(subset)})  identical assignments: yes")
+    print(f"engine    (n={args.n})  {engine:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
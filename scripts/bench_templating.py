@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from app.parsers.linux import parse_linux_line
+from app.parsers.templating import _template_token, template_content, template_content_reference
+from app.parsers.windows import parse_windows_line
+
+
+def load_contents(paths: List[Path]) -> List[str]:
+    """Return message bodies from the given log files (raw line when unparsable)."""
+    contents: List[str] = []
+    for path in paths:
+        with path.open(encoding="utf-8", errors="replace") as f:
+            for i, line in enumerate(f):
+                parsed = parse_linux_line(i, line) or parse_windows_line(i, line)
+                contents.append(parsed["content"] if parsed else line.rstrip("\n"))
+    return contents
+
+
+def _time(fn: Callable[[str], str], contents: List[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for content in contents:
+            fn(content)
+    return time.perf_counter() - start
+
+
+def _clear_caches() -> None:
+    template_content.cache_clear()
+    _template_token.cache_clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark template_content against the reference mask chain (run as python -m scripts.bench_templating)")
+    parser.add_argument("paths", nargs="*", type=Path, help="Log files to use. Defaults to data/*.log")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the data per measurement")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(Path("data").glob("*.log"))
+    contents = load_contents(paths)
+    if not contents:
+        raise SystemExit("no log lines found")
+
+    _clear_caches()
+    mismatches = [c for c in contents if template_content(c) != template_content_reference(c)]
+    if mismatches:
+        print(f"MISMATCH on {len(mismatches)} lines, first: {mismatches[0]!r}")
+        raise SystemExit(1)
+
+    n = len(contents) * args.rounds
+    reference = _time(template_content_reference, contents, args.rounds)
+    _clear_caches()
+    cold = _time(template_content, contents, 1)
+    warm = _time(template_content, contents, args.rounds)
+
+    print(f"lines={len(contents)} distinct={len(set(contents))} files={', '.join(str(p) for p in paths)}")
+    print(f"reference            {reference:8.3f}s  {n / reference:12.0f} lines/s")
+    print(f"engine, first pass   {cold:8.3f}s  {len(contents) / cold:12.0f} lines/s  (empty caches)")
+    print(f"engine, steady state {warm:8.3f}s  {n / warm:12.0f} lines/s")
+    print("outputs identical: yes")
+
+
+if __name__ == "__main__":
+    main()
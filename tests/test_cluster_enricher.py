@@ -0,0 +1,58 @@
+import json
+import time
+
+from app.services.label_propagation import classification_for_cluster, classification_metadata
+from app.streams import cluster_enricher
+
+
+class _Collection:
+    def __init__(self) -> None:
+        self.updates: list = []
+
+    def update(self, ids, metadatas):
+        self.updates.append((ids, metadatas))
+
+
+class _Provider:
+    def __init__(self) -> None:
+        self.collection = _Collection()
+
+    def get_or_create_collection(self, name):
+        return self.collection
+
+
+def _llm_meta(failure_type: str = "disk_full") -> dict:
+    result = {"failure_type": failure_type, "confidence": 0.9, "recommendation": "free space"}
+    meta = {"label": failure_type, "rationale": "llm_cluster", "solution": "free space"}
+    meta.update(classification_metadata(result, classified_at=time.time()))
+    return meta
+
+
+def test_self_hit_keeps_prototype_a_propagation_source(monkeypatch):
+    provider = _Provider()
+    monkeypatch.setattr(cluster_enricher, "_get_provider", lambda: provider)
+    meta = _llm_meta()
+
+    result = classification_for_cluster("linux", "c1", meta, None)
+    assert result is not None and result["propagated_from"]["cluster_id"] == "c1"
+
+    cluster_enricher._store_prototype_label("linux", "c1", meta, result)
+
+    assert provider.collection.updates == []
+    # The next candidate for the same cluster is still served without the LLM
+    assert classification_for_cluster("linux", "c1", meta, None) is not None
+
+
+def test_label_copied_from_another_prototype_is_demoted(monkeypatch):
+    provider = _Provider()
+    monkeypatch.setattr(cluster_enricher, "_get_provider", lambda: provider)
+    result = json.loads(_llm_meta()["classification"])
+    result["propagated_from"] = {"cluster_id": "c2", "distance": 0.05, "classified_at": time.time()}
+
+    cluster_enricher._store_prototype_label("linux", "c1", {"label": "unknown"}, result)
+
+    (ids, metas), = provider.collection.updates
+    assert ids == ["c1"]
+    assert metas[0]["rationale"] == "propagated"
+    assert metas[0]["label"] == "disk_full"
+    assert "classification" not in metas[0]
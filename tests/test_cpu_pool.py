@@ -0,0 +1,25 @@
+from app.core.config import settings
+from app.services import cpu_pool
+from app.services.cpu_pool import ProcessPoolEmbeddingFunction
+from app.services.embedding import CachedEmbeddingFunction, EmbeddingCache
+
+
+def _cached_pool_fn(monkeypatch, provider: str, model_setting: str, model: str) -> CachedEmbeddingFunction:
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", provider)
+    monkeypatch.setattr(settings, model_setting, model)
+    # name() is resolved from a worker at startup; no pool is needed for the key
+    monkeypatch.setattr(cpu_pool, "_pool_embedding_name", "sentence-transformers::384")
+    return CachedEmbeddingFunction(ProcessPoolEmbeddingFunction(), cache=EmbeddingCache(max_entries=8))
+
+
+def test_pooled_sentence_transformer_cache_key_names_the_model(monkeypatch):
+    first = _cached_pool_fn(monkeypatch, "sentence-transformers", "EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+    second = _cached_pool_fn(monkeypatch, "sentence-transformers", "EMBEDDING_MODEL_NAME", "paraphrase-MiniLM-L6-v2")
+
+    assert first._provider_key == "sentence-transformers::384::all-MiniLM-L6-v2"
+    assert second._provider_key != first._provider_key
+
+
+def test_pooled_logbert_cache_key_names_the_model(monkeypatch):
+    cached = _cached_pool_fn(monkeypatch, "logbert", "LOGBERT_MODEL_NAME", "bert-base-uncased")
+    assert cached._provider_key.endswith("::bert-base-uncased")
@@ -0,0 +1,66 @@
+from app.parsers.drain import DrainTemplateMiner
+
+
+def test_similar_lines_share_a_generalized_template():
+    miner = DrainTemplateMiner(depth=4, sim_threshold=0.4)
+    first_id, first = miner.add_content("session opened for user alice by root")
+    second_id, second = miner.add_content("session opened for user bob by root")
+
+    assert first_id == second_id
+    assert first == "session opened for user alice by root"
+    assert second == "session opened for user <*> by root"
+    assert miner.get(first_id).size == 2
+    assert len(miner) == 1
+
+
+def test_different_lengths_get_different_templates():
+    miner = DrainTemplateMiner()
+    a, _ = miner.add_content("disk sda failed")
+    b, _ = miner.add_content("disk sda failed with code 5")
+    assert a != b
+
+
+def test_ids_derive_from_seed_tokens_not_insertion_order():
+    one, two = DrainTemplateMiner(), DrainTemplateMiner()
+    one.add_content("link eth0 down")
+    id_one, _ = one.add_content("fan speed 1200 rpm")
+    id_two, _ = two.add_content("fan speed 1200 rpm")
+    assert id_one == id_two
+
+
+def test_match_content_does_not_mine():
+    miner = DrainTemplateMiner()
+    template_id, _ = miner.add_content("session opened for user alice by root")
+
+    assert miner.match_content("session opened for user bob by root") == (
+        template_id, "session opened for user alice by root",
+    )
+    assert miner.get(template_id).size == 1
+    assert miner.match_content("kernel panic at 0xdeadbeef") == (None, "kernel panic at <*>")
+    assert len(miner) == 1
+
+
+def test_snapshot_round_trip(tmp_path):
+    state = tmp_path / "drain.json"
+    miner = DrainTemplateMiner(state_path=str(state))
+    a_id, _ = miner.add_content("session opened for user alice by root")
+    miner.add_content("session opened for user bob by root")
+    b_id, b_text = miner.add_content("temperature 71 exceeds threshold on cpu0")
+    miner.save()
+
+    restored = DrainTemplateMiner(state_path=str(state))
+
+    assert len(restored) == 2
+    assert restored.get(a_id).tokens == miner.get(a_id).tokens
+    assert restored.get(a_id).size == 2
+    # The rebuilt tree routes new lines to the restored templates
+    assert restored.add_content("session opened for user carol by root")[0] == a_id
+    assert restored.add_content("temperature 85 exceeds threshold on cpu0") == (b_id, b_text)
+
+
+def test_snapshot_with_other_depth_is_ignored(tmp_path):
+    state = tmp_path / "drain.json"
+    miner = DrainTemplateMiner(depth=4, state_path=str(state))
+    miner.add_content("link eth0 down")
+    miner.save()
+    assert len(DrainTemplateMiner(depth=5, state_path=str(state))) == 0
@@ -0,0 +1,53 @@
+from app.services.llm_service import _split_batch_results
+
+ITEMS = [{"cluster_id": "a"}, {"cluster_id": "b"}, {"cluster_id": "c"}]
+
+
+def test_aligns_by_cluster_id_regardless_of_order():
+    result = {"results": [
+        {"cluster_id": "c", "failure_type": "network"},
+        {"cluster_id": "a", "failure_type": "disk"},
+        {"cluster_id": "b", "failure_type": "memory"},
+    ]}
+    out = _split_batch_results(result, ITEMS)
+    assert [entry["failure_type"] for entry in out] == ["disk", "memory", "network"]
+    # Routing fields are stripped from the per-item results
+    assert all("cluster_id" not in entry and "index" not in entry for entry in out)
+
+
+def test_falls_back_to_index_then_position():
+    by_index = _split_batch_results({"results": [{"index": 2, "failure_type": "power"}]}, ITEMS)
+    assert by_index == [None, None, {"failure_type": "power"}]
+
+    by_position = _split_batch_results([{"failure_type": "x"}, {"failure_type": "y"}, {"failure_type": "z"}], ITEMS)
+    assert [entry["failure_type"] for entry in by_position] == ["x", "y", "z"]
+
+
+def test_missing_items_are_none_and_never_shifted():
+    # Two answers for three items: position is ambiguous, so only identified items are used
+    result = {"results": [{"cluster_id": "b", "failure_type": "memory"}, {"failure_type": "unattributed"}]}
+    assert _split_batch_results(result, ITEMS) == [None, {"failure_type": "memory"}, None]
+
+
+def test_unparseable_response_leaves_every_item_unanswered():
+    assert _split_batch_results({"raw": "not json"}, ITEMS) == [None, None, None]
+    assert _split_batch_results("oops", ITEMS) == [None, None, None]
+
+
+def test_error_is_copied_to_every_item():
+    out = _split_batch_results({"error": "timeout", "_llm_metadata": {"tokens": 9}}, ITEMS)
+    assert [entry["error"] for entry in out] == ["timeout"] * 3
+
+
+def test_token_usage_is_split_across_answered_items():
+    result = {
+        "results": [{"cluster_id": "a"}, {"cluster_id": "b"}],
+        "_llm_metadata": {"prompt_tokens": 100, "completion_tokens": 40, "tokens": 140, "latency_ms": 5.0},
+    }
+    out = _split_batch_results(result, ITEMS)
+    assert out[2] is None
+    for entry in out[:2]:
+        meta = entry["_llm_metadata"]
+        assert (meta["prompt_tokens"], meta["completion_tokens"], meta["tokens"]) == (50, 20, 70)
+        assert meta["batch_size"] == 2
+        assert meta["latency_ms"] == 5.0
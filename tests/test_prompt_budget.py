@@ -0,0 +1,55 @@
+import pytest
+
+from app.core.config import settings
+from app.services import prompt_budget
+from app.services.prompt_budget import cap_prompt, estimate_tokens, fit_text, select_lines
+
+
+@pytest.fixture(autouse=True)
+def heuristic_tokens(monkeypatch):
+    # ~4 characters per token, independent of whether tiktoken is installed
+    monkeypatch.setattr(prompt_budget, "_encoder", None)
+    monkeypatch.setattr(prompt_budget, "_encoder_loaded", True)
+
+
+def _text(item):
+    return item["text"]
+
+
+def test_near_duplicates_are_dropped():
+    items = [{"text": "disk sda error at 100"}, {"text": "disk sda error at 200"}, {"text": "fan failure"}]
+    assert select_lines(items, _text, 1000, 10) == ["- disk sda error at 100", "- fan failure"]
+
+
+def test_priority_orders_lines_and_ties_keep_input_order():
+    items = [{"text": "a", "p": 1.0}, {"text": "b", "p": 5.0}, {"text": "c", "p": 1.0}]
+    assert select_lines(items, _text, 1000, 10, priority=lambda i: i["p"]) == ["- b", "- a", "- c"]
+
+
+def test_budget_and_item_limit_are_respected():
+    items = [{"text": f"line {chr(97 + i)} " + "x" * 36} for i in range(10)]  # 13 tokens each with "- " and newline
+    picked = select_lines(items, _text, 40, 10)
+    assert len(picked) == 3
+    assert sum(estimate_tokens(line[2:]) + 2 for line in picked) <= 40
+    assert len(select_lines(items, _text, 1000, 2)) == 2
+
+
+def test_long_lines_are_truncated_and_empty_lines_skipped(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROMPT_MAX_LINE_TOKENS", 10)
+    picked = select_lines([{"text": ""}, {"text": "y" * 400}], _text, 1000, 10)
+    assert picked == ["- " + "y" * 40 + " ..."]
+
+
+def test_fit_text_cuts_free_text_to_its_share(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROMPT_MAX_TOKENS", 1000)
+    assert fit_text("short", 0.1) == "short"
+    assert fit_text("z" * 4000, 0.1) == "z" * 400 + " ..."
+
+
+def test_cap_prompt_keeps_instructions_and_total_budget(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROMPT_MAX_TOKENS", 200)
+    instructions = "\nReturn JSON only.\n"
+    prompt = cap_prompt("system", "context " * 500, instructions)
+    assert prompt.endswith(instructions)
+    assert estimate_tokens("system") + estimate_tokens(prompt) <= 200
+    assert cap_prompt("system", "small body\n", instructions) == "small body\n" + instructions
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from app.services.quantile_sketch import DDSketch
+
+
+def _true_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize("alpha", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(alpha):
+    rng = random.Random(7)
+    values = [rng.lognormvariate(-2.0, 1.0) for _ in range(5000)]
+    sketch = DDSketch(relative_accuracy=alpha, min_value=1e-9)
+    for value in values:
+        sketch.add(value)
+    for q in (0.0, 0.25, 0.5, 0.9, 0.99, 1.0):
+        expected = _true_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= alpha * expected + 1e-12
+
+
+def test_values_below_min_value_land_in_zero_bin():
+    sketch = DDSketch(min_value=1e-3)
+    sketch.add(0.0, count=3)
+    sketch.add(1.0)
+    assert sketch.zero_count == 3
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(1.0, rel=0.01)
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert DDSketch().quantile(0.5) is None
+    assert DDSketch().quantiles([0.5, 0.99]) == {"p50": None, "p99": None}
+
+
+def test_merge_equals_sketch_of_all_values():
+    rng = random.Random(11)
+    left_values = [rng.uniform(0.0, 2.0) for _ in range(1000)]
+    right_values = [rng.uniform(0.5, 1.5) for _ in range(700)]
+    left, right, combined = DDSketch(), DDSketch(), DDSketch()
+    for value in left_values:
+        left.add(value)
+        combined.add(value)
+    for value in right_values:
+        right.add(value)
+        combined.add(value)
+
+    left.merge(right)
+
+    assert left.count == combined.count == 1700
+    assert left.zero_count == combined.zero_count
+    assert left.bins == combined.bins
+
+
+def test_merge_rejects_different_parameters():
+    with pytest.raises(ValueError):
+        DDSketch(relative_accuracy=0.01).merge(DDSketch(relative_accuracy=0.02))
+
+
+def test_fields_round_trip_through_redis_strings():
+    sketch = DDSketch()
+    for value in (0.0, 0.001, 0.2, 0.2, 0.7, 1.9):
+        sketch.add(value)
+    # Redis hands hash values back as strings
+    fields = {field: str(count) for field, count in sketch.to_fields().items()}
+
+    restored = DDSketch.from_fields(fields)
+
+    assert restored.bins == sketch.bins
+    assert restored.zero_count == sketch.zero_count
+    assert restored.count == sketch.count
+    assert restored.quantiles([0.5, 0.9]) == sketch.quantiles([0.5, 0.9])
+
+
+def test_from_fields_skips_unknown_and_malformed_fields():
+    restored = DDSketch.from_fields({"b10": "2", "bx": "4", "other": "9", "b11": "oops"})
+    assert restored.bins == {10: 2}
+    assert restored.count == 2
@@ -0,0 +1,41 @@
+import time
+
+from app.core.config import settings
+from app.streams import retention
+from app.streams.retention import parse_policies, xadd_args
+
+
+def test_parses_maxlen_and_minid_policies():
+    spec = " logs=maxlen:100000 , alerts=MINID:86400,metrics=maxlen:5e4 "
+    assert parse_policies(spec) == {
+        "logs": ("maxlen", 100000),
+        "alerts": ("minid", 86400),
+        "metrics": ("maxlen", 50000),
+    }
+
+
+def test_invalid_entries_are_skipped():
+    spec = "logs=maxlen:10,bad,alerts=ttl:5,metrics=maxlen:many,,issues=minid:60"
+    assert parse_policies(spec) == {"logs": ("maxlen", 10), "issues": ("minid", 60)}
+
+
+def test_empty_spec_has_no_policies():
+    assert parse_policies("") == {}
+
+
+def test_later_entries_override_earlier_ones():
+    assert parse_policies("logs=maxlen:10,logs=minid:30") == {"logs": ("minid", 30)}
+
+
+def test_xadd_args_scale_the_policy_by_headroom(monkeypatch):
+    monkeypatch.setattr(retention, "_policies", parse_policies("logs=maxlen:1000,alerts=minid:100"))
+    monkeypatch.setattr(settings, "STREAM_RETENTION_WRITE_HEADROOM", 2.0)
+
+    assert xadd_args("logs") == {"maxlen": 2000, "approximate": True}
+    assert xadd_args("unknown") == {}
+    minid = xadd_args("alerts")["minid"]
+    cutoff_ms = int(minid.split("-")[0])
+    assert abs(cutoff_ms - (time.time() - 200) * 1000) < 5000
+
+    monkeypatch.setattr(settings, "STREAM_RETENTION_WRITE_HEADROOM", 0.0)
+    assert xadd_args("logs") == {}
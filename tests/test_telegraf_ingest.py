@@ -0,0 +1,82 @@
+import asyncio
+import gzip
+import json
+import time
+
+import fakeredis.aioredis
+import pytest
+
+from app.core.config import settings
+from app.services.source_config_cache import get_source_config_cache
+from app.services.telegraf_ingest import (
+    TOKEN_INDEX_KEY,
+    TelegrafAgentIndex,
+    TokenIndexUnavailable,
+    _BUILT_FIELD,
+    decode_body,
+    token_hash,
+)
+
+
+def test_json_batch_and_single_metric():
+    batch = {"metrics": [{"name": "cpu", "tags": {"host": "h1"}, "fields": {"usage": 1.5}, "timestamp": 1}]}
+    assert decode_body(json.dumps(batch).encode(), "application/json", None) == batch["metrics"]
+    single = {"name": "mem", "tags": {}, "fields": {"used": 3}, "timestamp": 2}
+    assert decode_body(json.dumps(single).encode(), None, None) == [single]
+    assert decode_body(json.dumps([single]).encode(), None, None) == [single]
+
+
+def test_line_protocol_types_escapes_and_precision():
+    body = (
+        b"# comment\n"
+        b"disk,host=h1,path=/var\\ log used=42i,free=1.5,ok=true,label=\"a \\\"b\\\", c\" 1700000000000000000\n"
+        b"mem,host=h2 used=7u\n"
+    )
+    disk, mem = decode_body(body, "text/plain", None)
+    assert disk == {
+        "name": "disk",
+        "tags": {"host": "h1", "path": "/var log"},
+        "fields": {"used": 42, "free": 1.5, "ok": True, "label": 'a "b", c'},
+        "timestamp": 1700000000,
+    }
+    assert mem == {"name": "mem", "tags": {"host": "h2"}, "fields": {"used": 7}, "timestamp": None}
+
+
+def test_gzip_by_header_or_magic_bytes():
+    body = gzip.compress(b"cpu,host=h1 usage=1 1700000000")
+    for encoding in ("gzip", None):
+        (metric,) = decode_body(body, None, encoding)
+        assert metric["name"] == "cpu" and metric["timestamp"] == 1700000000
+
+
+def test_oversized_bodies_are_rejected(monkeypatch):
+    monkeypatch.setattr(settings, "TELEGRAF_MAX_BODY_BYTES", 64)
+    line = b"cpu,host=h1 usage=1\n" * 10
+    with pytest.raises(ValueError):
+        decode_body(line, None, None)
+    with pytest.raises(ValueError):
+        decode_body(gzip.compress(line), None, "gzip")
+
+
+def test_malformed_line_protocol_raises():
+    with pytest.raises(ValueError):
+        decode_body(b"cpu_without_fields", None, None)
+
+
+def test_unbuilt_index_is_unavailable_not_a_rejection(monkeypatch):
+    monkeypatch.setattr(get_source_config_cache(), "ensure_listener", lambda: None)
+
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        index = TelegrafAgentIndex(ttl_sec=60)
+        index._last_rebuild = time.monotonic()  # rebuild throttled
+        with pytest.raises(TokenIndexUnavailable):
+            await index.lookup(client, "secret")
+
+        agents = [{"id": 1, "name": "t1", "agent_id": "a1", "allowed_hosts": []}]
+        await client.hset(TOKEN_INDEX_KEY, mapping={_BUILT_FIELD: "1", token_hash("secret"): json.dumps(agents)})
+        assert (await index.lookup(client, "secret", "a1"))["id"] == 1
+        assert await index.lookup(client, "secret", "other-agent") is None
+        assert await index.lookup(client, "wrong") is None
+
+    asyncio.run(scenario())